@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+基准测试回归门禁
+将tests/benchmark_udfs.py的新结果与已提交的基线逐单元(函数, 规模, 并发)比较，存在回归时以退出码1结束。
+
+同一次运行内的延迟样本并不独立：整个单元可能恰好落在机器繁忙的时段，逐单元对样本做秩检验时，
+代码不变也会有十几个单元得到极小的p值。因此门禁的检验单位是单元而不是样本：
+1. 每个单元取各轮（--repeat）p50除以该轮校准耗时后的中位数，与基线相比得到对数比值；
+2. 以所有单元对数比值的中位数作为整体偏移、MAD作为噪声尺度，计算每个单元偏离整体的稳健z分数，
+   单侧p值经Holm校正控制全部单元的族错误率；
+3. 校正后p<alpha、中位数慢min_slowdown以上、绝对增量超过min_delta_ms，且（有多轮时）新结果每一轮都慢于基线每一轮，
+   才判定该单元回归；
+4. 整体偏移（所有单元比值的中位数）超过min_aggregate_slowdown时判定整体回归，覆盖所有单元同时变慢的情况。
+
+用法:
+    python tests/benchmark_udfs.py --sizes S,M --concurrency 1,4 --rows 50 --repeat 3 --output new.json
+    python scripts/benchmark_gate.py new.json
+    python scripts/benchmark_gate.py new.json --baseline tests/benchmark_baseline.json --alpha 0.01 --min-slowdown 0.25
+    python scripts/benchmark_gate.py new.json --update-baseline   # 接受新结果作为基线
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+from typing import Dict, List, Tuple
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "benchmark_baseline.json")
+
+# MAD换算为正态标准差的系数，以及噪声尺度的下限（对数比值，约5%），避免单元很少或结果完全相同时尺度为0
+MAD_SCALE = 1.4826
+MIN_NOISE_SCALE = 0.05
+
+
+def load_cells(path: str) -> Tuple[Dict, Dict[Tuple, Dict]]:
+    """读取基准结果，返回(meta, {(函数, 规模, 并发): 单元结果})"""
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    cells = {(r["function"], r["size"], r["concurrency"]): r for r in report.get("results", [])}
+    return report.get("meta", {}), cells
+
+
+def median(values: List[float]) -> float:
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def round_values(cell: Dict, normalize: bool) -> Tuple[List[float], float]:
+    """返回(单元各轮的p50, 换算回毫秒的系数)；normalize时各轮p50除以该轮校准耗时，单轮结果视为一轮"""
+    p50s = cell.get("repeat_p50_ms") or [median(cell["samples_ms"]) if cell.get("samples_ms") else cell["p50_ms"]]
+    calibrations = cell.get("repeat_calibration_ms") or [cell.get("calibration_ms")] * len(p50s)
+    if not normalize or not all(calibrations):
+        return list(p50s), 1.0
+    return [p50 / calibration for p50, calibration in zip(p50s, calibrations)], median(calibrations)
+
+
+def holm_adjust(p_values: List[float]) -> List[float]:
+    """Holm逐步校正，返回与输入顺序一致的校正后p值"""
+    order = sorted(range(len(p_values)), key=lambda i: p_values[i])
+    adjusted, running = [1.0] * len(p_values), 0.0
+    for rank, index in enumerate(order):
+        running = max(running, min(1.0, (len(p_values) - rank) * p_values[index]))
+        adjusted[index] = running
+    return adjusted
+
+
+def normal_tail(z: float) -> float:
+    return 0.5 * math.erfc(z / math.sqrt(2.0))
+
+
+def compare(base_cells: Dict, new_cells: Dict, alpha: float, min_slowdown: float, min_delta_ms: float, normalize: bool = True) -> List[Dict]:
+    rows, measured = [], []
+    for key in sorted(set(base_cells) | set(new_cells)):
+        base, new = base_cells.get(key), new_cells.get(key)
+        row = {"function": key[0], "size": key[1], "concurrency": key[2]}
+        rows.append(row)
+        if base is None or new is None:
+            row["status"] = "NEW" if base is None else "MISSING"
+            continue
+        (base_values, unit), (new_values, new_unit) = round_values(base, normalize), round_values(new, normalize)
+        if unit == 1.0 or new_unit == 1.0:
+            (base_values, unit), (new_values, _) = round_values(base, False), round_values(new, False)
+        base_stat, new_stat = median(base_values), median(new_values)
+        # unit把校准后的值换算回基线机器速度下的毫秒数，用于展示和绝对增量阈值
+        row.update({"base_p50_ms": round(base_stat * unit, 4), "new_p50_ms": round(new_stat * unit, 4),
+                    "ratio": round(new_stat / base_stat, 3) if base_stat > 0 else float("inf"),
+                    "rounds": min(len(base_values), len(new_values)),
+                    "slower_every_round": min(new_values) > max(base_values), "faster_every_round": max(new_values) < min(base_values),
+                    "base_p95_ms": base.get("p95_ms"), "new_p95_ms": new.get("p95_ms"),
+                    "base_errors": base.get("errors", 0), "new_errors": new.get("errors", 0), "status": "OK"})
+        if base_stat > 0 and new_stat > 0:
+            row["log_ratio"] = math.log(new_stat / base_stat)
+            measured.append(row)
+        if new.get("errors", 0) > base.get("errors", 0):
+            row["status"] = "REGRESSION"
+
+    if not measured:
+        return rows
+    logs = [row["log_ratio"] for row in measured]
+    center = median(logs)
+    scale = max(MAD_SCALE * median([abs(value - center) for value in logs]), MIN_NOISE_SCALE)
+    p_slower = holm_adjust([normal_tail((row["log_ratio"] - center) / scale) for row in measured])
+    p_faster = holm_adjust([normal_tail((center - row["log_ratio"]) / scale) for row in measured])
+    for row, slower, faster in zip(measured, p_slower, p_faster):
+        row.update({"shift": round(math.exp(center), 3), "noise": round(scale, 3)})
+        consistent_slower = row["rounds"] < 2 or row["slower_every_round"]
+        consistent_faster = row["rounds"] < 2 or row["faster_every_round"]
+        delta = row["new_p50_ms"] - row["base_p50_ms"]
+        if (slower < alpha and row["ratio"] >= 1.0 + min_slowdown and delta >= min_delta_ms and consistent_slower):
+            row["status"] = "REGRESSION"
+        elif (row["status"] == "OK" and faster < alpha and row["ratio"] <= 1.0 / (1.0 + min_slowdown)
+              and -delta >= min_delta_ms and consistent_faster):
+            row["status"] = "IMPROVED"
+        row["p_value"] = faster if row["status"] == "IMPROVED" else slower
+    return rows
+
+
+def aggregate_shift(rows: List[Dict]) -> float:
+    """所有单元比值的中位数（几何意义上的整体偏移），没有可比较的单元时返回1"""
+    logs = [row["log_ratio"] for row in rows if "log_ratio" in row]
+    return math.exp(median(logs)) if logs else 1.0
+
+
+def print_table(rows: List[Dict], show_all: bool):
+    marks = {"REGRESSION": "🔴", "IMPROVED": "🟢", "OK": "  ", "NEW": "🆕", "MISSING": "⚪"}
+    print(f"   {'函数':<34}{'规模':<6}{'并发':>4}{'基线p50':>10}{'新p50':>10}{'比值':>8}{'p值':>10}{'基线p95':>10}{'新p95':>10}  状态")
+    for row in rows:
+        if not show_all and row["status"] == "OK":
+            continue
+        if "ratio" not in row:
+            print(f"{marks[row['status']]} {row['function']:<34}{row['size']:<6}{row['concurrency']:>4}{'-':>10}{'-':>10}{'-':>8}{'-':>10}{'-':>10}{'-':>10}  {row['status']}")
+            continue
+        print(f"{marks[row['status']]} {row['function']:<34}{row['size']:<6}{row['concurrency']:>4}{row['base_p50_ms']:>10}{row['new_p50_ms']:>10}"
+              f"{row['ratio']:>8}{row.get('p_value', 1.0):>10.2g}{row['base_p95_ms']:>10}{row['new_p95_ms']:>10}  {row['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基准测试回归门禁（单元级稳健检验 + Holm校正）")
+    parser.add_argument("results", help="tests/benchmark_udfs.py输出的JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--alpha", type=float, default=0.01, help="Holm校正后的族错误率")
+    parser.add_argument("--min-slowdown", type=float, default=0.25, help="中位数涨幅阈值，0.25表示慢25%%以上才判定单元回归")
+    parser.add_argument("--min-aggregate-slowdown", type=float, default=0.15, help="所有单元整体偏移的阈值，0.15表示整体慢15%%以上判定回归")
+    parser.add_argument("--min-delta-ms", type=float, default=0.2, help="中位数绝对增量阈值（毫秒），过滤亚毫秒级噪声")
+    parser.add_argument("--all", action="store_true", help="同时列出无变化的单元")
+    parser.add_argument("--no-normalize", action="store_true", help="不按校准耗时缩放")
+    parser.add_argument("--update-baseline", action="store_true", help="用新结果覆盖基线")
+    args = parser.parse_args()
+
+    if args.update_baseline:
+        shutil.copyfile(args.results, args.baseline)
+        print(f"✅ 基线已更新: {args.baseline}")
+        return 0
+
+    base_meta, base_cells = load_cells(args.baseline)
+    new_meta, new_cells = load_cells(args.results)
+    print(f"📊 基线: {base_meta.get('git_commit')} ({base_meta.get('timestamp')})  新结果: {new_meta.get('git_commit')} ({new_meta.get('timestamp')})")
+    if base_meta.get("platform") != new_meta.get("platform") or base_meta.get("latency") != new_meta.get("latency"):
+        print("⚠️ 基线与新结果的运行平台或模拟延迟配置不同，比较结果仅供参考")
+    if min(base_meta.get("repeat", 1), new_meta.get("repeat", 1)) < 2:
+        print("⚠️ 基线或新结果只有一轮，无法检查各轮是否一致，单元级判定更容易受抖动影响；建议使用--repeat 3")
+
+    rows = compare(base_cells, new_cells, args.alpha, args.min_slowdown, args.min_delta_ms, not args.no_normalize)
+    shift = aggregate_shift(rows)
+    noise = next((row["noise"] for row in rows if "noise" in row), None)
+    print(f"⚙️ 整体偏移(新/基线，各单元比值中位数): {shift:.3f}  单元噪声尺度(对数比值): {noise}"
+          + ("，已按各轮校准耗时换算到基线机器速度" if not args.no_normalize else ""))
+    print_table(rows, args.all)
+
+    summary = {}
+    for row in rows:
+        summary[row["status"]] = summary.get(row["status"], 0) + 1
+    print("\n汇总: " + "  ".join(f"{status} {count}" for status, count in sorted(summary.items())))
+    failed = False
+    if shift >= 1.0 + args.min_aggregate_slowdown:
+        print(f"❌ 整体变慢 {shift:.3f} 倍，超过阈值 {1.0 + args.min_aggregate_slowdown:.2f}")
+        failed = True
+    if summary.get("REGRESSION"):
+        print(f"❌ 发现 {summary['REGRESSION']} 个显著变慢的单元")
+        flagged = sorted({row["function"] for row in rows if row["status"] == "REGRESSION"})
+        print(f"   确认时可只重跑这些函数: python tests/benchmark_udfs.py --functions {','.join(flagged)} "
+              f"--sizes {new_meta.get('sizes', 'S,M')} --concurrency {new_meta.get('concurrency', '1,4')} --rows {new_meta.get('rows')} "
+              f"--repeat {new_meta.get('repeat', 1)} --output rerun.json")
+        failed = True
+    if failed:
+        return 1
+    print("✅ 未发现显著的性能回归")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
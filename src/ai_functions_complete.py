@@ -7,6 +7,28 @@ ClickZetta AI Functions Complete Package
 import os
 import json
 import sys
+import re
+import math
+import random
+import unicodedata
+import zlib
+import io
+import hashlib
+import html
+import base64
+import tempfile
+import sqlite3
+import heapq
+from array import array
+from collections import OrderedDict
+import time
+import threading
+import contextvars
+import atexit
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 
 # 模拟装饰器（用于本地测试）
@@ -35,11 +57,2307 @@ try:
 except ImportError:
     HAS_DASHSCOPE = False
 
+# 图像预处理依赖（可选，缺失时相关优化自动降级）
+try:
+    import requests
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# ==================== 运行指标 ====================
+
+# 当前正在执行的UDF名称，由_instrument_udfs在evaluate入口设置，并发任务通过_run_concurrently继承
+_CURRENT_UDF = contextvars.ContextVar("aisql_current_udf", default="")
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class _MetricsRegistry(object):
+    """进程内指标注册表，计数器和直方图按(指标名, 标签)累计，导出为Prometheus文本格式"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = OrderedDict()  # 指标名 -> (类型, 说明)
+        self.counters = {}         # (指标名, 标签) -> 值
+        self.histograms = {}       # (指标名, 标签) -> [各桶计数..., 总和, 次数]
+        self.exported = 0.0
+
+    def describe(self, name, metric_type, text):
+        self.meta[name] = (metric_type, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            state = self.histograms.get(key)
+            if state is None:
+                state = self.histograms[key] = [0] * len(_LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(_LATENCY_BUCKETS):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, list(v)) for k, v in self.histograms.items())
+        lines = []
+        for name, (metric_type, text) in self.meta.items():
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (metric, labels), value in counters:
+                if metric == name:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+            for (metric, labels), state in histograms:
+                if metric != name:
+                    continue
+                for bound, count in zip(_LATENCY_BUCKETS, state):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {state[-1]}")
+                lines.append(f"{name}_sum{self._labels(labels)} {round(state[-2], 6)}")
+                lines.append(f"{name}_count{self._labels(labels)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """原子写入指标文件；路径中的{pid}替换为进程号，多进程部署时各自写一个文件"""
+        path = path.replace("{pid}", str(os.getpid()))
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+        self.exported = time.monotonic()
+
+    def maybe_export(self):
+        """设置了AISQL_METRICS_FILE时，距上次导出超过AISQL_METRICS_INTERVAL秒（默认10）则写入文件"""
+        path = os.environ.get("AISQL_METRICS_FILE")
+        if path and time.monotonic() - self.exported >= float(os.environ.get("AISQL_METRICS_INTERVAL", "10")):
+            try:
+                self.write_file(path)
+            except OSError:
+                pass
+
+_METRICS = _MetricsRegistry()
+_METRICS.describe("aisql_udf_calls_total", "counter", "UDF调用次数，status为ok或error")
+_METRICS.describe("aisql_udf_duration_seconds", "histogram", "UDF单次调用耗时")
+_METRICS.describe("aisql_api_requests_total", "counter", "DashScope接口请求次数，按状态码区分，exception表示请求抛出异常")
+_METRICS.describe("aisql_api_duration_seconds", "histogram", "DashScope接口请求耗时")
+_METRICS.describe("aisql_tokens_total", "counter", "response.usage中的token数，direction为input或output")
+_METRICS.describe("aisql_input_truncated_total", "counter", "提示词超出预算被截断的请求数")
+_METRICS.describe("aisql_rate_limit_wait_seconds", "histogram", "TPM限流等待时间")
+_METRICS.describe("aisql_queue_wait_seconds", "histogram", "并发任务从提交到开始执行的等待时间")
+_METRICS.describe("aisql_cache_requests_total", "counter", "本地缓存查询次数，result为hit或miss")
+_METRICS.describe("aisql_ocr_prefilter_total", "counter", "OCR文字预筛结果")
+_METRICS.describe("aisql_risk_prefilter_total", "counter", "风险文本本地预筛结果，action为pass（直接判定无风险）或flag（交给模型）")
+_METRICS.describe("aisql_sentiment_prescore_total", "counter", "情感分析本地预评分结果，action为local（直接返回）或model（交给模型）")
+_METRICS.describe("aisql_cascade_total", "counter", "级联路由结果，outcome为accepted或escalated，reason为升级原因")
+_METRICS.describe("aisql_estimated_cost_total", "counter", "按模型单价估算的费用（元），启用用量账本时记录")
+
+def _start_metrics_server(port, host="127.0.0.1"):
+    """在后台线程提供/metrics拉取接口，适用于常驻的UDF工作进程"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = _METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="aisql-metrics", daemon=True).start()
+    return server
+
+if os.environ.get("AISQL_METRICS_PORT"):
+    try:
+        _start_metrics_server(os.environ["AISQL_METRICS_PORT"], os.environ.get("AISQL_METRICS_HOST", "127.0.0.1"))
+    except OSError:
+        # 同一主机上的其他工作进程已占用端口
+        pass
+
+if os.environ.get("AISQL_METRICS_FILE"):
+    atexit.register(lambda: _METRICS.write_file(os.environ["AISQL_METRICS_FILE"]))
+
+# ==================== 用量账本 ====================
+
+# 模型估算单价（元），按最长前缀匹配模型名：input/output为每千token，image为每张图片；
+# 默认值仅作估算，以实际账单为准，可用AISQL_MODEL_PRICES（JSON字符串或JSON文件路径）覆盖或补充
+_MODEL_PRICES = {
+    "qwen-turbo": {"input": 0.0003, "output": 0.0006},
+    "qwen-plus": {"input": 0.0008, "output": 0.002},
+    "qwen-max": {"input": 0.0024, "output": 0.0096},
+    "qwen-long": {"input": 0.0005, "output": 0.002},
+    "qwen-vl-plus": {"input": 0.0015, "output": 0.0045},
+    "qwen-vl-max": {"input": 0.003, "output": 0.009},
+    "text-embedding": {"input": 0.0005},
+    "multimodal-embedding": {"input": 0.0007},
+    "deepseek": {"input": 0.002, "output": 0.008},
+}
+
+def _load_model_prices():
+    """内置单价合并AISQL_MODEL_PRICES；配置无法读取、不是JSON对象或单价不是非负数时发出警告并忽略对应部分"""
+    prices = dict(_MODEL_PRICES)
+    configured = os.environ.get("AISQL_MODEL_PRICES", "").strip()
+    if not configured:
+        return prices
+    try:
+        if not configured.startswith("{"):
+            with open(configured, "r", encoding="utf-8") as f:
+                configured = f.read()
+        overrides = json.loads(configured)
+    except (OSError, ValueError) as e:
+        warnings.warn(f"AISQL_MODEL_PRICES无法解析，使用内置单价: {e}", RuntimeWarning)
+        return prices
+    if not isinstance(overrides, dict):
+        warnings.warn("AISQL_MODEL_PRICES应为{模型名: {input/output/image: 单价}}形式的JSON对象，使用内置单价", RuntimeWarning)
+        return prices
+    for model_name, price in overrides.items():
+        valid = isinstance(price, dict) and all(
+            key in ("input", "output", "image") and isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+            for key, value in price.items())
+        if not valid:
+            warnings.warn(f"AISQL_MODEL_PRICES中{model_name}的单价无效，已忽略: {price!r}", RuntimeWarning)
+            continue
+        prices[model_name] = price
+    return prices
+
+def _count_images(kwargs):
+    """请求中的图片数：MultiModalConversation的messages内容项和MultiModalEmbedding的input项"""
+    items = []
+    for message in kwargs.get("messages") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, list):
+            items.extend(content)
+    request_input = kwargs.get("input")
+    items.extend(request_input if isinstance(request_input, list) else [request_input])
+    return sum(1 for item in items if isinstance(item, dict) and "image" in item)
+
+# 当前作业标签，由调用方通过_job_scope按调用设置，并发任务通过_run_concurrently继承；未设置时使用AISQL_JOB_TAG
+_CURRENT_JOB = contextvars.ContextVar("aisql_current_job", default="")
+
+def _job_tag():
+    return _CURRENT_JOB.get() or os.environ.get("AISQL_JOB_TAG", "")
+
+@contextmanager
+def _job_scope(tag):
+    """在with块内为账本记录指定作业标签，同一进程中不同线程/协程可以使用不同标签"""
+    token = _CURRENT_JOB.set(str(tag or ""))
+    try:
+        yield
+    finally:
+        _CURRENT_JOB.reset(token)
+
+class _UsageLedger(object):
+    """逐次记录DashScope请求的token、图片数和估算费用，缓冲后由后台线程定期写入SQLite或JSON Lines文件
+
+    同时按(作业, UDF)累计函数调用行数，便于计算每行成本。
+    """
+
+    def __init__(self, path, interval=5.0, max_buffer=1000):
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.use_sqlite = self.path.lower().endswith((".db", ".sqlite", ".sqlite3"))
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.prices = _load_model_prices()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.buffer = []
+        self.rows = {}
+        self.wakeup = threading.Event()
+        self.conn = None
+        self.thread = threading.Thread(target=self._run, name="aisql-ledger", daemon=True)
+        self.thread.start()
+
+    def price(self, model_name):
+        name = (model_name or "").lower()
+        matches = [key for key in self.prices if name.startswith(key)]
+        return self.prices[max(matches, key=len)] if matches else {}
+
+    def record(self, udf, api, model_name, status, request_id, input_tokens, output_tokens, images):
+        price = self.price(model_name)
+        cost = (input_tokens * price.get("input", 0.0) + output_tokens * price.get("output", 0.0)) / 1000.0 + images * price.get("image", 0.0)
+        entry = (time.time(), _job_tag(), udf, api, model_name, str(status), request_id or "",
+                 int(input_tokens), int(output_tokens), int(images), round(cost, 8))
+        with self.lock:
+            self.buffer.append(entry)
+            full = len(self.buffer) >= self.max_buffer
+        if full:
+            self.wakeup.set()
+        return cost
+
+    def count_row(self, udf):
+        key = (_job_tag(), udf)
+        with self.lock:
+            self.rows[key] = self.rows.get(key, 0) + 1
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self):
+        with self.lock:
+            entries, self.buffer = self.buffer, []
+            rows, self.rows = self.rows, {}
+        if not entries and not rows:
+            return
+        with self.write_lock:
+            if self.use_sqlite:
+                self._write_sqlite(entries, rows)
+            else:
+                self._write_jsonl(entries, rows)
+
+    _COLUMNS = ("ts", "job", "udf", "api", "model", "status", "request_id", "input_tokens", "output_tokens", "images", "cost")
+
+    def _write_jsonl(self, entries, rows):
+        lines = [json.dumps(dict(zip(self._COLUMNS, entry), type="call"), ensure_ascii=False) for entry in entries]
+        lines += [json.dumps({"type": "rows", "job": job, "udf": udf, "rows": count}, ensure_ascii=False) for (job, udf), count in rows.items()]
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _write_sqlite(self, entries, rows):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS usage_ledger (ts REAL, job TEXT, udf TEXT, api TEXT, model TEXT, status TEXT,
+                    request_id TEXT, input_tokens INTEGER, output_tokens INTEGER, images INTEGER, cost REAL);
+                CREATE TABLE IF NOT EXISTS usage_rows (job TEXT, udf TEXT, rows INTEGER, PRIMARY KEY (job, udf));
+                CREATE VIEW IF NOT EXISTS usage_summary AS
+                    SELECT c.job, c.udf, c.model, COUNT(*) AS requests, SUM(c.input_tokens) AS input_tokens,
+                           SUM(c.output_tokens) AS output_tokens, SUM(c.images) AS images, SUM(c.cost) AS cost,
+                           r.rows AS rows, SUM(c.cost) / NULLIF(r.rows, 0) AS cost_per_row
+                    FROM usage_ledger c LEFT JOIN usage_rows r ON r.job = c.job AND r.udf = c.udf
+                    GROUP BY c.job, c.udf, c.model;
+            """)
+        with self.conn:
+            self.conn.executemany(f"INSERT INTO usage_ledger VALUES ({','.join('?' * len(self._COLUMNS))})", entries)
+            self.conn.executemany("INSERT INTO usage_rows VALUES (?, ?, ?) ON CONFLICT(job, udf) DO UPDATE SET rows = rows + excluded.rows",
+                                  [(job, udf, count) for (job, udf), count in rows.items()])
+
+# 默认不记录；设置AISQL_LEDGER_FILE时启用（.db/.sqlite/.sqlite3写SQLite，其余写JSON Lines）
+_LEDGER = None
+if os.environ.get("AISQL_LEDGER_FILE"):
+    _LEDGER = _UsageLedger(os.environ["AISQL_LEDGER_FILE"], interval=float(os.environ.get("AISQL_LEDGER_INTERVAL", "5")))
+    atexit.register(_LEDGER.flush)
+
+# ==================== 调用追踪 ====================
+
+# 当前span，子阶段以其为父节点；并发任务通过_run_concurrently继承
+_CURRENT_SPAN = contextvars.ContextVar("aisql_current_span", default=None)
+
+class _Span(object):
+    """调用阶段的span，字段与OpenTelemetry span数据模型一致"""
+
+    def __init__(self, name, parent=None, kind="INTERNAL", attributes=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else "%032x" % random.getrandbits(128)
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = {"code": "UNSET"}
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = {"code": "ERROR", "message": str(message)}
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_span_id": self.parent_span_id, "name": self.name,
+                "kind": self.kind, "start_time_unix_nano": self.start_time, "end_time_unix_nano": self.end_time,
+                "attributes": self.attributes, "status": self.status, "resource": {"service.name": "clickzetta-aisql"}}
+
+class _NoopSpan(object):
+    """未启用追踪时使用，不记录任何内容"""
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class _JsonlSpanExporter(object):
+    """把结束的span逐行写入JSON Lines文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path.replace("{pid}", str(os.getpid())), "a", encoding="utf-8")
+            self.file.write(line)
+            self.file.flush()
+
+# 默认不导出（no-op）；设置AISQL_TRACE_FILE时写入JSON Lines文件
+_SPAN_EXPORTER = _JsonlSpanExporter(os.environ["AISQL_TRACE_FILE"]) if os.environ.get("AISQL_TRACE_FILE") else None
+
+@contextmanager
+def _span(name, kind="INTERNAL", **attributes):
+    """记录一个调用阶段；未启用导出时返回no-op span，开销可忽略"""
+    if _SPAN_EXPORTER is None:
+        yield _NOOP_SPAN
+        return
+    span = _Span(name, _CURRENT_SPAN.get(), kind, attributes)
+    token = _CURRENT_SPAN.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.set_error(e)
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        span.end_time = time.time_ns()
+        try:
+            _SPAN_EXPORTER.export(span)
+        except Exception:
+            pass
+
+def _dashscope_call(api, **kwargs):
+    """DashScope接口调用的统一入口，按(UDF, 接口, 模型, 状态码)记录请求数、耗时和token用量"""
+    labels = {"udf": _CURRENT_UDF.get(), "api": api.__name__, "model": kwargs.get("model", "")}
+    with _span(f"dashscope.{labels['api']}", kind="CLIENT", **{"gen_ai.system": "dashscope", "gen_ai.request.model": labels["model"]}) as span:
+        start = time.monotonic()
+        try:
+            response = api.call(**kwargs)
+        except Exception:
+            _METRICS.inc("aisql_api_requests_total", status_code="exception", **labels)
+            raise
+        finally:
+            _METRICS.observe("aisql_api_duration_seconds", time.monotonic() - start, **labels)
+        status_code = getattr(response, "status_code", "")
+        _METRICS.inc("aisql_api_requests_total", status_code=str(status_code), **labels)
+        input_tokens = _response_usage(response, "input_tokens")
+        output_tokens = _response_usage(response, "output_tokens")
+        if not input_tokens and not output_tokens:
+            # 向量接口只返回total_tokens
+            input_tokens = _response_usage(response, "total_tokens")
+        if input_tokens:
+            _METRICS.inc("aisql_tokens_total", input_tokens, udf=labels["udf"], model=labels["model"], direction="input")
+        if output_tokens:
+            _METRICS.inc("aisql_tokens_total", output_tokens, udf=labels["udf"], model=labels["model"], direction="output")
+        if _LEDGER is not None:
+            images = _count_images(kwargs)
+            cost = _LEDGER.record(labels["udf"], labels["api"], labels["model"], status_code, getattr(response, "request_id", None),
+                                  input_tokens, output_tokens, images)
+            _METRICS.inc("aisql_estimated_cost_total", cost, udf=labels["udf"], model=labels["model"])
+        span.set_attribute("http.response.status_code", status_code)
+        span.set_attribute("gen_ai.response.id", getattr(response, "request_id", None))
+        span.set_attribute("gen_ai.usage.input_tokens", input_tokens)
+        span.set_attribute("gen_ai.usage.output_tokens", output_tokens)
+        if status_code != HTTPStatus.OK:
+            span.set_error(getattr(response, "message", "") or getattr(response, "code", ""))
+        return response
+
+# ==================== 性能剖析 ====================
+
+class _StackSampler(object):
+    """采样剖析：后台线程按固定间隔抓取正在执行UDF的线程调用栈，累计为折叠栈（flamegraph.pl/speedscope格式）"""
+
+    def __init__(self, path, interval=0.005, flush_interval=30.0):
+        self.path = path
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.active = {}   # 线程id -> [(UDF名称, 栈底帧), ...]
+        self.counts = {}   # 折叠栈 -> 采样次数
+        self.thread = None
+        self.dirty = False
+
+    @contextmanager
+    def track(self, name, stop_frame, worker=False):
+        """标记当前线程正在执行UDF；采到的调用栈截止到stop_frame（不含）"""
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.active.setdefault(thread_id, []).append((name, stop_frame))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="aisql-profiler", daemon=True)
+                self.thread.start()
+        try:
+            yield
+        finally:
+            with self.lock:
+                entries = self.active[thread_id]
+                entries.pop()
+                if not entries:
+                    del self.active[thread_id]
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self):
+        with self.lock:
+            active = {thread_id: entries[0] for thread_id, entries in self.active.items()}
+        if not active:
+            return
+        frames = sys._current_frames()
+        for thread_id, (name, stop) in active.items():
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None and frame is not stop:
+                stack.append(self._frame_label(frame))
+                frame = frame.f_back
+            stack.append(name)
+            key = ";".join(reversed(stack))
+            with self.lock:
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.dirty = True
+
+    def _run(self):
+        flushed = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+                if self.dirty and time.monotonic() - flushed >= self.flush_interval:
+                    self.write_file()
+                    flushed = time.monotonic()
+            except Exception:
+                pass
+
+    def write_file(self):
+        """原子写入折叠栈文件，每行"帧;帧;...;帧 次数"；路径中的{pid}替换为进程号"""
+        with self.lock:
+            lines = [f"{stack} {count}" for stack, count in sorted(self.counts.items())]
+            self.dirty = False
+        path = self.path.replace("{pid}", str(os.getpid()))
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + ("\n" if lines else ""))
+        os.replace(temp_path, path)
+
+class _DeterministicProfiler(object):
+    """cProfile确定性剖析：串行执行最外层UDF调用并累计统计，进程退出时写出pstats文件，适合在模拟后端上离线运行"""
+
+    def __init__(self, path):
+        import cProfile
+        self.path = path
+        self.profile = cProfile.Profile()
+        self.lock = threading.RLock()
+        self.depth = 0
+
+    @contextmanager
+    def track(self, name, stop_frame, worker=False):
+        # 外层调用持锁等待并发任务，工作线程不能再取锁；Python 3.12以下工作线程的耗时不计入
+        if worker:
+            yield
+            return
+        with self.lock:
+            self.depth += 1
+            if self.depth == 1:
+                self.profile.enable()
+            try:
+                yield
+            finally:
+                if self.depth == 1:
+                    self.profile.disable()
+                self.depth -= 1
+
+    def write_file(self):
+        with self.lock:
+            self.profile.dump_stats(self.path.replace("{pid}", str(os.getpid())))
+
+def _create_profiler():
+    """AISQL_PROFILE=sample开启采样剖析（AISQL_PROFILE_INTERVAL毫秒，默认5），=cprofile开启确定性剖析；
+    输出路径AISQL_PROFILE_FILE，默认系统临时目录下aisql_profile_{pid}.folded/.prof"""
+    mode = os.environ.get("AISQL_PROFILE", "").strip().lower()
+    if mode not in ("sample", "cprofile"):
+        return None
+    suffix = "folded" if mode == "sample" else "prof"
+    path = os.environ.get("AISQL_PROFILE_FILE") or os.path.join(tempfile.gettempdir(), f"aisql_profile_{{pid}}.{suffix}")
+    if mode == "sample":
+        profiler = _StackSampler(path, interval=float(os.environ.get("AISQL_PROFILE_INTERVAL", "5")) / 1000.0)
+    else:
+        profiler = _DeterministicProfiler(path)
+    atexit.register(profiler.write_file)
+    return profiler
+
+_PROFILER = _create_profiler()
+
+@contextmanager
+def _profile(name, worker=False):
+    """UDF执行期间纳入剖析；未开启时无额外开销"""
+    if _PROFILER is None:
+        yield
+        return
+    # 调用栈截止到with语句所在的帧：0为本生成器，1为contextlib的__enter__
+    with _PROFILER.track(name, sys._getframe(2), worker):
+        yield
+
+def _instrument_udfs(namespace):
+    """为模块中所有UDF类的evaluate记录调用次数、耗时和错误，设置当前UDF名称并开启根span
+
+    SQL中在evaluate全部参数之后多传一个参数（或Python中传job_tag关键字参数）时，作为本次调用的作业标签。
+    """
+    def wrap(name, evaluate):
+        arg_count = evaluate.__code__.co_argcount - 1
+        def instrumented(self, *args, **kwargs):
+            job_tag = kwargs.pop("job_tag", None)
+            if len(args) == arg_count + 1:
+                args, job_tag = args[:-1], args[-1]
+            with _job_scope(job_tag) if job_tag else nullcontext():
+                return call(self, args, kwargs)
+        def call(self, args, kwargs):
+            token = _CURRENT_UDF.set(name)
+            if _LEDGER is not None:
+                _LEDGER.count_row(name)
+            start = time.monotonic()
+            status = "error"
+            try:
+                with _span(f"udf {name}", **{"aisql.udf": name}) as span, _profile(name):
+                    result = evaluate(self, *args, **kwargs)
+                    if isinstance(result, str) and result.startswith('{"error": true'):
+                        span.set_error(json.loads(result).get("message", ""))
+                    else:
+                        status = "ok"
+                return result
+            finally:
+                _METRICS.observe("aisql_udf_duration_seconds", time.monotonic() - start, udf=name)
+                _METRICS.inc("aisql_udf_calls_total", udf=name, status=status)
+                _CURRENT_UDF.reset(token)
+                _METRICS.maybe_export()
+        instrumented.__name__ = evaluate.__name__
+        instrumented.__doc__ = evaluate.__doc__
+        instrumented.__wrapped__ = evaluate
+        return instrumented
+
+    for name, value in list(namespace.items()):
+        if name.startswith("ai_") and isinstance(value, type) and "evaluate" in value.__dict__:
+            value.evaluate = wrap(name, value.__dict__["evaluate"])
+
+# ==================== 内部工具函数 ====================
+
+# CJK字符范围（中日韩统一表意文字、假名、谚文）
+_CJK_CHARS = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af'
+_UNIT_PATTERN = re.compile('[' + _CJK_CHARS + ']|[^\\W_' + _CJK_CHARS + ']+')
+
+def _text_units(text):
+    """将文本切分为基本单元：CJK按单字切分，字母和数字按连续词切分"""
+    normalized = unicodedata.normalize('NFKC', text or '').lower()
+    return _UNIT_PATTERN.findall(normalized)
+
+def _text_shingles(text, shingle_size=3):
+    """生成文本的shingle集合（连续shingle_size个单元）"""
+    units = _text_units(text)
+    if not units:
+        return set()
+    if len(units) <= shingle_size:
+        return {'\x1f'.join(units)}
+    return {'\x1f'.join(units[i:i + shingle_size]) for i in range(len(units) - shingle_size + 1)}
+
+def _jaccard(set1, set2):
+    if not set1 and not set2:
+        return 1.0
+    return len(set1 & set2) / float(len(set1 | set2))
+
+# 本地文本清洗规则：确定性操作无需调用模型，每条规则返回(文本, 改动次数)
+_HTML_BLOCK_PATTERN = re.compile(r'<(script|style)\b[^>]*>.*?</\1\s*>', re.I | re.S)
+_HTML_BREAK_PATTERN = re.compile(r'<br\s*/?>|</(?:p|div|li|tr|h[1-6])\s*>', re.I)
+_HTML_TAG_PATTERN = re.compile(r'<!--.*?-->|</?[A-Za-z][^<>]*>', re.S)
+_HTML_ENTITY_PATTERN = re.compile(r'&(?:#\d+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);')
+_CONTROL_CHAR_PATTERN = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\u200b-\u200f\u2028\u2029\ufeff]')
+_REPEATED_PUNCT_PATTERN = re.compile(r'([!?,;！？。，、；：~～])\1+')
+_INLINE_SPACE_PATTERN = re.compile('[ \t\u00a0\u3000]{2,}|[\t\u00a0\u3000]')
+_TRAILING_SPACE_PATTERN = re.compile(r'^ +| +$', re.M)
+_BLANK_LINES_PATTERN = re.compile(r'\n{3,}')
+# 中文字符或全角标点之间的空格
+_CJK_SPACE_PATTERN = re.compile('(?<=[' + _CJK_CHARS + '\u3001-\u303f\uff01-\uff5e]) (?=[' + _CJK_CHARS + '\u3001-\u303f\uff01-\uff5e])')
+_URL_PATTERN = re.compile(r'(?:https?://|www\.)[^\s<>"\'，。！？）】]+', re.I)
+_EMAIL_PATTERN = re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}')
+# 全角字母、数字、空格和常用符号转半角；中文标点（，。！？：；（）等）保持不变
+_FULLWIDTH_TABLE = {0x3000: 0x20}
+_FULLWIDTH_TABLE.update({code: code - 0xFEE0 for code in range(0xFF10, 0xFF1A)})
+_FULLWIDTH_TABLE.update({code: code - 0xFEE0 for code in range(0xFF21, 0xFF3B)})
+_FULLWIDTH_TABLE.update({code: code - 0xFEE0 for code in range(0xFF41, 0xFF5B)})
+_FULLWIDTH_TABLE.update({ord(c): ord(c) - 0xFEE0 for c in "＃＄％＆＊＋－／＜＝＞＠＾＿｀｜"})
+
+def _clean_remove_html(text):
+    text, blocks = _HTML_BLOCK_PATTERN.subn('', text)
+    text, breaks = _HTML_BREAK_PATTERN.subn('\n', text)
+    text, tags = _HTML_TAG_PATTERN.subn('', text)
+    entities = len(_HTML_ENTITY_PATTERN.findall(text))
+    if entities:
+        text = html.unescape(text)
+    return text, blocks + breaks + tags + entities
+
+def _clean_translate(text, table):
+    converted = text.translate(table)
+    return converted, sum(1 for a, b in zip(text, converted) if a != b)
+
+def _clean_fix_spacing(text):
+    text, inline = _INLINE_SPACE_PATTERN.subn(' ', text)
+    text, trailing = _TRAILING_SPACE_PATTERN.subn('', text)
+    text, blank = _BLANK_LINES_PATTERN.subn('\n\n', text)
+    text, cjk = _CJK_SPACE_PATTERN.subn('', text)
+    stripped = text.strip()
+    return stripped, inline + trailing + blank + cjk + int(stripped != text)
+
+def _clean_normalize_unicode(text):
+    normalized = unicodedata.normalize('NFKC', text)
+    return normalized, int(normalized != text)
+
+_CLEAN_RULES = OrderedDict([
+    ("remove_html", _clean_remove_html),
+    ("remove_control_chars", lambda text: _CONTROL_CHAR_PATTERN.subn('', text)),
+    ("normalize_unicode", _clean_normalize_unicode),
+    ("fullwidth_to_halfwidth", lambda text: _clean_translate(text, _FULLWIDTH_TABLE)),
+    ("remove_urls", lambda text: _URL_PATTERN.subn('', text)),
+    ("remove_emails", lambda text: _EMAIL_PATTERN.subn('', text)),
+    ("dedupe_punctuation", lambda text: _REPEATED_PUNCT_PATTERN.subn(r'\1', text)),
+    ("fix_spacing", _clean_fix_spacing),
+])
+# operations="all"时执行的本地规则；删除内容的规则（链接、邮箱）和NFKC需显式指定
+_CLEAN_DEFAULT_RULES = ("remove_html", "remove_control_chars", "fullwidth_to_halfwidth", "dedupe_punctuation", "fix_spacing")
+_CLEAN_ALIASES = {
+    "html": "remove_html", "去除html": "remove_html", "去html": "remove_html", "去除控制字符": "remove_control_chars",
+    "nfkc": "normalize_unicode", "unicode标准化": "normalize_unicode", "全角转半角": "fullwidth_to_halfwidth",
+    "去除链接": "remove_urls", "去除网址": "remove_urls", "去除邮箱": "remove_emails",
+    "标点去重": "dedupe_punctuation", "去重标点": "dedupe_punctuation", "空白规范化": "fix_spacing", "空格规范化": "fix_spacing",
+}
+
+def _split_clean_operations(operations):
+    """把operations拆分为(本地规则列表, 需要模型处理的语义操作列表)"""
+    local, semantic = [], []
+    for item in re.split(r'[,，、;；\s]+', str(operations or "all")):
+        if not item:
+            continue
+        key = _CLEAN_ALIASES.get(item.lower(), item.lower())
+        names = _CLEAN_DEFAULT_RULES if key == "all" else ((key,) if key in _CLEAN_RULES else ())
+        for name in names:
+            if name not in local:
+                local.append(name)
+        if not names and item not in semantic:
+            semantic.append(item)
+    return [name for name in _CLEAN_RULES if name in local], semantic
+
+def _clean_text_locally(text, rules):
+    """按固定顺序执行本地清洗规则，返回(清洗后文本, 实际生效的规则, 改动次数)"""
+    applied, changes = [], 0
+    text = text or ""
+    for name in rules:
+        text, count = _CLEAN_RULES[name](text)
+        if count:
+            applied.append(name)
+            changes += count
+    return text, applied, changes
+
+class _AhoCorasick(object):
+    """多模式串匹配自动机，一次扫描找出文本中所有词典词的出现位置（不区分大小写）"""
+
+    def __init__(self, patterns):
+        # patterns: {词: 附加信息}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for word, payload in patterns.items():
+            word = word.lower()
+            if not word:
+                continue
+            node = 0
+            for char in word:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append((word, payload))
+        # 广度优先构建失败指针，并合并后缀节点的输出
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """返回[(起点, 终点, 词, 附加信息)]"""
+        matches = []
+        node = 0
+        for index, char in enumerate((text or "").lower()):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for word, payload in self.output[node]:
+                matches.append((index - len(word) + 1, index + 1, word, payload))
+        return matches
+
+# 内置风险词典：类别 -> {词: 权重}；可用环境变量AISQL_RISK_LEXICON指定JSON文件覆盖或补充
+_RISK_LEXICON = {
+    "欺诈": {"刷单": 0.8, "返利": 0.5, "兼职日结": 0.6, "稳赚不赔": 0.8, "保本高收益": 0.8, "内幕消息": 0.6, "中奖": 0.4,
+           "领取奖金": 0.6, "验证码": 0.4, "安全账户": 0.9, "先交押金": 0.7, "贷款秒批": 0.7, "无抵押贷款": 0.6, "杀猪盘": 0.9,
+           "guaranteed returns": 0.8, "wire transfer": 0.4, "gift card": 0.4, "verify your account": 0.6, "investment opportunity": 0.4},
+    "赌博": {"博彩": 0.8, "赌场": 0.7, "百家乐": 0.8, "时时彩": 0.8, "六合彩": 0.8, "下注": 0.5, "菠菜": 0.5, "casino": 0.6, "betting": 0.5},
+    "色情": {"约炮": 0.9, "裸聊": 0.9, "一夜情": 0.7, "色情": 0.6, "porn": 0.8},
+    "暴力": {"杀了你": 0.8, "砍死": 0.8, "去死": 0.6, "知道你住哪": 0.7, "炸弹": 0.6, "枪支": 0.7, "弹药": 0.6, "爆炸物": 0.8, "kill you": 0.8},
+    "毒品": {"冰毒": 0.9, "大麻": 0.6, "海洛因": 0.9, "k粉": 0.8, "摇头丸": 0.9},
+    "违禁交易": {"代开发票": 0.8, "办证": 0.5, "假证": 0.8, "刻章": 0.5, "出售公民信息": 0.9, "身份证号": 0.3, "银行卡号": 0.3, "银行卡密码": 0.8},
+}
+# 本地放行时返回的固定置信度：词典未命中只说明没有已知风险词，不代表模型级别的判断
+_RISK_PREFILTER_CONFIDENCE = 0.9
+
+# 启发式信号：(类别, 正则, 权重)
+_RISK_HEURISTICS = [
+    ("引流", re.compile(r'加(?:微信|vx|v信|qq|薇|威)|(?:微信|vx|qq)[号:：]?\s*[A-Za-z0-9_-]{5,}', re.I), 0.25),
+    ("链接", _URL_PATTERN, 0.1),
+    ("电话", re.compile(r'(?<!\d)1[3-9]\d{9}(?!\d)'), 0.1),
+    ("金额", re.compile(r'\d+(?:\.\d+)?\s*(?:万元|万|元|块)|[¥￥$]\s*\d+'), 0.05),
+    ("催促", re.compile(r'[!！]{2,}|立即|马上|限时|名额有限', re.I), 0.05),
+]
+
+# 风险类型参数中英文名称到词典类别的映射
+_RISK_TYPE_ALIASES = {"fraud": "欺诈", "scam": "欺诈", "诈骗": "欺诈", "gambling": "赌博", "porn": "色情", "pornography": "色情",
+                      "sexual": "色情", "涉黄": "色情", "violence": "暴力", "drug": "毒品", "drugs": "毒品",
+                      "contraband": "违禁交易", "illegal_trade": "违禁交易"}
+_RISK_TYPE_SPLIT = re.compile(r'[\s,，、;；|/]+')
+
+_RISK_MATCHER = None
+_RISK_CATEGORIES = frozenset()
+_RISK_COVERS_ALL = False
+_RISK_MATCHER_LOCK = threading.Lock()
+_RISK_PREFILTER_STATS = {"passed": 0, "flagged": 0}
+
+def _risk_compact(text):
+    """匹配前的归一化：NFKC（全角转半角等）后去掉空白、标点和符号，返回(紧凑文本, 每个字符在原文中的下标)
+
+    用于识别“刷 单 日 结”“ＣＡＳＩＮＯ”这类插空格、换全角的规避写法。
+    """
+    chars, positions = [], []
+    for index, char in enumerate(text or ""):
+        for normalized in unicodedata.normalize('NFKC', char):
+            if unicodedata.category(normalized)[0] not in "ZPSC":
+                chars.append(normalized.lower())
+                positions.append(index)
+    return "".join(chars), positions
+
+def _risk_matcher():
+    """懒加载风险词典自动机；AISQL_RISK_LEXICON为JSON文件路径，格式同_RISK_LEXICON（词也可以是列表，权重默认0.6）
+
+    文件中"_covers_all": true表示该词典覆盖全部风险类型，此时risk_types为all也允许本地放行。
+    """
+    global _RISK_MATCHER, _RISK_CATEGORIES, _RISK_COVERS_ALL
+    if _RISK_MATCHER is None:
+        with _RISK_MATCHER_LOCK:
+            if _RISK_MATCHER is None:
+                lexicon = {category: dict(words) for category, words in _RISK_LEXICON.items()}
+                covers_all = False
+                path = os.environ.get("AISQL_RISK_LEXICON")
+                if path:
+                    with open(path, "r", encoding="utf-8") as f:
+                        for category, words in json.load(f).items():
+                            if category == "_covers_all":
+                                covers_all = bool(words)
+                                continue
+                            if isinstance(words, list):
+                                words = {word: 0.6 for word in words}
+                            lexicon.setdefault(category, {}).update(words)
+                patterns = {}
+                for category, words in lexicon.items():
+                    for word, weight in words.items():
+                        patterns[_risk_compact(word)[0]] = (category, float(weight))
+                _RISK_CATEGORIES = frozenset(lexicon)
+                _RISK_COVERS_ALL = covers_all
+                _RISK_MATCHER = _AhoCorasick(patterns)
+    return _RISK_MATCHER
+
+def _risk_types_covered(risk_types):
+    """risk_types中每个类型都属于风险词典类别时返回True（词典未命中才能代表模型判定无风险）
+
+    all包含自残、仇恨言论等词典没有的类型，只有词典声明_covers_all时才算覆盖。
+    """
+    _risk_matcher()
+    names = [name for name in _RISK_TYPE_SPLIT.split(str(risk_types or "").strip()) if name]
+    if not names or any(name.lower() in ("all", "全部") for name in names):
+        return _RISK_COVERS_ALL
+    return all(_RISK_TYPE_ALIASES.get(name.lower(), name) in _RISK_CATEGORIES for name in names)
+
+def _risk_prefilter(text, threshold, risk_types="all"):
+    """本地风险预筛，返回(是否放行, 预筛信息)
+
+    词典没有命中且启发式得分低于threshold时放行（直接判定无风险），否则带命中片段交给模型；
+    risk_types包含词典未覆盖的类型时不放行，只把命中片段作为提示。
+    """
+    covered = _risk_types_covered(risk_types)
+    compact, positions = _risk_compact(text)
+    hits = [(positions[start], positions[end - 1] + 1, word, payload) for start, end, word, payload in _risk_matcher().find(compact)]
+    # 启发式同时在NFKC文本和紧凑文本上匹配：链接、连续感叹号依赖标点，拆开的手机号、联系方式只在紧凑文本中完整
+    normalized = unicodedata.normalize('NFKC', text or "")
+    signals, heuristic_score = [], 0.0
+    for name, pattern, weight in _RISK_HEURISTICS:
+        count = max(len(pattern.findall(normalized)), len(pattern.findall(compact)))
+        if count:
+            signals.append(name)
+            heuristic_score += weight * min(count, 3)
+    lexicon_score = sum(weight for _, _, _, (_, weight) in hits)
+    score = round(min(1.0, lexicon_score + heuristic_score), 4)
+    passed = covered and not hits and heuristic_score < float(threshold)
+    with _RISK_MATCHER_LOCK:
+        _RISK_PREFILTER_STATS["passed" if passed else "flagged"] += 1
+        stats = dict(_RISK_PREFILTER_STATS)
+    _METRICS.inc("aisql_risk_prefilter_total", action="pass" if passed else "flag")
+    matches = [{"text": text[start:end], "start": start, "end": end, "category": category}
+               for start, end, _, (category, _) in hits[:20]]
+    return passed, {"score": score, "matches": matches, "signals": signals, "action": "pass" if passed else "model",
+                    "risk_types_covered": covered, "stats": stats}
+
+# 情感词典：词 -> (极性得分, 情绪)；得分0的词用于屏蔽误匹配（如“好像”中的“好”），
+# 以及退款、退货这类本身不带倾向的售后名词（“没有退款”被否定词翻转后会误判为正面）
+_SENTIMENT_LEXICON = {}
+for _words, _score, _emotion in [
+    ("好 好用 好看 好吃 不错 满意 喜欢 推荐 值得 超值 划算 实惠 方便 流畅 清晰 舒服 舒适 耐用 精美 漂亮 完美 优秀 出色 给力 靠谱 专业 及时 耐心 贴心 周到 稳定 省心 惊艳 物美价廉 性价比高 没问题", 1.0, "joy"),
+    ("开心 高兴 愉快 惊喜 感谢 谢谢 点赞 赞 棒 爱了 太棒了", 1.2, "joy"),
+    ("差 差劲 垃圾 糟糕 失望 后悔 坏 坏了 难用 难吃 难看 卡顿 模糊 粗糙 劣质 坑 坑人 骗人 假货 破损 故障 不值 贵 慢 吵 异味 掉色 起球 漏水 发热 闪退 死机 敷衍 拖延 问题", -1.0, "sadness"),
+    ("生气 愤怒 气死 恶心 无语 投诉 离谱 忽悠 态度恶劣 服务差 太差", -1.3, "anger"),
+    ("担心 害怕 不安 焦虑", -0.8, "fear"),
+    ("good great excellent amazing awesome perfect love loved like nice happy satisfied recommend recommended fast smooth reliable comfortable beautiful worth helpful friendly easy", 1.0, "joy"),
+    ("bad poor terrible awful horrible worst hate hated broken slow disappointed disappointing useless cheap defective late damaged noisy expensive", -1.0, "sadness"),
+    ("angry furious scam rude ridiculous", -1.3, "anger"),
+    ("快 很快 速度快", 0.6, "joy"),
+    ("好像 好多 只好 好几 好在 最好 好奇 快递 快要 快点 问题不大", 0.0, None),
+    ("退货 退款 退换 refund refunded return returned", 0.0, None),
+    # 以否定字开头的普通词，避免其中的“无/未/非/别/不/没”被当作否定词
+    ("无线 无人 无论 无糖 无限 无需 无忧 无缝 无损 未拆封 未开封 未来 别人 别的 别说 非得 非要 不仅 不但 不管 不论 不断 不久 不得不 没想到 毫不犹豫", 0.0, None),
+]:
+    for _word in _words.split():
+        _SENTIMENT_LEXICON[_word] = (_score, _emotion)
+_SENTIMENT_LEXICON["问题不大"] = (0.6, "joy")
+_NEGATION_WORDS = "不 没 没有 无 非 未 别 不是 并不 从不 毫不 不太 不怎么 not no never don't doesn't didn't isn't wasn't aren't can't won't hardly".split()
+# 否定词只作用于紧随其后的情感词：两者之间除程度副词和空白外最多相隔的字符数
+_NEGATION_WINDOW = 2
+_DEGREE_WORDS = {"非常": 1.8, "特别": 1.8, "极其": 2.0, "超级": 1.8, "十分": 1.6, "太": 1.6, "超": 1.6, "很": 1.5, "挺": 1.3, "真": 1.3, "比较": 1.2,
+                 "有点": 0.7, "有些": 0.7, "稍微": 0.6, "略": 0.6, "very": 1.5, "really": 1.4, "extremely": 2.0, "so": 1.4, "too": 1.3,
+                 "super": 1.6, "quite": 1.2, "pretty": 1.2, "slightly": 0.6, "somewhat": 0.7, "a bit": 0.7}
+_CLAUSE_PATTERN = re.compile(r'[，。！？；,.!?;\n]+')
+_CONTRAST_PATTERN = re.compile(r'但是|但|可是|不过|然而|\bbut\b|\bhowever\b', re.I)
+_CONTRAST_WEIGHTS = (0.7, 1.5)  # 最后一个转折词之前、之后的权重
+_SENTIMENT_MATCHER = None
+
+def _sentiment_matcher():
+    global _SENTIMENT_MATCHER
+    if _SENTIMENT_MATCHER is None:
+        patterns = {word: ("sentiment",) + value for word, value in _SENTIMENT_LEXICON.items()}
+        patterns.update({word: ("negation",) for word in _NEGATION_WORDS})
+        patterns.update({word: ("degree", weight) for word, weight in _DEGREE_WORDS.items()})
+        # “不太”“不怎么”按弱化否定处理，优先于单独的“不”和“太”
+        patterns.update({"不太": ("weak_negation",), "不怎么": ("weak_negation",), "not very": ("weak_negation",), "not so": ("weak_negation",)})
+        _SENTIMENT_MATCHER = _AhoCorasick(patterns)
+    return _SENTIMENT_MATCHER
+
+def _sentiment_tokens(text):
+    """词典匹配取最左最长且不重叠的结果；英文词要求两侧不是字母"""
+    tokens, end = [], 0
+    for start, stop, word, payload in sorted(_sentiment_matcher().find(text), key=lambda m: (m[0], m[0] - m[1])):
+        if start < end:
+            continue
+        if word[0].isascii() and word[0].isalpha():
+            if (start > 0 and text[start - 1].isascii() and text[start - 1].isalpha()) or (stop < len(text) and text[stop].isascii() and text[stop].isalpha()):
+                continue
+        tokens.append((start, stop, payload))
+        end = stop
+    return tokens
+
+def _lexicon_sentiment(text):
+    """基于词典的情感打分，处理否定词、程度副词和转折，返回与模型一致的结果结构和本地置信度"""
+    text = text or ""
+    positive = negative = 0.0
+    emotions, keywords = [], []
+    # 转折之后的部分权重更高，之前的降低；标点分句限定否定词和程度副词的作用范围
+    contrasts = list(_CONTRAST_PATTERN.finditer(text))
+    parts = [(text[:contrasts[-1].start()], _CONTRAST_WEIGHTS[0]), (text[contrasts[-1].end():], _CONTRAST_WEIGHTS[1])] if contrasts else [(text, 1.0)]
+    clauses = [(clause, weight) for part, weight in parts for clause in _CLAUSE_PATTERN.split(part) if clause.strip()]
+    for clause, clause_weight in clauses:
+        negation, weak_negation, degree, negation_end = False, False, 1.0, 0
+        for start, stop, payload in _sentiment_tokens(clause):
+            kind = payload[0]
+            # 否定词与当前词之间隔得太远时不再生效（如“无线耳机非常好用”中的“无”）
+            near = len(re.sub(r'\s+', '', clause[negation_end:start])) <= _NEGATION_WINDOW
+            if (negation or weak_negation) and not near:
+                negation, weak_negation = False, False
+            if kind == "negation":
+                negation = not negation
+                negation_end = stop
+            elif kind == "weak_negation":
+                weak_negation, negation_end = True, stop
+            elif kind == "degree":
+                degree *= payload[1]
+                if negation or weak_negation:
+                    negation_end = stop
+            elif not payload[1]:
+                # 屏蔽词消耗掉前面的否定词和程度副词，避免作用到后面的情感词
+                negation, weak_negation, degree = False, False, 1.0
+            else:
+                score = payload[1] * degree * clause_weight
+                if weak_negation:
+                    score *= -0.5
+                elif negation:
+                    score *= -0.8
+                if score > 0:
+                    positive += score
+                else:
+                    negative -= score
+                word = clause[start:stop]
+                if word not in keywords:
+                    keywords.append(word)
+                emotion = payload[2] if score * payload[1] > 0 else None
+                if emotion and emotion not in emotions:
+                    emotions.append(emotion)
+                negation, weak_negation, degree = False, False, 1.0
+    total = positive + negative
+    if total == 0:
+        return {"sentiment": "neutral", "confidence": 0.5, "emotions": [], "keywords": []}, 0.0
+    polarity = (positive - negative) / total
+    strength = 1.0 - math.exp(-total / 1.5)
+    confidence = round(0.5 + 0.5 * abs(polarity) * strength, 3)
+    sentiment = "positive" if polarity > 0.2 else "negative" if polarity < -0.2 else "neutral"
+    return {"sentiment": sentiment, "confidence": confidence, "emotions": emotions, "keywords": keywords[:5]}, confidence
+
+# 本地情感预评分只用于短文本，长文本交给模型
+_SENTIMENT_MAX_LOCAL_CHARS = 300
+_SENTIMENT_PRESCORE_STATS = {"local": 0, "model": 0}
+_SENTIMENT_PRESCORE_LOCK = threading.Lock()
+
+def _sentiment_prescore(text, min_confidence):
+    """返回(本地结果或None, 预评分信息)；置信度不低于min_confidence的短文本直接采用本地结果"""
+    result, confidence = _lexicon_sentiment(text) if len(text or "") <= _SENTIMENT_MAX_LOCAL_CHARS else (None, 0.0)
+    action = "local" if result is not None and confidence >= float(min_confidence) else "model"
+    with _SENTIMENT_PRESCORE_LOCK:
+        _SENTIMENT_PRESCORE_STATS[action] += 1
+        stats = dict(_SENTIMENT_PRESCORE_STATS)
+    _METRICS.inc("aisql_sentiment_prescore_total", action=action)
+    return (result if action == "local" else None), {"local_confidence": confidence, "action": action, "stats": stats}
+
+# MinHash使用 (a*x+b) mod p 的置换族，种子固定以保证跨进程签名一致
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_MAX = (1 << 32) - 1
+
+@lru_cache(maxsize=8)
+def _minhash_permutations(num_perm):
+    rng = random.Random(1)
+    return tuple((rng.randint(1, _MINHASH_PRIME - 1), rng.randint(0, _MINHASH_PRIME - 1)) for _ in range(num_perm))
+
+def _minhash_signature(shingles, num_perm=128):
+    """计算shingle集合的MinHash签名"""
+    if not shingles:
+        return [_MINHASH_MAX] * num_perm
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles]
+    return [min(((a * h + b) % _MINHASH_PRIME) & _MINHASH_MAX for h in hashes)
+            for a, b in _minhash_permutations(num_perm)]
+
+def _minhash_similarity(sig1, sig2):
+    """根据两个MinHash签名估计Jaccard相似度"""
+    if not sig1 or len(sig1) != len(sig2):
+        return 0.0
+    return sum(1 for a, b in zip(sig1, sig2) if a == b) / float(len(sig1))
+
+@lru_cache(maxsize=64)
+def _lsh_params(threshold, num_perm):
+    """选择使误报与漏报面积之和最小的分段参数(bands, rows)"""
+    def collision_probability(s, bands, rows):
+        return 1.0 - (1.0 - s ** rows) ** bands
+
+    def area(f, lower, upper, steps=50):
+        width = (upper - lower) / steps
+        return sum(f(lower + (i + 0.5) * width) for i in range(steps)) * width
+
+    best, best_error = (1, num_perm), None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positive = area(lambda s: collision_probability(s, bands, rows), 0.0, threshold)
+            false_negative = area(lambda s: 1.0 - collision_probability(s, bands, rows), threshold, 1.0)
+            error = false_positive + false_negative
+            if best_error is None or error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+def _lsh_band_keys(signature, bands, rows):
+    """将签名分段并生成稳定的分桶键，可直接用于SQL中GROUP BY/JOIN"""
+    keys = []
+    for band in range(bands):
+        chunk = signature[band * rows:(band + 1) * rows]
+        digest = zlib.crc32(','.join(str(v) for v in chunk).encode('ascii'))
+        keys.append(f"b{band:02d}_{digest:08x}")
+    return keys
+
+_CJK_UNIT_PATTERN = re.compile('[' + _CJK_CHARS + ']')
+
+def _search_terms(text):
+    """检索分词：英文/数字按词，连续CJK字符按二元组（单字片段保留单字）"""
+    terms, cjk_run = [], []
+
+    def flush():
+        if len(cjk_run) == 1:
+            terms.append(cjk_run[0])
+        else:
+            terms.extend(cjk_run[i] + cjk_run[i + 1] for i in range(len(cjk_run) - 1))
+        del cjk_run[:]
+
+    for unit in _text_units(text):
+        if _CJK_UNIT_PATTERN.match(unit):
+            cjk_run.append(unit)
+        else:
+            flush()
+            terms.append(unit)
+    flush()
+    return terms
+
+class _BM25Index(object):
+    """轻量BM25倒排索引，查询时只对命中词项的文档打分"""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1, self.b = k1, b
+        self.postings = {}
+        self.doc_lengths = []
+        for doc_index, text in enumerate(texts):
+            terms = _search_terms(text)
+            self.doc_lengths.append(len(terms))
+            frequencies = {}
+            for term in terms:
+                frequencies[term] = frequencies.get(term, 0) + 1
+            for term, tf in frequencies.items():
+                self.postings.setdefault(term, []).append((doc_index, tf))
+        self.doc_count = len(self.doc_lengths)
+        self.avg_length = (sum(self.doc_lengths) / float(self.doc_count)) if self.doc_count else 0.0
+
+    def top_n(self, query, n):
+        """返回[(文档下标, 分数)]，按分数降序，只包含有词项命中的文档"""
+        scores = {}
+        for term in set(_search_terms(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1.0 + (self.doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, tf in postings:
+                norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[doc_index] / (self.avg_length or 1.0))
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1.0) / (tf + norm)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n]
+
+# 各模型族的token估算系数：每个CJK字符、英文字母、数字、其他符号对应的token数
+# （空白通常与相邻单词合并，不单独计数）
+_TOKEN_RATIOS = {
+    "qwen": {"cjk": 0.7, "alpha": 0.25, "digit": 1.0, "other": 0.5},
+    "deepseek": {"cjk": 0.6, "alpha": 0.25, "digit": 0.34, "other": 0.5},
+    "default": {"cjk": 1.0, "alpha": 0.3, "digit": 0.5, "other": 0.6},
+}
+_ALPHA_PATTERN = re.compile(r'[A-Za-z]')
+_DIGIT_PATTERN = re.compile(r'[0-9]')
+_SPACE_PATTERN = re.compile(r'\s')
+
+# 模型上下文长度与最大输出token数，按最长前缀匹配模型名
+_MODEL_LIMITS = {
+    "qwen-turbo": (1000000, 8192),
+    "qwen-plus": (131072, 8192),
+    "qwen-max": (32768, 8192),
+    "qwen-long": (10000000, 8192),
+    "deepseek": (65536, 8192),
+}
+_DEFAULT_MODEL_LIMITS = (32768, 2048)
+
+def _model_family(model_name):
+    name = (model_name or "").lower()
+    if name.startswith(("qwen", "qwq", "qvq")):
+        return "qwen"
+    if name.startswith("deepseek"):
+        return "deepseek"
+    return "default"
+
+def _model_limits(model_name):
+    """返回(上下文token数, 最大输出token数)"""
+    name = (model_name or "").lower()
+    matches = [key for key in _MODEL_LIMITS if name.startswith(key)]
+    return _MODEL_LIMITS[max(matches, key=len)] if matches else _DEFAULT_MODEL_LIMITS
+
+def _estimate_tokens(text, model_name="qwen-plus"):
+    """按模型族估算文本token数，不依赖分词器"""
+    if not text:
+        return 0
+    ratios = _TOKEN_RATIOS[_model_family(model_name)]
+    cjk = len(_CJK_UNIT_PATTERN.findall(text))
+    alpha = len(_ALPHA_PATTERN.findall(text))
+    digit = len(_DIGIT_PATTERN.findall(text))
+    other = len(text) - cjk - alpha - digit - len(_SPACE_PATTERN.findall(text))
+    return int(cjk * ratios["cjk"] + alpha * ratios["alpha"] + digit * ratios["digit"] + other * ratios["other"]) + 1
+
+def _estimate_message_tokens(messages, model_name="qwen-plus"):
+    """估算消息列表的token数，每条消息额外计入格式开销"""
+    total = 3
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += _estimate_tokens(content, model_name)
+        elif isinstance(content, list):
+            total += sum(_estimate_tokens(item.get("text", ""), model_name) for item in content if isinstance(item, dict))
+        total += 4
+    return total
+
+def _input_token_budget(model_name, max_tokens=None):
+    """可用于提示词的token预算：上下文长度扣除输出预留，可用环境变量AISQL_MAX_INPUT_TOKENS进一步收紧"""
+    context_tokens, output_tokens = _model_limits(model_name)
+    budget = context_tokens - int(max_tokens or output_tokens)
+    configured = int(os.environ.get("AISQL_MAX_INPUT_TOKENS", "0") or 0)
+    if configured > 0:
+        budget = min(budget, configured)
+    return max(budget, 1)
+
+def _truncate_middle(text, max_tokens, model_name="qwen-plus"):
+    """截断超出预算的文本，保留开头和结尾（合同签署、简历联系方式等常在末尾）"""
+    tokens = _estimate_tokens(text, model_name)
+    if tokens <= max_tokens:
+        return text
+    marker = "\n……（中间内容过长已省略）……\n"
+    keep = int(len(text) * max_tokens / float(tokens))
+    while keep > 0:
+        head = keep * 3 // 4
+        truncated = text[:head] + marker + text[len(text) - (keep - head):]
+        if _estimate_tokens(truncated, model_name) <= max_tokens:
+            return truncated
+        keep = int(keep * 0.9)
+    return text[:max(max_tokens, 1)]
+
+def _fit_messages_to_budget(messages, model_name, max_tokens=None):
+    """提示词超出预算时截断最后一条用户消息，返回(消息列表, 提示词token数, 是否截断)"""
+    budget = _input_token_budget(model_name, max_tokens)
+    prompt_tokens = _estimate_message_tokens(messages, model_name)
+    if prompt_tokens <= budget or not messages or not isinstance(messages[-1].get("content"), str):
+        return messages, prompt_tokens, False
+    last = messages[-1]
+    allowed = budget - (prompt_tokens - _estimate_tokens(last["content"], model_name))
+    fitted = messages[:-1] + [dict(last, content=_truncate_middle(last["content"], max(allowed, 1), model_name))]
+    return fitted, _estimate_message_tokens(fitted, model_name), True
+
+class _TokenRateLimiter(object):
+    """按每分钟token数(TPM)限流的令牌桶，tokens_per_minute<=0时不限流"""
+
+    def __init__(self, tokens_per_minute=0):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens):
+        """阻塞直到可发送tokens个token，返回等待秒数"""
+        if self.capacity <= 0:
+            return 0.0
+        tokens = min(float(tokens), self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return waited
+                delay = (tokens - self.available) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def consume(self, tokens):
+        """记入事后才知道的token消耗（如输出token），允许余额暂时为负"""
+        if self.capacity <= 0 or tokens <= 0:
+            return
+        with self.lock:
+            self._refill()
+            self.available -= tokens
+
+_TPM_LIMITER = _TokenRateLimiter(int(os.environ.get("AISQL_TPM_LIMIT", "0") or 0))
+
+# 切分点：中文句末标点与换行之后，英文句末标点且后跟空白处
+_SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？；…\n])|(?<=[.!?;])(?=\s)')
+
+def _split_sentences(text):
+    """按句子和段落边界切分文本，各片段首尾相接即为原文，适用于中英文混排"""
+    sentences = []
+    for piece in _SENTENCE_END_PATTERN.split(text or ''):
+        if not piece:
+            continue
+        if sentences and not piece.strip():
+            sentences[-1] += piece
+        else:
+            sentences.append(piece)
+    return sentences
+
+def _chunk_text(text, max_tokens=3000, overlap_tokens=200, model_name="qwen-plus"):
+    """按句子边界将文本打包为不超过max_tokens的分块，相邻分块保留约overlap_tokens的重叠"""
+    pieces = []
+    for sentence in _split_sentences(text):
+        tokens = _estimate_tokens(sentence, model_name)
+        if tokens <= max_tokens:
+            pieces.append((sentence, tokens))
+            continue
+        # 超长句子按字符硬切分
+        step = max(1, int(len(sentence) * max_tokens / float(tokens)))
+        for start in range(0, len(sentence), step):
+            part = sentence[start:start + step]
+            pieces.append((part, _estimate_tokens(part, model_name)))
+
+    chunks, current, current_tokens = [], [], 0
+    for piece, tokens in pieces:
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(''.join(p for p, _ in current).strip())
+            overlap, overlap_total = [], 0
+            for previous in reversed(current):
+                if overlap_total + previous[1] > overlap_tokens or overlap_total + previous[1] + tokens > max_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_total += previous[1]
+            current, current_tokens = overlap, overlap_total
+        current.append((piece, tokens))
+        current_tokens += tokens
+    if current:
+        chunks.append(''.join(p for p, _ in current).strip())
+    return chunks
+
+def _run_concurrently(func, items, max_workers=4):
+    """并发执行func(item)，结果顺序与items一致；工作线程继承调用方的上下文（当前UDF等）"""
+    items = list(items)
+    if len(items) <= 1 or int(max_workers) <= 1:
+        return [func(item) for item in items]
+    context = contextvars.copy_context()
+    udf = _CURRENT_UDF.get()
+
+    def run(task):
+        submitted, item = task
+        _METRICS.observe("aisql_queue_wait_seconds", time.monotonic() - submitted, udf=udf)
+        with _profile(udf, worker=True):
+            return context.copy().run(func, item)
+
+    with ThreadPoolExecutor(max_workers=min(int(max_workers), len(items))) as executor:
+        return list(executor.map(run, [(time.monotonic(), item) for item in items]))
+
+def _response_usage(response, key):
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        return usage.get(key) or 0
+    try:
+        return usage[key] or 0
+    except (KeyError, TypeError, AttributeError):
+        return getattr(usage, key, 0) or 0
+
+def _generation_text(model_name, messages, temperature=0.7, max_tokens=None, call_info=None, **kwargs):
+    """调用Generation接口，返回(文本内容, 错误信息)
+
+    调用前估算提示词token数，超出模型预算时截断最后一条用户消息，并按估算量通过TPM限流。
+    max_tokens为预期输出上限，会被压缩到模型允许的范围内；call_info字典用于带回调用细节
+    （输出因长度上限被截断时finish_reason为length）。
+    """
+    context_tokens, output_limit = _model_limits(model_name)
+    if max_tokens:
+        max_tokens = max(1, min(int(max_tokens), output_limit))
+    with _span("prompt.fit", **{"gen_ai.request.model": model_name}) as span:
+        messages, prompt_tokens, truncated = _fit_messages_to_budget(messages, model_name, max_tokens)
+        span.set_attribute("aisql.prompt_tokens", prompt_tokens)
+        span.set_attribute("aisql.truncated", truncated)
+    remaining = context_tokens - prompt_tokens
+    if not max_tokens and remaining < output_limit:
+        max_tokens = max(remaining, 1)
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+
+    if truncated:
+        _METRICS.inc("aisql_input_truncated_total", udf=_CURRENT_UDF.get(), model=model_name)
+    with _span("rate_limit.wait", **{"aisql.requested_tokens": prompt_tokens}) as span:
+        waited = _TPM_LIMITER.acquire(prompt_tokens)
+        span.set_attribute("aisql.wait_seconds", round(waited, 6))
+    if _TPM_LIMITER.capacity > 0:
+        _METRICS.observe("aisql_rate_limit_wait_seconds", waited, udf=_CURRENT_UDF.get(), model=model_name)
+    response = _dashscope_call(dashscope.Generation, model=model_name, messages=messages, stream=False, result_format='message', temperature=temperature, **kwargs)
+    _TPM_LIMITER.consume(_response_usage(response, 'output_tokens'))
+
+    if call_info is not None:
+        call_info.update({"prompt_tokens": prompt_tokens, "truncated": truncated, "max_tokens": max_tokens,
+                          "status_code": response.status_code, "request_id": getattr(response, 'request_id', None),
+                          "code": getattr(response, 'code', None), "message": getattr(response, 'message', None)})
+    if response.status_code != HTTPStatus.OK:
+        return None, f"API调用失败: {response.message}"
+    full_content = ""
+    if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
+        if hasattr(response.output.choices[0].message, 'content'):
+            full_content = response.output.choices[0].message.content or ""
+        if call_info is not None:
+            call_info["finish_reason"] = getattr(response.output.choices[0], 'finish_reason', None)
+    return full_content, None
+
+# 级联路由统计：按UDF累计行数和各原因的升级次数
+_CASCADE_STATS = {}
+_CASCADE_LOCK = threading.Lock()
+
+def _result_confidence(result):
+    """读取模型返回的confidence，兼容字符串和百分数；无法解析、NaN、负数或超过100%时返回None"""
+    value = result.get("confidence") if isinstance(result, dict) else None
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip().rstrip("%")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(value) or value < 0 or value > 100:
+        return None
+    return value / 100.0 if value > 1 else value
+
+def _cascade_generation(model_name, messages, fast_model="", min_confidence=0.8, temperature=0.7):
+    """级联调用：先用fast_model，JSON解析失败、缺少confidence或低于min_confidence时改用model_name重新生成
+
+    返回(文本内容, 错误信息, 级联信息)；未指定fast_model时直接调用model_name，级联信息为None。
+    """
+    if not fast_model or fast_model == model_name:
+        full_content, error = _generation_text(model_name, messages, temperature=temperature)
+        return full_content, error, None
+    udf = _CURRENT_UDF.get()
+    reason, confidence = None, None
+    try:
+        full_content, error = _generation_text(fast_model, messages, temperature=temperature)
+    except Exception:
+        full_content, error = None, "exception"
+    if error:
+        reason = "api_error"
+    else:
+        try:
+            confidence = _result_confidence(_load_model_json(full_content))
+            if confidence is None:
+                reason = "no_confidence"
+            elif confidence < float(min_confidence):
+                reason = "low_confidence"
+        except Exception:
+            reason = "parse_error"
+    if reason:
+        full_content, error = _generation_text(model_name, messages, temperature=temperature)
+    with _CASCADE_LOCK:
+        stats = _CASCADE_STATS.setdefault(udf, {"rows": 0, "escalated": 0, "api_error": 0, "parse_error": 0, "no_confidence": 0, "low_confidence": 0})
+        stats["rows"] += 1
+        if reason:
+            stats["escalated"] += 1
+            stats[reason] += 1
+        snapshot = dict(stats, escalation_rate=round(stats["escalated"] / float(stats["rows"]), 4))
+    _METRICS.inc("aisql_cascade_total", udf=udf, outcome="escalated" if reason else "accepted", reason=reason or "")
+    info = {"fast_model": fast_model, "model": model_name if reason else fast_model, "escalated": bool(reason),
+            "reason": reason, "fast_confidence": confidence, "min_confidence": float(min_confidence), "stats": snapshot}
+    return full_content, error, info
+
+def _multimodal_text(model_name, messages, **kwargs):
+    """调用MultiModalConversation接口，返回(模型原始content, 错误信息)"""
+    response = _dashscope_call(dashscope.MultiModalConversation, model=model_name, messages=messages, **kwargs)
+    if response.status_code != HTTPStatus.OK:
+        return None, response.message
+    return response.output.choices[0].message.content, None
+
+def _content_text(content):
+    """将多模态返回的content（[{"text": ...}]或字符串）转为纯文本"""
+    if isinstance(content, list):
+        return "\n".join(item.get("text", "") for item in content if isinstance(item, dict) and item.get("text"))
+    return content or ""
+
+def _parse_json_object(content):
+    """解析模型返回的JSON对象，兼容```json代码块包裹，解析失败返回None"""
+    text = (content or "").strip()
+    if text.startswith("```"):
+        text = re.sub(r'^```[a-zA-Z]*\s*|\s*```$', '', text)
+    try:
+        parsed = _load_model_json(text)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+def _load_model_json(content):
+    """json.loads模型返回内容并记录json.parse阶段，解析失败时照常抛出异常"""
+    with _span("json.parse", **{"aisql.content_length": len(content or "")}):
+        return json.loads(content)
+
+def _summary_max_tokens(max_length):
+    """摘要字数上限对应的输出token上限，留足英文摘要和格式的余量"""
+    return int(max_length) * 2 + 100
+
+# 合同章节标题：一、/（一）/第X条/1. 1、/Article 1 等行首编号
+_CONTRACT_HEADING_PATTERN = re.compile(r'^\s*(第[一二三四五六七八九十百零〇\d]+[条章节款]|[一二三四五六七八九十]+[、.．]|[（(][一二三四五六七八九十\d]+[)）]|\d+(\.\d+)*[、.．]\s*\S|(article|section|clause)\s+\d+)', re.IGNORECASE)
+_SIGNATURE_PATTERN = re.compile(r'签字|签章|盖章|签名|签署页|IN WITNESS WHEREOF|signature|signed by', re.IGNORECASE)
+
+def _split_contract_sections(text):
+    """按条款标题行切分合同，首段（标题、当事人信息等）单独成节"""
+    sections, current = [], []
+    for line in (text or '').splitlines(True):
+        if current and _CONTRACT_HEADING_PATTERN.match(line):
+            sections.append(''.join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append(''.join(current))
+    return [section for section in sections if section.strip()]
+
+def _chunk_contract(text, chunk_tokens=3000, model_name="qwen-plus"):
+    """将合同章节打包为不超过chunk_tokens的分块，超长章节按句子滑动窗口切分"""
+    chunks, current, current_tokens = [], [], 0
+    for section in _split_contract_sections(text):
+        tokens = _estimate_tokens(section, model_name)
+        if tokens > chunk_tokens:
+            if current:
+                chunks.append(''.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_chunk_text(section, chunk_tokens, chunk_tokens // 10, model_name))
+            continue
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(''.join(current))
+            current, current_tokens = [], 0
+        current.append(section)
+        current_tokens += tokens
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+def _is_empty_value(value):
+    return value is None or value == "" or value == [] or value == {} or value in ("无", "未知", "N/A", "null")
+
+def _merge_extracted_fields(chunk_results, preferred_index=None, preferred_fields=()):
+    """合并各分块的字段提取结果，返回(合并结果, 冲突字段)
+
+    preferred_fields优先取preferred_index分块（如签署页）的值；列表字段取并集去重；
+    amount取出现次数最多的值；其余标量取第一个非空值。
+    """
+    merged, conflicts = {}, {}
+    keys = []
+    for chunk_result in chunk_results:
+        for key in chunk_result:
+            if key not in keys:
+                keys.append(key)
+
+    for key in keys:
+        values = [(index, r[key]) for index, r in enumerate(chunk_results) if key in r and not _is_empty_value(r[key])]
+        if not values:
+            merged[key] = chunk_results[0].get(key) if chunk_results and key in chunk_results[0] else ""
+            continue
+        preferred = [v for index, v in values if index == preferred_index]
+        if key in preferred_fields and preferred:
+            merged[key] = preferred[0]
+            distinct = [v for _, v in values if v != preferred[0]]
+            if distinct:
+                conflicts[key] = [preferred[0]] + [v for i, v in enumerate(distinct) if v not in distinct[:i]]
+            continue
+        if all(isinstance(v, list) for _, v in values):
+            union, seen = [], set()
+            for _, items in values:
+                for item in items:
+                    marker = json.dumps(item, ensure_ascii=False, sort_keys=True)
+                    if marker not in seen:
+                        seen.add(marker)
+                        union.append(item)
+            merged[key] = union
+            continue
+
+        distinct = []
+        for _, v in values:
+            if v not in distinct:
+                distinct.append(v)
+        if len(distinct) > 1:
+            conflicts[key] = distinct
+        if key == "amount":
+            counts = [sum(1 for _, v in values if v == candidate) for candidate in distinct]
+            merged[key] = distinct[counts.index(max(counts))]
+        else:
+            merged[key] = values[0][1]
+    return merged, conflicts
+
+class _LRUCache(object):
+    """线程安全的进程内LRU缓存"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+def _cosine_similarity(vector1, vector2):
+    dot_product = sum(a * b for a, b in zip(vector1, vector2))
+    magnitude = math.sqrt(sum(a * a for a in vector1)) * math.sqrt(sum(b * b for b in vector2))
+    return dot_product / magnitude if magnitude else 0.0
+
+# ==================== 图像工具函数 ====================
+
+_HTTP_SESSION = None
+_HTTP_SESSION_LOCK = threading.Lock()
+
+def _http_session():
+    """进程内共享的HTTP连接池"""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None:
+        with _HTTP_SESSION_LOCK:
+            if _HTTP_SESSION is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _HTTP_SESSION = session
+    return _HTTP_SESSION
+
+def _fetch_image_bytes(url, timeout=15):
+    """下载图片内容，不支持的地址或下载失败时抛出异常"""
+    if not HAS_REQUESTS:
+        raise RuntimeError("requests library not available")
+    response = _http_session().get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+def _image_dhash(image, hash_size=8):
+    """差值感知哈希(dHash)，返回64位整数"""
+    pixels = list(image.convert("L").resize((hash_size + 1, hash_size)).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return value
+
+def _color_histogram(image):
+    """4x4x4 RGB颜色直方图（已归一化）"""
+    pixels = list(image.convert("RGB").resize((32, 32)).getdata())
+    histogram = [0.0] * 64
+    for r, g, b in pixels:
+        histogram[(r >> 6) * 16 + (g >> 6) * 4 + (b >> 6)] += 1.0
+    return [count / len(pixels) for count in histogram]
+
+def _hamming_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count("1")
+
+def _frame_fingerprint(url):
+    """下载视频帧并计算指纹：有PIL时为(dHash, 颜色直方图)，否则为内容哈希"""
+    data = _fetch_image_bytes(url)
+    if HAS_PIL:
+        image = Image.open(io.BytesIO(data))
+        return {"dhash": _image_dhash(image), "histogram": _color_histogram(image)}
+    return {"digest": hashlib.sha1(data).hexdigest()}
+
+def _histogram_distance(histogram1, histogram2):
+    return sum(abs(a - b) for a, b in zip(histogram1, histogram2)) / 2.0
+
+def _frame_distance(fp1, fp2):
+    """两帧差异度，0表示相同，越大差异越大"""
+    if "digest" in fp1 or "digest" in fp2:
+        return 0.0 if fp1.get("digest") == fp2.get("digest") else 1.0
+    return _hamming_distance(fp1["dhash"], fp2["dhash"]) / 64.0 + _histogram_distance(fp1["histogram"], fp2["histogram"])
+
+def _is_near_identical(fp1, fp2, dedup_threshold):
+    if "digest" in fp1 or "digest" in fp2:
+        return fp1.get("digest") == fp2.get("digest")
+    return _hamming_distance(fp1["dhash"], fp2["dhash"]) <= dedup_threshold and _histogram_distance(fp1["histogram"], fp2["histogram"]) < 0.15
+
+def _select_keyframes(frame_urls, max_frames, dedup_threshold=6, max_workers=8):
+    """选取代表性关键帧，返回按时间顺序的帧下标列表
+
+    先去掉与上一保留帧近似相同的连续帧（dHash汉明距离<=dedup_threshold且颜色分布接近），
+    仍超过max_frames时保留首帧和画面变化最大的帧。下载失败的帧视为不同帧。
+    """
+    def fingerprint(url):
+        try:
+            return _frame_fingerprint(url)
+        except Exception:
+            return None
+
+    fingerprints = _run_concurrently(fingerprint, frame_urls, max_workers)
+    kept, change_scores = [], {}
+    for index, fp in enumerate(fingerprints):
+        if not kept:
+            kept.append(index)
+            continue
+        previous = fingerprints[kept[-1]]
+        if previous is None or fp is None:
+            change_scores[index] = 1.0
+        elif _is_near_identical(previous, fp, dedup_threshold):
+            continue
+        else:
+            change_scores[index] = _frame_distance(previous, fp)
+        kept.append(index)
+
+    if len(kept) > max_frames:
+        ranked = sorted(kept[1:], key=lambda i: change_scores.get(i, 0.0), reverse=True)
+        kept = sorted([kept[0]] + ranked[:max_frames - 1])
+    return kept
+
+# 各任务的图片长边目标像素：OCR需保留小字细节，描述类任务低分辨率即可
+_IMAGE_TARGET_SIZES = {"ocr": 2048, "chart": 1536, "analyze": 1024, "describe": 768}
+_IMAGE_JPEG_QUALITY = {"ocr": 90, "chart": 88}
+
+# preprocess为file时本地图片文件的保留数量；超出后删除最久未使用的文件，最近写入的文件可能仍在上传，不删除
+_IMAGE_FILE_MAX_FILES = 256
+_IMAGE_FILE_MIN_AGE = 300
+
+def _encode_image(data, task):
+    """按任务缩放图片并重新编码为JPEG，返回(字节内容, 原始尺寸, 发送尺寸)
+
+    先按EXIF方向信息旋转，手机拍摄的竖图重新编码后不会丢失方向；原始尺寸为旋转后的尺寸。
+    """
+    image = Image.open(io.BytesIO(data))
+    rotated = image.getexif().get(0x0112, 1) not in (0, 1)
+    if rotated:
+        image = ImageOps.exif_transpose(image)
+    original_size = image.size
+    target = _IMAGE_TARGET_SIZES.get(task, 1024)
+    if max(image.size) > target:
+        scale = target / float(max(image.size))
+        image = image.resize((max(1, int(image.size[0] * scale)), max(1, int(image.size[1] * scale))), Image.LANCZOS)
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=_IMAGE_JPEG_QUALITY.get(task, 85), optimize=True)
+    encoded = buffer.getvalue()
+    if len(encoded) >= len(data) and original_size == image.size and not rotated and data[:3] == b"\xff\xd8\xff":
+        encoded = data
+    return encoded, original_size, image.size
+
+def _evict_image_files(directory, keep):
+    """图片目录超过_IMAGE_FILE_MAX_FILES个文件时按修改时间删除最旧的文件，跳过keep和最近写入的文件"""
+    try:
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".jpg"):
+                path = os.path.join(directory, name)
+                entries.append((os.path.getmtime(path), path))
+    except OSError:
+        return
+    if len(entries) <= _IMAGE_FILE_MAX_FILES:
+        return
+    cutoff = time.time() - _IMAGE_FILE_MIN_AGE
+    entries.sort()
+    for mtime, path in entries[:len(entries) - _IMAGE_FILE_MAX_FILES]:
+        if path == keep or mtime > cutoff:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _image_reference(encoded, transport):
+    """生成提交给模型的图片引用：base64内联或本地文件（由SDK负责上传）
+
+    文件按内容哈希命名，先写入临时文件再原子替换，并发写同一图片时不会读到半个文件；
+    目录按最近使用保留_IMAGE_FILE_MAX_FILES个文件。
+    """
+    if transport == "file":
+        directory = os.path.join(tempfile.gettempdir(), "aisql_images")
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, hashlib.sha1(encoded).hexdigest() + ".jpg")
+        if os.path.exists(path):
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        else:
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(encoded)
+                os.replace(temp_path, path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            _evict_image_files(directory, path)
+        return "file://" + path
+    return "data:image/jpeg;base64," + base64.b64encode(encoded).decode("ascii")
+
+def _prepare_image(image_url, task, preprocess="none", data=None):
+    """可选的图片预处理：下载、按任务缩放、重新编码后以base64或本地文件提交
+
+    返回(图片引用, 预处理信息)；preprocess为none、依赖缺失或处理失败时原样返回URL和None。
+    已下载的图片内容可通过data传入，避免重复下载。
+    """
+    if preprocess not in ("base64", "file") or not (HAS_PIL and HAS_REQUESTS):
+        return image_url, None
+    try:
+        if data is None:
+            data = _fetch_image_bytes(image_url)
+        encoded, original_size, sent_size = _encode_image(data, task)
+        info = {"original_bytes": len(data), "sent_bytes": len(encoded), "original_size": list(original_size), "sent_size": list(sent_size)}
+        return _image_reference(encoded, preprocess), info
+    except Exception:
+        return image_url, None
+
+def _text_likelihood(data):
+    """本地估计图片中文字区域的占比(0~1)，不调用模型
+
+    文字表现为成片出现、边缘密集但不饱和的小块：边缘图按16x16分块统计边缘占比，
+    占比在文字范围内的块做4邻域连通，保留横向展开或面积较大的连通块，返回其块数占全部块的比例。
+    """
+    image = Image.open(io.BytesIO(data)).convert("L")
+    image.thumbnail((1024, 1024))
+    width, height = image.size
+    # 去掉1像素边框，避免图片边缘被当作边缘
+    edges = image.filter(ImageFilter.FIND_EDGES).point(lambda v: 255 if v > 48 else 0).crop((1, 1, width - 1, height - 1))
+    cols, rows = max(1, (width - 2) // 16), max(1, (height - 2) // 16)
+    density = list(edges.resize((cols, rows), Image.BOX).getdata())
+    candidates = {i for i, value in enumerate(density) if 40 <= value <= 160}
+    seen, text_blocks = set(), 0
+    for start in candidates:
+        if start in seen:
+            continue
+        seen.add(start)
+        stack, members = [start], []
+        while stack:
+            i = stack.pop()
+            members.append(i)
+            row, col = divmod(i, cols)
+            for neighbor, valid in ((i - 1, col > 0), (i + 1, col < cols - 1), (i - cols, row > 0), (i + cols, row < rows - 1)):
+                if valid and neighbor in candidates and neighbor not in seen:
+                    seen.add(neighbor)
+                    stack.append(neighbor)
+        member_rows = [i // cols for i in members]
+        member_cols = [i % cols for i in members]
+        wide = max(member_cols) - min(member_cols) >= max(member_rows) - min(member_rows)
+        if len(members) >= 3 and (wide or len(members) >= 12):
+            text_blocks += len(members)
+    return text_blocks / float(len(density))
+
+# OCR文字预筛计数（进程内累计）：skipped-判定无文字直接返回，downgraded-改用低成本模型，sent-正常调用
+_OCR_PREFILTER_STATS = {"skipped": 0, "downgraded": 0, "sent": 0}
+_OCR_PREFILTER_LOCK = threading.Lock()
+
+def _ocr_prefilter(image_url, data, min_text_score, low_text_model=""):
+    """OCR前的本地文字预筛，返回(动作, 文字得分, 图片内容)
+
+    动作为skip/downgrade/send；未开启、缺少依赖或图片无法解析时一律send，不影响识别，
+    此时文字得分为None，也不计入预筛统计和指标。
+    """
+    action, score = "send", None
+    if float(min_text_score) > 0 and HAS_PIL and HAS_REQUESTS:
+        try:
+            if data is None:
+                data = _fetch_image_bytes(image_url)
+            score = round(_text_likelihood(data), 4)
+            if score < float(min_text_score):
+                action = "downgrade" if low_text_model else "skip"
+        except Exception:
+            pass
+    if score is None:
+        return action, score, data
+    with _OCR_PREFILTER_LOCK:
+        _OCR_PREFILTER_STATS[{"skip": "skipped", "downgrade": "downgraded", "send": "sent"}[action]] += 1
+    _METRICS.inc("aisql_ocr_prefilter_total", action=action)
+    return action, score, data
+
+def _tile_spans(length, tile_size, overlap):
+    """一维切分：返回覆盖[0, length)的(起点, 终点)列表，相邻分块重叠约overlap像素"""
+    if length <= tile_size:
+        return [(0, length)]
+    count = int(math.ceil((length - overlap) / float(tile_size - overlap)))
+    step = (length - tile_size) / float(count - 1)
+    return [(int(round(i * step)), int(round(i * step)) + tile_size) for i in range(count)]
+
+# 分块尺寸下限和每页分块数上限：分块过小会切碎文字，过多会放大调用次数和费用
+_TILE_MIN_SIZE = 512
+_TILE_MAX_COUNT = 16
+
+def _image_tiles(data, tile_size=1536, overlap=128):
+    """把大图切成带重叠的全宽横条，返回(分块列表, 横条区间)
+
+    只纵向切分，不左右切开文字行，宽度超过tile_size时整体缩小到tile_size宽；
+    横条数超过_TILE_MAX_COUNT时继续缩小整图。分块为(横条序号, JPEG字节)，横条区间为缩放后的像素范围；
+    图片长边不超过tile_size时返回空列表。
+    """
+    tile_size = max(_TILE_MIN_SIZE, int(tile_size))
+    image = Image.open(io.BytesIO(data))
+    if max(image.size) <= tile_size:
+        return [], [(0, image.size[1])]
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    overlap = max(0, min(int(overlap), tile_size // 2))
+    width, height = image.size
+    max_height = _TILE_MAX_COUNT * (tile_size - overlap) + overlap
+    scale = min(1.0, tile_size / float(width), max_height / float(height))
+    if scale < 1.0:
+        image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+    row_spans = _tile_spans(image.size[1], tile_size, overlap)
+    tiles = []
+    for row, (top, bottom) in enumerate(row_spans):
+        buffer = io.BytesIO()
+        image.crop((0, top, image.size[0], bottom)).save(buffer, format="JPEG", quality=_IMAGE_JPEG_QUALITY["ocr"])
+        tiles.append((row, buffer.getvalue()))
+    return tiles, row_spans
+
+def _overlap_match(line, candidates):
+    """在相邻分块的行中查找与line重复的行（完全相同、互相包含或高度相似），找不到返回None"""
+    key = re.sub(r'\s+', '', line)
+    shingles = _text_shingles(key, 2)
+    for candidate in candidates:
+        other = re.sub(r'\s+', '', candidate)
+        if not key or not other:
+            continue
+        if key == other or (min(len(key), len(other)) >= 4 and (key in other or other in key)):
+            return candidate
+        if _jaccard(shingles, _text_shingles(other, 2)) >= 0.8:
+            return candidate
+    return None
+
+def _merge_tile_texts(tile_texts, row_count, overlap_lines=3):
+    """合并横条识别结果：按横条从上到下输出，去掉上下重叠区域重复识别的行
+
+    tile_texts为{横条序号: 文本}。本条开头与上一条末尾overlap_lines行重复的行去掉，
+    若本条识别得更完整则替换上一条的行；其余位置重复出现的短行（如表格里的相同数值）保留。
+    """
+    strips = {row: [line.strip() for line in (text or "").splitlines() if line.strip()]
+              for row, text in tile_texts.items()}
+    output, positions = [], {}
+    for row in range(row_count):
+        lines = list(strips.get(row, []))
+        above = strips.get(row - 1, [])[-overlap_lines:]
+        while lines and above:
+            matched = _overlap_match(lines[0], above)
+            if matched is None:
+                break
+            if len(lines[0]) > len(matched) and (row - 1, matched) in positions:
+                output[positions[(row - 1, matched)]] = lines[0]
+            lines.pop(0)
+        for line in lines:
+            positions[(row, line)] = len(output)
+            output.append(line)
+    return "\n".join(output)
+
+def _tiled_recognize(pages, prompt, model_name, preprocess="none", tile_size=1536, overlap=128, max_workers=4):
+    """多页大图切成全宽横条并发识别，pages为[(图片URL, 图片内容或None)]
+
+    所有页面的分块放入同一个线程池执行，返回与pages对应的[(文本, 分块数, 失败分块数)]；
+    未超过tile_size或无法切分的页面整页提交（按preprocess处理）。分块以base64提交，preprocess为file时写入本地文件。
+    """
+    transport = "file" if preprocess == "file" else "base64"
+    tasks, layouts = [], []
+    for page_index, (image_url, data) in enumerate(pages):
+        try:
+            if data is None:
+                data = _fetch_image_bytes(image_url)
+            tiles, row_spans = _image_tiles(data, tile_size, overlap)
+        except Exception:
+            tiles, row_spans = [], [(0, 1)]
+        if not tiles:
+            tasks.append((page_index, 0, _prepare_image(image_url, "ocr", preprocess, data)[0], 1))
+        for row, encoded in tiles:
+            tasks.append((page_index, row, _image_reference(encoded, transport), len(row_spans)))
+        layouts.append(len(row_spans))
+    
+    def recognize(task):
+        page_index, row, image_ref, tile_count = task
+        hint = f"（这是整张图片从上到下第{row + 1}/{tile_count}段横条，上下边缘处的文字可能被截断）" if tile_count > 1 else ""
+        messages = [{"role": "user", "content": [{"image": image_ref}, {"text": prompt + hint}]}]
+        try:
+            content, error = _multimodal_text(model_name, messages)
+        except Exception as e:
+            content, error = None, str(e)
+        return None if error else _content_text(content)
+    
+    outputs = _run_concurrently(recognize, tasks, max_workers)
+    results = []
+    for page_index, row_count in enumerate(layouts):
+        tile_texts, failed = {}, 0
+        for task, text in zip(tasks, outputs):
+            if task[0] != page_index:
+                continue
+            if text is None:
+                failed += 1
+            else:
+                tile_texts[task[1]] = text
+        results.append((_merge_tile_texts(tile_texts, row_count), row_count, failed))
+    return results
+
+class _ImageResultCache(object):
+    """按图片内容缓存模型结果，与图片URL无关
+
+    默认只按内容SHA-256精确匹配。调用方允许近似匹配（near_match）且max_distance>0时，再按dHash
+    汉明距离<=max_distance匹配视觉上相同的图片（同一图片经不同CDN重新压缩后字节不同但dHash几乎不变）；
+    同一模板生成的票据、表单在该距离内也会被误判为同一图片，因此OCR和向量不使用近似匹配。
+    dHash按16位分4段建索引，max_distance<=3时由抽屉原理保证近似匹配不会漏查。
+    设置path时结果同时写入SQLite，跨进程复用。
+    """
+
+    def __init__(self, max_entries=10000, max_distance=0, path=None):
+        self.max_entries = max_entries
+        self.max_distance = min(max_distance, 3)
+        self.entries = OrderedDict()  # (namespace, sha256) -> (dhash, aspect, result)
+        self.bands = {}               # (namespace, 段号, 段值) -> {sha256}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS image_cache (namespace TEXT, sha256 TEXT, dhash TEXT, aspect REAL, result TEXT, PRIMARY KEY (namespace, sha256))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS image_cache_dhash ON image_cache (namespace, dhash)")
+
+    @staticmethod
+    def _band_keys(namespace, dhash):
+        return [(namespace, band, (dhash >> (band * 16)) & 0xFFFF) for band in range(4)]
+
+    def _store(self, namespace, sha256, dhash, aspect, result):
+        self.entries[(namespace, sha256)] = (dhash, aspect, result)
+        self.entries.move_to_end((namespace, sha256))
+        if dhash is not None:
+            for key in self._band_keys(namespace, dhash):
+                self.bands.setdefault(key, set()).add(sha256)
+        while len(self.entries) > self.max_entries:
+            (old_namespace, old_sha256), (old_dhash, _, _) = self.entries.popitem(last=False)
+            if old_dhash is not None:
+                for key in self._band_keys(old_namespace, old_dhash):
+                    self.bands.get(key, set()).discard(old_sha256)
+
+    def _lookup(self, namespace, fingerprint, near_match=False):
+        entry = self.entries.get((namespace, fingerprint["sha256"]))
+        if entry is not None:
+            self.entries.move_to_end((namespace, fingerprint["sha256"]))
+            return entry[2]
+        dhash = fingerprint.get("dhash")
+        if dhash is None or not near_match or self.max_distance <= 0:
+            return None
+        for key in self._band_keys(namespace, dhash):
+            for sha256 in self.bands.get(key, ()):
+                candidate_dhash, aspect, result = self.entries[(namespace, sha256)]
+                if _hamming_distance(dhash, candidate_dhash) <= self.max_distance and abs(aspect - fingerprint["aspect"]) < 0.02:
+                    return result
+        return None
+
+    def get(self, namespace, fingerprint, near_match=False):
+        near_match = near_match and self.max_distance > 0
+        with self.lock:
+            result = self._lookup(namespace, fingerprint, near_match)
+            if result is None and self.db is not None:
+                dhash = "%016x" % fingerprint["dhash"] if near_match and fingerprint.get("dhash") is not None else None
+                row = self.db.execute("SELECT dhash, aspect, result FROM image_cache WHERE namespace = ? AND (sha256 = ? OR dhash = ?) LIMIT 1",
+                                      (namespace, fingerprint["sha256"], dhash)).fetchone()
+                if row:
+                    result = json.loads(row[2])
+                    self._store(namespace, fingerprint["sha256"], int(row[0], 16) if row[0] else None, row[1], result)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        _METRICS.inc("aisql_cache_requests_total", cache="image_result", result="miss" if result is None else "hit")
+        return result
+
+    def put(self, namespace, fingerprint, result):
+        result = dict(result)
+        with self.lock:
+            self._store(namespace, fingerprint["sha256"], fingerprint.get("dhash"), fingerprint.get("aspect", 0.0), result)
+            if self.db is not None:
+                dhash = fingerprint.get("dhash")
+                self.db.execute("INSERT OR REPLACE INTO image_cache VALUES (?, ?, ?, ?, ?)",
+                                (namespace, fingerprint["sha256"], "%016x" % dhash if dhash is not None else None,
+                                 fingerprint.get("aspect", 0.0), json.dumps(result, ensure_ascii=False)))
+                self.db.commit()
+
+_IMAGE_CACHE = _ImageResultCache(
+    max_entries=int(os.environ.get("AISQL_IMAGE_CACHE_SIZE", "10000")),
+    max_distance=int(os.environ.get("AISQL_IMAGE_CACHE_DISTANCE", "0")),
+    path=os.environ.get("AISQL_IMAGE_CACHE_PATH") or None
+)
+
+def _image_content_fingerprint(data):
+    """图片内容指纹：SHA-256，有PIL时附加dHash和宽高比"""
+    fingerprint = {"sha256": hashlib.sha256(data).hexdigest()}
+    if HAS_PIL:
+        try:
+            image = Image.open(io.BytesIO(data))
+            fingerprint.update({"dhash": _image_dhash(image), "aspect": round(image.size[0] / float(image.size[1]), 4)})
+        except Exception:
+            pass
+    return fingerprint
+
+# 已下载过的URL直接复用指纹，重复URL命中缓存时无需再次下载
+_IMAGE_URL_FINGERPRINTS = _LRUCache(_IMAGE_CACHE.max_entries)
+
+def _cached_image_lookup(namespace, image_url, near_match=False):
+    """按图片内容查询结果缓存，返回(图片指纹, 图片内容, 缓存结果)；下载失败时全部为None
+
+    URL已知时不下载，图片内容返回None。near_match只应由描述、分析类函数开启，OCR和向量必须精确匹配。
+    """
+    with _span("cache.lookup", **{"aisql.cache.namespace": namespace}) as span:
+        fingerprint = _IMAGE_URL_FINGERPRINTS.get(image_url)
+        data = None
+        if fingerprint is None:
+            try:
+                data = _fetch_image_bytes(image_url)
+            except Exception:
+                return None, None, None
+            fingerprint = _image_content_fingerprint(data)
+            _IMAGE_URL_FINGERPRINTS.put(image_url, fingerprint)
+        cached = _IMAGE_CACHE.get(namespace, fingerprint, near_match)
+        span.set_attribute("aisql.cache.hit", cached is not None)
+        return fingerprint, data, cached
+
+def _cache_hit_result(cached, **fields):
+    result = dict(cached)
+    result.update(fields)
+    result["cache_hit"] = True
+    return json.dumps(result, ensure_ascii=False)
+
+# 单次请求可包含多张图片并逐张返回向量的模型及每批图片上限；
+# 其他模型（如one-peace会把多个输入融合为一个向量）每次请求只发送一张图片
+_MULTI_ITEM_EMBEDDING_MODELS = {
+    "multimodal-embedding-v1": 5,
+    "tongyi-embedding-vision-plus": 8,
+    "tongyi-embedding-vision-flash": 8,
+}
+
+# 图片向量存储：(模型, 图片URL) -> array('d')，同一进程内每张图片只生成一次向量
+_IMAGE_EMBEDDING_STORE = _LRUCache(int(os.environ.get("AISQL_EMBEDDING_STORE_SIZE", "10000")))
+
+def _embed_images(image_urls, model_name, max_workers=4):
+    """批量获取图片向量，返回(与image_urls一一对应的向量列表, 错误信息)
+
+    已在向量存储中的图片直接复用；其余图片去重后按模型允许的批大小分组，各组并发请求。
+    """
+    embeddings, missing, seen = {}, [], set()
+    for url in image_urls:
+        if url in seen:
+            continue
+        seen.add(url)
+        stored = _IMAGE_EMBEDDING_STORE.get((model_name, url))
+        _METRICS.inc("aisql_cache_requests_total", cache="embedding_store", result="miss" if stored is None else "hit")
+        if stored is not None:
+            embeddings[url] = stored
+        else:
+            missing.append(url)
+
+    batch_size = _MULTI_ITEM_EMBEDDING_MODELS.get(model_name, 1)
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    def embed_batch(batch):
+        request_input = {"image": batch[0]} if len(batch) == 1 else [{"image": url} for url in batch]
+        response = _dashscope_call(dashscope.MultiModalEmbedding, model=model_name, input=request_input)
+        if response.status_code != HTTPStatus.OK:
+            return None, f"图片嵌入生成失败: {response.message}"
+        items = sorted(response.output['embeddings'], key=lambda item: item.get('index', 0))
+        if len(items) != len(batch):
+            return None, f"图片嵌入生成失败: 请求{len(batch)}张图片，返回{len(items)}个向量"
+        return [item['embedding'] for item in items], None
+
+    for batch, (vectors, error) in zip(batches, _run_concurrently(embed_batch, batches, max_workers)):
+        if error:
+            return None, error
+        for url, vector in zip(batch, vectors):
+            embeddings[url] = array('d', vector)
+            _IMAGE_EMBEDDING_STORE.put((model_name, url), embeddings[url])
+    return [embeddings[url] for url in image_urls], None
+
+# ==================== 向量索引 ====================
+
+_INDEX_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+
+class _VectorIndex(object):
+    """持久化的向量索引：JSON Lines文件追加写入，内存中保存归一化向量做精确检索
+
+    同一id多次写入时以最后一次为准。有numpy时向量保存为float32矩阵，用矩阵乘法批量打分；
+    否则逐条计算。其他进程修改了索引文件时，下次访问会重新加载。
+    文件中的头部行{"header": {"model": ..., "dimension": ...}}记录向量模型和维度，
+    模型或维度不一致的写入和检索会被拒绝（不同模型的向量不在同一空间，相似度没有意义）。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.loaded_signature = None
+        self.ids, self.positions, self.vectors = [], {}, []
+        self.matrix = None
+        self.model, self.dimension, self.has_header = "", 0, False
+
+    def _signature(self):
+        if not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.path)
+        return (stat.st_mtime, stat.st_size)
+
+    @staticmethod
+    def _normalize(embedding):
+        norm = math.sqrt(sum(v * v for v in embedding)) or 1.0
+        return array('d', (v / norm for v in embedding))
+
+    def _apply(self, items):
+        """把(id, 向量)写入内存结构"""
+        stored_rows = self.matrix.shape[0] if self.matrix is not None else 0
+        pending = []
+        for item_id, embedding in items:
+            if HAS_NUMPY:
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector = vector / (float(np.linalg.norm(vector)) or 1.0)
+            else:
+                vector = self._normalize(embedding)
+            position = self.positions.get(item_id)
+            if position is None:
+                self.positions[item_id] = len(self.ids)
+                self.ids.append(item_id)
+                (pending if HAS_NUMPY else self.vectors).append(vector)
+            elif HAS_NUMPY and position < stored_rows:
+                self.matrix[position] = vector
+            elif HAS_NUMPY:
+                pending[position - stored_rows] = vector
+            else:
+                self.vectors[position] = vector
+        if pending:
+            stacked = np.vstack(pending)
+            self.matrix = stacked if self.matrix is None else np.vstack([self.matrix, stacked])
+
+    def _load(self):
+        signature = self._signature()
+        if signature == self.loaded_signature:
+            return
+        self.ids, self.positions, self.vectors, self.matrix = [], {}, [], None
+        self.model, self.dimension, self.has_header = "", 0, False
+        if signature is not None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            items = [(line["id"], line["embedding"]) for line in lines if "header" not in line]
+            for line in lines:
+                if "header" in line:
+                    self.model = line["header"].get("model") or self.model
+                    self.dimension = int(line["header"].get("dimension") or self.dimension)
+                    self.has_header = True
+            if not self.dimension and items:
+                self.dimension = len(items[0][1])
+            self._apply(items)
+        self.loaded_signature = signature
+
+    def _check(self, model, dimension):
+        """模型或维度与索引头部不一致时抛出ValueError；索引未记录模型时不检查模型"""
+        if model and self.model and model != self.model:
+            raise ValueError(f"向量模型不一致：索引使用{self.model}，当前为{model}")
+        if self.dimension and dimension != self.dimension:
+            raise ValueError(f"向量维度不一致：索引为{self.dimension}维，当前为{dimension}维")
+
+    def add(self, items, model=""):
+        """追加(id, 向量)列表，返回(索引大小, 向量维度)；model为生成向量的模型，空字符串表示未知"""
+        with self.lock:
+            self._load()
+            dimension = self.dimension or (len(items[0][1]) if items else 0)
+            self._check(model, dimension)
+            for item_id, embedding in items:
+                if len(embedding) != dimension:
+                    raise ValueError(f"向量维度不一致：{item_id}为{len(embedding)}维，其余为{dimension}维")
+            if not items:
+                return len(self.ids), self.dimension
+            with open(self.path, "a", encoding="utf-8") as f:
+                if not self.has_header or (model and not self.model):
+                    # 旧版索引文件没有头部，补写一行；之前未记录模型时以首次提供的模型为准
+                    f.write(json.dumps({"header": {"model": model or self.model, "dimension": dimension}}, ensure_ascii=False) + "\n")
+                    self.model, self.dimension, self.has_header = model or self.model, dimension, True
+                for item_id, embedding in items:
+                    f.write(json.dumps({"id": item_id, "embedding": list(embedding)}, ensure_ascii=False) + "\n")
+            self._apply(items)
+            self.loaded_signature = self._signature()
+            return len(self.ids), self.dimension
+
+    def search(self, query, top_k=10, model=""):
+        """返回([(id, 余弦相似度)], 索引大小)，按相似度降序；top_k必须为正整数"""
+        if int(top_k) <= 0:
+            raise ValueError("top_k必须为正整数")
+        with self.lock:
+            self._load()
+            if self.ids:
+                self._check(model, len(query))
+            ids, vectors, matrix = self.ids, self.vectors, self.matrix
+        if not ids:
+            return [], 0
+        norm = math.sqrt(sum(v * v for v in query)) or 1.0
+        top_k = min(int(top_k), len(ids))
+        if matrix is not None:
+            scores = matrix.dot(np.asarray(query, dtype=np.float32) / norm)
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            ranked = sorted(((ids[i], float(scores[i])) for i in top), key=lambda x: x[1], reverse=True)
+        else:
+            query = [v / norm for v in query]
+            ranked = heapq.nlargest(top_k, ((ids[i], sum(a * b for a, b in zip(vectors[i], query))) for i in range(len(ids))), key=lambda x: x[1])
+        return ranked, len(ids)
+
+_VECTOR_INDEXES = {}
+_VECTOR_INDEXES_LOCK = threading.Lock()
+
+def _vector_index(index_name):
+    """按名称获取索引，文件位于环境变量AISQL_INDEX_DIR（默认系统临时目录下aisql_indexes）"""
+    if not _INDEX_NAME_PATTERN.match(index_name or ""):
+        raise ValueError("索引名称只能包含字母、数字、下划线和短横线，长度不超过64")
+    with _VECTOR_INDEXES_LOCK:
+        if index_name not in _VECTOR_INDEXES:
+            directory = os.environ.get("AISQL_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "aisql_indexes")
+            if not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+            _VECTOR_INDEXES[index_name] = _VectorIndex(os.path.join(directory, index_name + ".jsonl"))
+        return _VECTOR_INDEXES[index_name]
+
 # ==================== 文本处理函数 (8个) ====================
 
+# map_reduce摘要的最大归并层数，防止摘要长度下限超出分块预算时无限循环调用模型
+_SUMMARY_MAX_LEVELS = 5
+
 @annotate("*->string")
 class ai_text_summarize(object):
-    def evaluate(self, text, api_key, model_name="qwen-plus", max_length=200):
+    def evaluate(self, text, api_key, model_name="qwen-plus", max_length=200, mode="auto", chunk_tokens=4000, max_workers=4):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -50,24 +2368,72 @@ class ai_text_summarize(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.7)
+            chunk_tokens = int(chunk_tokens)
+            if chunk_tokens <= 0:
+                return json.dumps({"error": True, "message": "chunk_tokens must be a positive integer"}, ensure_ascii=False)
+            if mode == "map_reduce" or (mode == "auto" and _estimate_tokens(text, model_name) > chunk_tokens):
+                return self._map_reduce(text, model_name, max_length, chunk_tokens, max_workers)
             
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-                else:
-                    full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.7, max_tokens=_summary_max_tokens(max_length))
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             result = {"summary": full_content, "original_length": len(text), "model": model_name, "timestamp": datetime.now().isoformat()}
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
+    def _map_reduce(self, text, model_name, max_length, chunk_tokens, max_workers):
+        """长文本分块并发摘要，再逐层归并，层数由输入规模决定
+
+        归并最多_SUMMARY_MAX_LEVELS层；某一层的分块数不再减少（摘要长度下限已装不进预算）时提前停止，直接整合。
+        """
+        def summarize(task):
+            part, index, total, limit = task
+            messages = [
+                {"role": "system", "content": f"你是专业的文本摘要专家。以下是长文本的第{index}/{total}部分，请将其总结为不超过{limit}字的摘要，保留关键事实、数字和结论。"},
+                {"role": "user", "content": part}
+            ]
+            return _generation_text(model_name, messages, temperature=0.7, max_tokens=_summary_max_tokens(limit))
+        
+        try:
+            overlap_tokens = chunk_tokens // 20
+            chunks = _chunk_text(text, chunk_tokens, overlap_tokens, model_name)
+            chunk_count, levels = len(chunks), 0
+            while True:
+                levels += 1
+                # 各分块摘要长度按预算分摊，保证下一层能装入更少的分块
+                partial_limit = max(int(max_length), chunk_tokens // max(len(chunks), 1))
+                outputs = _run_concurrently(summarize, [(c, i + 1, len(chunks), partial_limit) for i, c in enumerate(chunks)], max_workers)
+                for _, error in outputs:
+                    if error:
+                        return json.dumps({"error": True, "message": error}, ensure_ascii=False)
+                combined = "\n\n".join(content for content, _ in outputs)
+                if len(chunks) == 1 or _estimate_tokens(combined, model_name) <= chunk_tokens or levels >= _SUMMARY_MAX_LEVELS:
+                    break
+                next_chunks = _chunk_text(combined, chunk_tokens, overlap_tokens, model_name)
+                if len(next_chunks) >= len(chunks):
+                    break
+                chunks = next_chunks
+            
+            if len(outputs) > 1:
+                messages = [
+                    {"role": "system", "content": f"你是专业的文本摘要专家。以下是同一篇长文本各部分的摘要，请整合为一篇连贯、不重复、不超过{max_length}字的总摘要。"},
+                    {"role": "user", "content": combined}
+                ]
+                full_content, error = _generation_text(model_name, messages, temperature=0.7, max_tokens=_summary_max_tokens(max_length))
+                if error:
+                    return json.dumps({"error": True, "message": error}, ensure_ascii=False)
+                levels += 1
+            else:
+                full_content = combined
+            
+            result = {"summary": full_content, "original_length": len(text), "model": model_name, "timestamp": datetime.now().isoformat(),
+                      "mode": "map_reduce", "chunk_count": chunk_count, "levels": levels}
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
 @annotate("*->string")
 class ai_text_translate(object):
     def evaluate(self, text, target_language, api_key, model_name="qwen-plus"):
@@ -81,16 +2447,9 @@ class ai_text_translate(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.3)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.3, max_tokens=_estimate_tokens(text, model_name) * 3 + 100)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             result = {"translated_text": full_content, "original_text": text, "target_language": target_language, "model": model_name}
             return json.dumps(result, ensure_ascii=False)
@@ -99,7 +2458,17 @@ class ai_text_translate(object):
 
 @annotate("*->string")
 class ai_text_sentiment_analyze(object):
-    def evaluate(self, text, api_key, model_name="qwen-plus"):
+    def evaluate(self, text, api_key, model_name="qwen-plus", min_local_confidence=0):
+        prescore = None
+        try:
+            if float(min_local_confidence) > 0:
+                local_result, prescore = _sentiment_prescore(text, min_local_confidence)
+                if local_result is not None:
+                    local_result.update({"model": "local", "prescore": prescore})
+                    return json.dumps(local_result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -112,22 +2481,17 @@ class ai_text_sentiment_analyze(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.1)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.1)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"sentiment_analysis": full_content}
             result["model"] = model_name
+            if prescore:
+                result["prescore"] = prescore
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
@@ -147,19 +2511,12 @@ class ai_text_extract_entities(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.2)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.2)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"entities": full_content}
             result["entity_types"] = entity_types
@@ -182,19 +2539,12 @@ class ai_text_extract_keywords(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.3)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.3)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"keywords": full_content.split("、") if "、" in full_content else [full_content]}
             result["max_keywords"] = max_keywords
@@ -204,7 +2554,7 @@ class ai_text_extract_keywords(object):
 
 @annotate("*->string")
 class ai_text_classify(object):
-    def evaluate(self, text, api_key, categories="auto", model_name="qwen-plus"):
+    def evaluate(self, text, api_key, categories="auto", model_name="qwen-plus", fast_model="", min_confidence=0.8):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -217,29 +2567,40 @@ class ai_text_classify(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.2)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error, cascade = _cascade_generation(model_name, messages, fast_model, min_confidence, temperature=0.2)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"classification": full_content}
             result["categories"] = categories
+            if cascade:
+                result["cascade"] = cascade
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
 @annotate("*->string")
 class ai_text_clean_normalize(object):
-    def evaluate(self, text, api_key, operations="all", model_name="qwen-plus"):
+    def evaluate(self, text, api_key, operations="all", model_name="qwen-plus", engine="auto"):
+        # engine=auto：确定性操作在本地完成，仅拼写纠错等语义操作调用模型；local只做本地规则；llm全部交给模型
+        if engine != "llm":
+            try:
+                rules, semantic = _split_clean_operations(operations)
+                cleaned, applied, changes = _clean_text_locally(text, rules)
+            except Exception as e:
+                return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+            if engine == "local" or not semantic:
+                result = {"cleaned_text": cleaned, "operations_applied": applied, "changes_count": changes, "operations": operations, "engine": "local"}
+                if semantic:
+                    result["unsupported_operations"] = semantic
+                return json.dumps(result, ensure_ascii=False)
+            text, llm_operations = cleaned, "、".join(semantic)
+        else:
+            applied, changes, llm_operations = [], 0, operations
+
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -247,27 +2608,26 @@ class ai_text_clean_normalize(object):
         messages = [
             {"role": "system", "content": f"""你是文本清洗专家。执行文本清洗和标准化操作。
 严格按照以下JSON格式返回，不要包含任何解释文字：
-{{"cleaned_text": "清洗后文本", "operations_applied": ["去重", "标准化"], "changes_count": 5}}（执行操作：{operations}）"""},
+{{"cleaned_text": "清洗后文本", "operations_applied": ["去重", "标准化"], "changes_count": 5}}（执行操作：{llm_operations}）"""},
             {"role": "user", "content": text}
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.1)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.1)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"cleaned_text": full_content}
             result["operations"] = operations
+            if engine != "llm":
+                llm_applied = result.get("operations_applied")
+                result["operations_applied"] = applied + (llm_applied if isinstance(llm_applied, list) else [])
+                if isinstance(result.get("changes_count"), (int, float)):
+                    result["changes_count"] += changes
+                result["engine"] = "local+llm"
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
@@ -287,19 +2647,12 @@ class ai_auto_tag_generate(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.5)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.5)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"tags": full_content.split("、") if "、" in full_content else [full_content]}
             result["max_tags"] = max_tags
@@ -317,7 +2670,7 @@ class ai_text_to_embedding(object):
         
         try:
             dashscope.api_key = api_key
-            response = dashscope.TextEmbedding.call(model=model_name, input=text)
+            response = _dashscope_call(dashscope.TextEmbedding, model=model_name, input=text)
             if response.status_code == HTTPStatus.OK:
                 embedding = response.output['embeddings'][0]['embedding']
                 result = {"embedding": embedding, "dimension": len(embedding), "model": model_name, "text_length": len(text)}
@@ -337,8 +2690,8 @@ class ai_semantic_similarity(object):
             dashscope.api_key = api_key
             
             # 获取两个文本的嵌入
-            response1 = dashscope.TextEmbedding.call(model=model_name, input=text1)
-            response2 = dashscope.TextEmbedding.call(model=model_name, input=text2)
+            response1 = _dashscope_call(dashscope.TextEmbedding, model=model_name, input=text1)
+            response2 = _dashscope_call(dashscope.TextEmbedding, model=model_name, input=text2)
             
             if response1.status_code == HTTPStatus.OK and response2.status_code == HTTPStatus.OK:
                 emb1 = response1.output['embeddings'][0]['embedding']
@@ -370,7 +2723,7 @@ class ai_text_clustering_prepare(object):
             
             embeddings = []
             for text in texts:
-                response = dashscope.TextEmbedding.call(model=model_name, input=text)
+                response = _dashscope_call(dashscope.TextEmbedding, model=model_name, input=text)
                 if response.status_code == HTTPStatus.OK:
                     embeddings.append(response.output['embeddings'][0]['embedding'])
                 else:
@@ -392,7 +2745,7 @@ class ai_find_similar_text(object):
             dashscope.api_key = api_key
             
             # 获取查询文本嵌入
-            query_response = dashscope.TextEmbedding.call(model=model_name, input=query_text)
+            query_response = _dashscope_call(dashscope.TextEmbedding, model=model_name, input=query_text)
             if query_response.status_code != HTTPStatus.OK:
                 return json.dumps({"error": True, "message": "查询文本嵌入失败"}, ensure_ascii=False)
             
@@ -400,7 +2753,7 @@ class ai_find_similar_text(object):
             similarities = []
             
             for text in candidate_texts:
-                response = dashscope.TextEmbedding.call(model=model_name, input=text)
+                response = _dashscope_call(dashscope.TextEmbedding, model=model_name, input=text)
                 if response.status_code == HTTPStatus.OK:
                     emb = response.output['embeddings'][0]['embedding']
                     
@@ -422,16 +2775,26 @@ class ai_find_similar_text(object):
 
 @annotate("*->string")
 class ai_document_search(object):
-    def evaluate(self, query, documents_json, api_key, top_k=3, model_name="text-embedding-v4"):
+    def evaluate(self, query, documents_json, api_key, top_k=3, model_name="text-embedding-v4", prefilter_top_n=0):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
         try:
             documents = json.loads(documents_json)  # [{"id": "1", "text": "content"}, ...]
+            total_docs = len(documents)
             dashscope.api_key = api_key
             
+            # 可选的BM25词法预筛选：只对前N个词法候选做嵌入，无任何词项命中时退回全量
+            lexical_candidates = None
+            prefilter_top_n = int(prefilter_top_n or 0)
+            if 0 < prefilter_top_n < total_docs:
+                ranked = _BM25Index([doc["text"] for doc in documents]).top_n(query, prefilter_top_n)
+                if ranked:
+                    documents = [documents[doc_index] for doc_index, _ in ranked]
+                    lexical_candidates = len(documents)
+            
             # 获取查询嵌入
-            query_response = dashscope.TextEmbedding.call(model=model_name, input=query)
+            query_response = _dashscope_call(dashscope.TextEmbedding, model=model_name, input=query)
             if query_response.status_code != HTTPStatus.OK:
                 return json.dumps({"error": True, "message": "查询嵌入失败"}, ensure_ascii=False)
             
@@ -439,7 +2802,7 @@ class ai_document_search(object):
             results = []
             
             for doc in documents:
-                response = dashscope.TextEmbedding.call(model=model_name, input=doc["text"])
+                response = _dashscope_call(dashscope.TextEmbedding, model=model_name, input=doc["text"])
                 if response.status_code == HTTPStatus.OK:
                     emb = response.output['embeddings'][0]['embedding']
                     
@@ -457,7 +2820,104 @@ class ai_document_search(object):
                     })
             
             results.sort(key=lambda x: x["score"], reverse=True)
-            result = {"results": results[:top_k], "query": query, "total_docs": len(documents)}
+            result = {"results": results[:top_k], "query": query, "total_docs": total_docs}
+            if lexical_candidates is not None:
+                result["lexical_candidates"] = lexical_candidates
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
+# ==================== 本地去重函数 (2个) ====================
+
+@annotate("*->string")
+class ai_text_minhash(object):
+    def evaluate(self, text, num_perm=128, threshold=0.8, shingle_size=3):
+        try:
+            num_perm, shingle_size = int(num_perm), int(shingle_size)
+            shingles = _text_shingles(text, shingle_size)
+            signature = _minhash_signature(shingles, num_perm)
+            bands, rows = _lsh_params(float(threshold), num_perm)
+            result = {
+                "signature": signature,
+                "band_keys": _lsh_band_keys(signature, bands, rows),
+                "bands": bands,
+                "rows": rows,
+                "num_perm": num_perm,
+                "shingle_count": len(shingles),
+                "text_length": len(text or "")
+            }
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
+@annotate("*->string")
+class ai_text_near_duplicates(object):
+    def evaluate(self, texts_json, threshold=0.8, ambiguous_threshold=0.5, shingle_size=3, num_perm=128):
+        try:
+            items = json.loads(texts_json)  # ["文本", ...] 或 [{"id": "1", "text": "内容"}, ...]
+            threshold, num_perm, shingle_size = float(threshold), int(num_perm), int(shingle_size)
+            ambiguous_threshold = min(float(ambiguous_threshold), threshold)
+
+            ids, shingle_sets = [], []
+            for index, item in enumerate(items):
+                if isinstance(item, dict):
+                    ids.append(item.get("id", index))
+                    shingle_sets.append(_text_shingles(item.get("text", ""), shingle_size))
+                else:
+                    ids.append(index)
+                    shingle_sets.append(_text_shingles(item, shingle_size))
+
+            # 按较低的模糊阈值分桶，保证模糊区间内的候选对也能被召回
+            bands, rows = _lsh_params(ambiguous_threshold, num_perm)
+            buckets = {}
+            for index, shingles in enumerate(shingle_sets):
+                signature = _minhash_signature(shingles, num_perm)
+                for key in _lsh_band_keys(signature, bands, rows):
+                    buckets.setdefault(key, []).append(index)
+
+            candidates = set()
+            for members in buckets.values():
+                for i in range(len(members)):
+                    for j in range(i + 1, len(members)):
+                        candidates.add((members[i], members[j]))
+
+            # 候选对使用精确Jaccard校验，并用并查集合并重复组
+            parent = list(range(len(items)))
+
+            def find(x):
+                while parent[x] != x:
+                    parent[x] = parent[parent[x]]
+                    x = parent[x]
+                return x
+
+            ambiguous_pairs = []
+            for i, j in sorted(candidates):
+                similarity = _jaccard(shingle_sets[i], shingle_sets[j])
+                if similarity >= threshold:
+                    parent[find(j)] = find(i)
+                elif similarity >= ambiguous_threshold:
+                    ambiguous_pairs.append({"id1": ids[i], "id2": ids[j], "jaccard": round(similarity, 4)})
+
+            members_by_root = {}
+            for index in range(len(items)):
+                members_by_root.setdefault(find(index), []).append(index)
+
+            groups = []
+            for members in members_by_root.values():
+                if len(members) > 1:
+                    groups.append({"group_id": len(groups), "representative": ids[members[0]], "ids": [ids[m] for m in members], "size": len(members)})
+
+            duplicate_count = sum(group["size"] - 1 for group in groups)
+            result = {
+                "groups": groups,
+                "ambiguous_pairs": ambiguous_pairs,
+                "total_texts": len(items),
+                "unique_count": len(items) - duplicate_count,
+                "duplicate_count": duplicate_count,
+                "candidate_pairs": len(candidates),
+                "threshold": threshold,
+                "method": "minhash_lsh"
+            }
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
@@ -466,57 +2926,101 @@ class ai_document_search(object):
 
 @annotate("*->string")
 class ai_image_describe(object):
-    def evaluate(self, image_url, api_key, prompt="描述这张图片", model_name="qwen-vl-plus"):
+    def evaluate(self, image_url, api_key, prompt="描述这张图片", model_name="qwen-vl-plus", preprocess="none", use_cache=False):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
         try:
             dashscope.api_key = api_key
+            fingerprint, data = None, None
+            if use_cache:
+                namespace = f"ai_image_describe|{model_name}|{prompt}"
+                fingerprint, data, cached = _cached_image_lookup(namespace, image_url, near_match=True)
+                if cached is not None:
+                    return _cache_hit_result(cached, image_url=image_url)
+            image_ref, preprocess_info = _prepare_image(image_url, "describe", preprocess, data)
             messages = [
                 {"role": "user", "content": [
-                    {"image": image_url},
+                    {"image": image_ref},
                     {"text": prompt}
                 ]}
             ]
             
-            response = dashscope.MultiModalConversation.call(model=model_name, messages=messages)
-            if response.status_code == HTTPStatus.OK:
-                description = response.output.choices[0].message.content
-                result = {"description": description, "image_url": image_url, "prompt": prompt, "model": model_name}
-                return json.dumps(result, ensure_ascii=False)
-            else:
-                return json.dumps({"error": True, "message": f"图片描述失败: {response.message}"}, ensure_ascii=False)
+            description, error = _multimodal_text(model_name, messages)
+            if error:
+                return json.dumps({"error": True, "message": f"图片描述失败: {error}"}, ensure_ascii=False)
+            result = {"description": description, "image_url": image_url, "prompt": prompt, "model": model_name}
+            if fingerprint:
+                _IMAGE_CACHE.put(namespace, fingerprint, result)
+            if preprocess_info:
+                result["image_preprocess"] = preprocess_info
+            return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
 @annotate("*->string")
 class ai_image_ocr(object):
-    def evaluate(self, image_url, api_key, language="auto", model_name="qwen-vl-plus"):
+    def evaluate(self, image_url, api_key, language="auto", model_name="qwen-vl-plus", preprocess="none", use_cache=False, min_text_score=0, low_text_model="", tile_size=0, max_workers=4):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
         try:
             dashscope.api_key = api_key
+            fingerprint, data = None, None
+            if use_cache:
+                namespace = f"ai_image_ocr|{model_name}|{language}" + (f"|tile{int(tile_size)}" if int(tile_size) > 0 else "")
+                fingerprint, data, cached = _cached_image_lookup(namespace, image_url)
+                if cached is not None:
+                    return _cache_hit_result(cached, image_url=image_url)
+            
+            # 可选的本地文字预筛：文字得分低于阈值的图片直接返回空结果，或改用low_text_model识别
+            action, text_score, data = _ocr_prefilter(image_url, data, min_text_score, low_text_model)
+            prefilter_info = None
+            if text_score is not None:
+                prefilter_info = {"text_score": text_score, "action": action, "stats": dict(_OCR_PREFILTER_STATS)}
+            if action == "skip":
+                result = {"text": "", "image_url": image_url, "language": language, "model": model_name, "skipped": True, "prefilter": prefilter_info}
+                return json.dumps(result, ensure_ascii=False)
+            call_model = low_text_model if action == "downgrade" else model_name
+            
+            # 可选的分块识别：大图切成重叠分块并发识别，合并时去掉重叠区域的重复行
+            if int(tile_size) > 0 and HAS_PIL and HAS_REQUESTS:
+                prompt = f"请识别图片中的文字内容（语言：{language}），按阅读顺序逐行输出，不要添加解释"
+                text, tile_count, failed_tiles = _tiled_recognize([(image_url, data)], prompt, call_model, preprocess, int(tile_size), max_workers=max_workers)[0]
+                if failed_tiles == tile_count:
+                    return json.dumps({"error": True, "message": "OCR识别失败: 所有分块识别均失败"}, ensure_ascii=False)
+                result = {"text": text, "image_url": image_url, "language": language, "model": call_model, "tiles": tile_count, "failed_tiles": failed_tiles}
+                if fingerprint and action == "send" and not failed_tiles:
+                    _IMAGE_CACHE.put(namespace, fingerprint, result)
+                if prefilter_info:
+                    result["prefilter"] = prefilter_info
+                return json.dumps(result, ensure_ascii=False)
+            
+            image_ref, preprocess_info = _prepare_image(image_url, "ocr", preprocess, data)
             messages = [
                 {"role": "user", "content": [
-                    {"image": image_url},
+                    {"image": image_ref},
                     {"text": f"请识别图片中的文字内容（语言：{language}）"}
                 ]}
             ]
             
-            response = dashscope.MultiModalConversation.call(model=model_name, messages=messages)
-            if response.status_code == HTTPStatus.OK:
-                text = response.output.choices[0].message.content
-                result = {"text": text, "image_url": image_url, "language": language, "model": model_name}
-                return json.dumps(result, ensure_ascii=False)
-            else:
-                return json.dumps({"error": True, "message": f"OCR识别失败: {response.message}"}, ensure_ascii=False)
+            text, error = _multimodal_text(call_model, messages)
+            if error:
+                return json.dumps({"error": True, "message": f"OCR识别失败: {error}"}, ensure_ascii=False)
+            result = {"text": text, "image_url": image_url, "language": language, "model": call_model}
+            if fingerprint and action == "send":
+                _IMAGE_CACHE.put(namespace, fingerprint, result)
+            if preprocess_info:
+                result["image_preprocess"] = preprocess_info
+            if prefilter_info:
+                result["prefilter"] = prefilter_info
+            return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
 @annotate("*->string")
 class ai_image_analyze(object):
-    def evaluate(self, image_url, api_key, analysis_type="general", model_name="qwen-vl-plus"):
+    def evaluate(self, image_url, api_key, analysis_type="general", model_name="qwen-vl-plus", preprocess="none", use_cache=False):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -531,42 +3035,55 @@ class ai_image_analyze(object):
             }
             
             prompt = prompts.get(analysis_type, prompts["general"])
+            fingerprint, data = None, None
+            if use_cache:
+                namespace = f"ai_image_analyze|{model_name}|{analysis_type}"
+                fingerprint, data, cached = _cached_image_lookup(namespace, image_url, near_match=True)
+                if cached is not None:
+                    return _cache_hit_result(cached, image_url=image_url)
+            image_ref, preprocess_info = _prepare_image(image_url, "ocr" if analysis_type == "text" else "analyze", preprocess, data)
             messages = [
                 {"role": "user", "content": [
-                    {"image": image_url},
+                    {"image": image_ref},
                     {"text": prompt}
                 ]}
             ]
             
-            response = dashscope.MultiModalConversation.call(model=model_name, messages=messages)
-            if response.status_code == HTTPStatus.OK:
-                analysis = response.output.choices[0].message.content
-                result = {"analysis": analysis, "analysis_type": analysis_type, "image_url": image_url, "model": model_name}
-                return json.dumps(result, ensure_ascii=False)
-            else:
-                return json.dumps({"error": True, "message": f"图片分析失败: {response.message}"}, ensure_ascii=False)
+            analysis, error = _multimodal_text(model_name, messages)
+            if error:
+                return json.dumps({"error": True, "message": f"图片分析失败: {error}"}, ensure_ascii=False)
+            result = {"analysis": analysis, "analysis_type": analysis_type, "image_url": image_url, "model": model_name}
+            if fingerprint:
+                _IMAGE_CACHE.put(namespace, fingerprint, result)
+            if preprocess_info:
+                result["image_preprocess"] = preprocess_info
+            return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
 @annotate("*->string")
 class ai_image_to_embedding(object):
-    def evaluate(self, image_url, api_key, model_name="multimodal-embedding-one-peace-v1"):
+    def evaluate(self, image_url, api_key, model_name="multimodal-embedding-one-peace-v1", use_cache=False):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
         try:
             dashscope.api_key = api_key
-            response = dashscope.MultiModalEmbedding.call(
-                model=model_name,
-                input={"image": image_url}
-            )
-            
-            if response.status_code == HTTPStatus.OK:
-                embedding = response.output['embeddings'][0]['embedding']
-                result = {"embedding": embedding, "dimension": len(embedding), "image_url": image_url, "model": model_name}
-                return json.dumps(result, ensure_ascii=False)
-            else:
-                return json.dumps({"error": True, "message": f"图片嵌入生成失败: {response.message}"}, ensure_ascii=False)
+            fingerprint = None
+            if use_cache:
+                namespace = f"ai_image_to_embedding|{model_name}"
+                fingerprint, _, cached = _cached_image_lookup(namespace, image_url)
+                if cached is not None:
+                    return _cache_hit_result(cached, image_url=image_url)
+            # 与相似度、批量嵌入共用向量存储，同一图片只生成一次向量
+            embeddings, error = _embed_images([image_url], model_name)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
+            embedding = list(embeddings[0])
+            result = {"embedding": embedding, "dimension": len(embedding), "image_url": image_url, "model": model_name}
+            if fingerprint:
+                _IMAGE_CACHE.put(namespace, fingerprint, result)
+            return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
@@ -579,31 +3096,118 @@ class ai_image_similarity(object):
         try:
             dashscope.api_key = api_key
             
-            # 获取两张图片的嵌入
-            response1 = dashscope.MultiModalEmbedding.call(model=model_name, input={"image": image_url1})
-            response2 = dashscope.MultiModalEmbedding.call(model=model_name, input={"image": image_url2})
+            # 获取两张图片的嵌入（并发请求，已生成过的图片直接从向量存储读取）
+            embeddings, error = _embed_images([image_url1, image_url2], model_name)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
-            if response1.status_code == HTTPStatus.OK and response2.status_code == HTTPStatus.OK:
-                emb1 = response1.output['embeddings'][0]['embedding']
-                emb2 = response2.output['embeddings'][0]['embedding']
-                
-                # 计算余弦相似度
-                import math
-                dot_product = sum(a * b for a, b in zip(emb1, emb2))
-                magnitude1 = math.sqrt(sum(a * a for a in emb1))
-                magnitude2 = math.sqrt(sum(a * a for a in emb2))
-                similarity = dot_product / (magnitude1 * magnitude2)
-                
-                result = {"similarity": similarity, "image1": image_url1, "image2": image_url2, "model": model_name}
-                return json.dumps(result, ensure_ascii=False)
-            else:
-                return json.dumps({"error": True, "message": "图片嵌入生成失败"}, ensure_ascii=False)
+            similarity = _cosine_similarity(embeddings[0], embeddings[1])
+            result = {"similarity": similarity, "image1": image_url1, "image2": image_url2, "model": model_name}
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
+@annotate("*->string")
+class ai_image_batch_embedding(object):
+    def evaluate(self, image_urls_json, api_key, model_name="multimodal-embedding-one-peace-v1", max_workers=4):
+        if not HAS_DASHSCOPE:
+            return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
+        
+        try:
+            image_urls = json.loads(image_urls_json)
+            dashscope.api_key = api_key
+            
+            embeddings, error = _embed_images(image_urls, model_name, int(max_workers))
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
+            
+            items = [{"image_url": url, "embedding": list(embedding)} for url, embedding in zip(image_urls, embeddings)]
+            result = {"embeddings": items, "count": len(items), "dimension": len(embeddings[0]) if embeddings else 0, "model": model_name}
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
+@annotate("*->string")
+class ai_image_similarity_matrix(object):
+    def evaluate(self, image_urls_json, api_key, model_name="multimodal-embedding-one-peace-v1", max_workers=4):
+        if not HAS_DASHSCOPE:
+            return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
+        
+        try:
+            image_urls = json.loads(image_urls_json)
+            dashscope.api_key = api_key
+            
+            # 每张图片只生成一次向量，两两相似度在本地计算
+            embeddings, error = _embed_images(image_urls, model_name, int(max_workers))
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
+            
+            norms = [math.sqrt(sum(v * v for v in embedding)) or 1.0 for embedding in embeddings]
+            matrix = [[1.0] * len(embeddings) for _ in embeddings]
+            for i in range(len(embeddings)):
+                for j in range(i + 1, len(embeddings)):
+                    similarity = sum(a * b for a, b in zip(embeddings[i], embeddings[j])) / (norms[i] * norms[j])
+                    matrix[i][j] = matrix[j][i] = similarity
+            
+            result = {"matrix": matrix, "image_urls": image_urls, "count": len(image_urls), "model": model_name}
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
+@annotate("*->string")
+class ai_image_index_add(object):
+    def evaluate(self, index_name, items_json, model_name=""):
+        try:
+            # 支持[{"id": "sku1", "embedding": [...]}]，或直接使用ai_image_to_embedding的输出（以image_url作为id）
+            items = json.loads(items_json)
+            if isinstance(items, dict):
+                items = [items]
+            entries, models = [], set()
+            for item in items:
+                if isinstance(item, str):
+                    item = json.loads(item)
+                entries.append((item.get("id", item.get("image_url")), item["embedding"]))
+                if item.get("model"):
+                    models.add(item["model"])
+            # 向量模型取model_name参数，未指定时取ai_image_to_embedding输出中的model字段
+            if model_name:
+                models.add(model_name)
+            if len(models) > 1:
+                return json.dumps({"error": True, "message": f"向量模型不一致: {', '.join(sorted(models))}"}, ensure_ascii=False)
+            model = models.pop() if models else ""
+            
+            size, dimension = _vector_index(index_name).add(entries, model)
+            result = {"index_name": index_name, "added": len(entries), "size": size, "dimension": dimension, "model": model}
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
+@annotate("*->string")
+class ai_image_index_search(object):
+    def evaluate(self, query_image_url, index_name, api_key, top_k=10, model_name="multimodal-embedding-one-peace-v1"):
+        if not HAS_DASHSCOPE:
+            return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
+        
+        try:
+            if int(top_k) <= 0:
+                return json.dumps({"error": True, "message": "top_k必须为正整数"}, ensure_ascii=False)
+            dashscope.api_key = api_key
+            index = _vector_index(index_name)
+            
+            embeddings, error = _embed_images([query_image_url], model_name)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
+            
+            ranked, index_size = index.search(embeddings[0], top_k, model_name)
+            result = {"results": [{"id": item_id, "score": score} for item_id, score in ranked], "query_image": query_image_url,
+                      "index_name": index_name, "index_size": index_size, "model": model_name}
+            return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
 @annotate("*->string")
 class ai_video_summarize(object):
-    def evaluate(self, video_frames_json, api_key, model_name="qwen-vl-plus"):
+    def evaluate(self, video_frames_json, api_key, model_name="qwen-vl-plus", max_frames=0, dedup_threshold=6):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -611,18 +3215,25 @@ class ai_video_summarize(object):
             frame_urls = json.loads(video_frames_json)
             dashscope.api_key = api_key
             
+            # 可选的关键帧筛选：去掉近似重复的连续帧，最多保留max_frames帧
+            selected = list(range(len(frame_urls)))
+            if int(max_frames) > 0:
+                selected = _select_keyframes(frame_urls, int(max_frames), int(dedup_threshold))
+            
             # 构建消息，包含多个视频帧
             content = []
-            for url in frame_urls:
-                content.append({"image": url})
+            for index in selected:
+                content.append({"image": frame_urls[index]})
             content.append({"text": "请基于这些视频帧生成视频内容摘要"})
             
             messages = [{"role": "user", "content": content}]
             
-            response = dashscope.MultiModalConversation.call(model=model_name, messages=messages)
+            response = _dashscope_call(dashscope.MultiModalConversation, model=model_name, messages=messages)
             if response.status_code == HTTPStatus.OK:
                 summary = response.output.choices[0].message.content
                 result = {"summary": summary, "frame_count": len(frame_urls), "model": model_name}
+                if int(max_frames) > 0:
+                    result.update({"selected_frames": len(selected), "selected_indexes": selected})
                 return json.dumps(result, ensure_ascii=False)
             else:
                 return json.dumps({"error": True, "message": f"视频摘要失败: {response.message}"}, ensure_ascii=False)
@@ -631,7 +3242,7 @@ class ai_video_summarize(object):
 
 @annotate("*->string")
 class ai_chart_analyze(object):
-    def evaluate(self, chart_image_url, api_key, analysis_focus="data", model_name="qwen-vl-plus"):
+    def evaluate(self, chart_image_url, api_key, analysis_focus="data", model_name="qwen-vl-plus", preprocess="none"):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -645,26 +3256,27 @@ class ai_chart_analyze(object):
             }
             
             prompt = focus_prompts.get(analysis_focus, focus_prompts["data"])
+            image_ref, preprocess_info = _prepare_image(chart_image_url, "chart", preprocess)
             messages = [
                 {"role": "user", "content": [
-                    {"image": chart_image_url},
+                    {"image": image_ref},
                     {"text": prompt}
                 ]}
             ]
             
-            response = dashscope.MultiModalConversation.call(model=model_name, messages=messages)
-            if response.status_code == HTTPStatus.OK:
-                analysis = response.output.choices[0].message.content
-                result = {"analysis": analysis, "focus": analysis_focus, "chart_url": chart_image_url, "model": model_name}
-                return json.dumps(result, ensure_ascii=False)
-            else:
-                return json.dumps({"error": True, "message": f"图表分析失败: {response.message}"}, ensure_ascii=False)
+            analysis, error = _multimodal_text(model_name, messages)
+            if error:
+                return json.dumps({"error": True, "message": f"图表分析失败: {error}"}, ensure_ascii=False)
+            result = {"analysis": analysis, "focus": analysis_focus, "chart_url": chart_image_url, "model": model_name}
+            if preprocess_info:
+                result["image_preprocess"] = preprocess_info
+            return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
 @annotate("*->string")
 class ai_document_parse(object):
-    def evaluate(self, doc_images_json, api_key, parse_type="structure", model_name="qwen-vl-plus"):
+    def evaluate(self, doc_images_json, api_key, parse_type="structure", model_name="qwen-vl-plus", mode="single", max_workers=4, merge_model="", tile_size=0):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -680,6 +3292,10 @@ class ai_document_parse(object):
             }
             
             prompt = parse_prompts.get(parse_type, parse_prompts["structure"])
+            if int(tile_size) > 0 and HAS_PIL and HAS_REQUESTS:
+                return self._parse_per_page(image_urls, prompt, parse_type, model_name, max_workers, merge_model, int(tile_size))
+            if mode == "per_page" and len(image_urls) > 1:
+                return self._parse_per_page(image_urls, prompt, parse_type, model_name, max_workers, merge_model)
             
             # 构建消息，包含所有文档页面
             content = []
@@ -689,7 +3305,7 @@ class ai_document_parse(object):
             
             messages = [{"role": "user", "content": content}]
             
-            response = dashscope.MultiModalConversation.call(model=model_name, messages=messages)
+            response = _dashscope_call(dashscope.MultiModalConversation, model=model_name, messages=messages)
             if response.status_code == HTTPStatus.OK:
                 parsed_content = response.output.choices[0].message.content
                 result = {"parsed_content": parsed_content, "parse_type": parse_type, "page_count": len(image_urls), "model": model_name}
@@ -699,11 +3315,68 @@ class ai_document_parse(object):
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
+    def _parse_per_page(self, image_urls, prompt, parse_type, model_name, max_workers, merge_model, tile_size=0):
+        """逐页并发解析并按页码顺序拼接，可选用文本模型合并跨页表格和段落
+
+        tile_size>0时超过该尺寸的页面切成重叠分块，所有页面的分块一起并发识别。
+        """
+        def parse_page(task):
+            index, url = task
+            messages = [{"role": "user", "content": [
+                {"image": url},
+                {"text": f"{prompt}（这是文档的第{index + 1}/{len(image_urls)}页）"}
+            ]}]
+            try:
+                return _multimodal_text(model_name, messages)
+            except Exception as e:
+                return None, str(e)
+        
+        tile_counts = []
+        if tile_size:
+            outputs = []
+            for text, tile_count, failed_tiles in _tiled_recognize([(url, None) for url in image_urls], prompt, model_name, tile_size=tile_size, max_workers=max_workers):
+                outputs.append((None, "所有分块识别均失败") if failed_tiles == tile_count else (text, None))
+                tile_counts.append({"tiles": tile_count, "failed_tiles": failed_tiles})
+        else:
+            outputs = _run_concurrently(parse_page, list(enumerate(image_urls)), max_workers)
+        pages, failed_pages = [], []
+        for index, (content, error) in enumerate(outputs):
+            if error:
+                failed_pages.append(index + 1)
+                pages.append({"page": index + 1, "error": error})
+            else:
+                pages.append({"page": index + 1, "parsed_content": _content_text(content)})
+            if tile_counts:
+                pages[-1].update(tile_counts[index])
+        if len(failed_pages) == len(image_urls):
+            return json.dumps({"error": True, "message": f"文档解析失败: {pages[0]['error']}"}, ensure_ascii=False)
+        
+        parsed_content = "\n\n".join(f"[第{page['page']}页]\n{page['parsed_content']}" for page in pages if "parsed_content" in page)
+        merged, merge_truncated = False, False
+        if merge_model:
+            messages = [
+                {"role": "system", "content": "你是文档整理专家。以下是同一文档逐页解析的结果（以[第N页]分隔）。请按页码顺序输出完整内容，将跨页断开的表格、段落合并为一个整体，不要增删信息，不要添加解释。"},
+                {"role": "user", "content": parsed_content}
+            ]
+            # 合并结果与输入等长，按输入估算输出上限；输入或输出被截断时保留未合并的逐页内容
+            call_info = {}
+            merged_content, error = _generation_text(merge_model, messages, temperature=0.1, call_info=call_info,
+                                                     max_tokens=_estimate_tokens(parsed_content, merge_model) * 5 // 4 + 100)
+            merge_truncated = not error and (call_info.get("truncated") or call_info.get("finish_reason") == "length")
+            if not error and not merge_truncated:
+                parsed_content, merged = merged_content, True
+        
+        result = {"parsed_content": parsed_content, "parse_type": parse_type, "page_count": len(image_urls), "model": model_name,
+                  "mode": "tiled" if tile_size else "per_page", "pages": pages, "failed_pages": failed_pages, "merged": merged}
+        if merge_truncated:
+            result["merge_truncated"] = True
+        return json.dumps(result, ensure_ascii=False)
+
 # ==================== 业务场景函数 (9个) ====================
 
 @annotate("*->string")
 class ai_customer_intent_analyze(object):
-    def evaluate(self, customer_text, api_key, business_context="general", model_name="qwen-plus"):
+    def evaluate(self, customer_text, api_key, business_context="general", model_name="qwen-plus", fast_model="", min_confidence=0.8):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
@@ -716,23 +3389,18 @@ class ai_customer_intent_analyze(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.2)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error, cascade = _cascade_generation(model_name, messages, fast_model, min_confidence, temperature=0.2)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"intent_analysis": full_content}
             
-            result.update({"customer_text": customer_text, "business_context": business_context, "model": model_name})
+            result.update({"customer_text": customer_text, "business_context": business_context, "model": cascade["model"] if cascade else model_name})
+            if cascade:
+                result["cascade"] = cascade
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
@@ -752,19 +3420,12 @@ class ai_sales_lead_score(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.1)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.1)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"lead_score": full_content}
             
@@ -788,19 +3449,12 @@ class ai_review_analyze(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.2)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.2)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"review_analysis": full_content}
             
@@ -811,72 +3465,130 @@ class ai_review_analyze(object):
 
 @annotate("*->string")
 class ai_risk_text_detect(object):
-    def evaluate(self, text, api_key, risk_types="all", model_name="qwen-plus"):
+    def evaluate(self, text, api_key, risk_types="all", model_name="qwen-plus", fast_model="", min_confidence=0.8, prefilter_threshold=0):
+        prefilter = None
+        try:
+            threshold = float(prefilter_threshold)
+        except (TypeError, ValueError) as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+        if threshold > 0:
+            try:
+                passed, prefilter = _risk_prefilter(text, threshold, risk_types)
+            except Exception as e:
+                return json.dumps({"error": True, "message": f"风险词典加载失败: {e}"}, ensure_ascii=False)
+            if passed:
+                return json.dumps({"risk_level": "none", "confidence": _RISK_PREFILTER_CONFIDENCE, "flagged_content": [],
+                                   "action_required": False, "original_text": text, "risk_types": risk_types, "model": "local", "prefilter": prefilter}, ensure_ascii=False)
+
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
         dashscope.api_key = api_key
-        messages = [
-            {"role": "system", "content": f"""你是风险检测专家。检测文本中的各类风险内容。
+        system_prompt = f"""你是风险检测专家。检测文本中的各类风险内容。
 严格按照以下JSON格式返回，不要包含任何解释文字：
-{{"risk_level": "high|medium|low|none", "risk_types": ["欺诈", "违规"], "confidence": 0.95, "flagged_content": ["具体风险文本"], "action_required": true}}（风险类型：{risk_types}）"""},
+{{"risk_level": "high|medium|low|none", "risk_types": ["欺诈", "违规"], "confidence": 0.95, "flagged_content": ["具体风险文本"], "action_required": true}}（风险类型：{risk_types}）"""
+        if prefilter and (prefilter["matches"] or prefilter["signals"]):
+            hints = "、".join(f"{m['text']}({m['category']})" for m in prefilter["matches"]) or "无"
+            system_prompt += f"\n本地规则命中的片段：{hints}；可疑信号：{'、'.join(prefilter['signals']) or '无'}。仅供参考，请结合上下文判断，命中词可能是正常用法。"
+        messages = [
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": text}
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.1)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error, cascade = _cascade_generation(model_name, messages, fast_model, min_confidence, temperature=0.1)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"risk_assessment": full_content}
             
-            result.update({"original_text": text, "risk_types": risk_types, "model": model_name})
+            result.update({"original_text": text, "risk_types": risk_types, "model": cascade["model"] if cascade else model_name})
+            if cascade:
+                result["cascade"] = cascade
+            if prefilter:
+                result["prefilter"] = prefilter
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
 
 @annotate("*->string")
 class ai_contract_extract(object):
-    def evaluate(self, contract_text, api_key, extract_fields="all", model_name="qwen-plus"):
+    def evaluate(self, contract_text, api_key, extract_fields="all", model_name="qwen-plus", mode="single", chunk_tokens=3000, max_workers=4):
         if not HAS_DASHSCOPE:
             return json.dumps({"error": True, "message": "DashScope library not available. Please ensure the deployment package includes all dependencies."}, ensure_ascii=False)
         
         dashscope.api_key = api_key
         messages = [
-            {"role": "system", "content": f"""你是合同信息提取专家。提取合同的关键信息字段。
-严格按照以下JSON格式返回，不要包含任何解释文字：
-{{"parties": ["甲方", "乙方"], "amount": "1000000", "start_date": "2024-01-01", "end_date": "2024-12-31", "key_terms": ["重要条款"], "risk_points": ["风险点"]}}（提取字段：{extract_fields}）"""},
+            {"role": "system", "content": self._system_prompt(extract_fields)},
             {"role": "user", "content": f"合同内容：{contract_text}"}
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.1)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            chunk_tokens = int(chunk_tokens)
+            if chunk_tokens <= 0:
+                return json.dumps({"error": True, "message": "chunk_tokens must be a positive integer"}, ensure_ascii=False)
+            if mode == "chunked" or (mode == "auto" and _estimate_tokens(contract_text, model_name) > chunk_tokens):
+                return self._extract_chunked(contract_text, extract_fields, model_name, chunk_tokens, max_workers)
+            
+            call_info = {}
+            full_content, error = _generation_text(model_name, messages, temperature=0.1, call_info=call_info)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"contract_info": full_content}
             
             result.update({"extract_fields": extract_fields, "contract_length": len(contract_text), "model": model_name})
+            if call_info["truncated"]:
+                result["input_truncated"] = True
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
+
+    def _system_prompt(self, extract_fields):
+        return f"""你是合同信息提取专家。提取合同的关键信息字段。
+严格按照以下JSON格式返回，不要包含任何解释文字：
+{{"parties": ["甲方", "乙方"], "amount": "1000000", "start_date": "2024-01-01", "end_date": "2024-12-31", "key_terms": ["重要条款"], "risk_points": ["风险点"]}}（提取字段：{extract_fields}）"""
+
+    def _extract_chunked(self, contract_text, extract_fields, model_name, chunk_tokens, max_workers):
+        """按条款分块并发提取，签署页所在分块的当事人和日期优先"""
+        chunks = _chunk_contract(contract_text, chunk_tokens, model_name)
+        system_prompt = self._system_prompt(extract_fields) + "\n注意：以下只是合同的一部分，只提取该部分中明确出现的信息，未出现的字段返回空字符串或空数组。"
+
+        def extract(task):
+            index, chunk = task
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"合同内容（第{index + 1}/{len(chunks)}部分）：{chunk}"}
+            ]
+            return _generation_text(model_name, messages, temperature=0.1)
+        
+        try:
+            outputs = _run_concurrently(extract, list(enumerate(chunks)), max_workers)
+            parsed, raw_contents = [], []
+            for content, error in outputs:
+                if error:
+                    return json.dumps({"error": True, "message": error}, ensure_ascii=False)
+                chunk_result = _parse_json_object(content)
+                if chunk_result is None:
+                    raw_contents.append(content)
+                parsed.append(chunk_result or {})
+            
+            signature_chunks = [index for index, chunk in enumerate(chunks) if _SIGNATURE_PATTERN.search(chunk)]
+            signature_chunk = signature_chunks[-1] if signature_chunks else None
+            if any(parsed):
+                result, conflicts = _merge_extracted_fields(parsed, signature_chunk, ("parties", "start_date", "end_date"))
+            else:
+                result, conflicts = {"contract_info": "\n".join(raw_contents)}, {}
+            
+            result.update({"extract_fields": extract_fields, "contract_length": len(contract_text), "model": model_name,
+                           "mode": "chunked", "chunk_count": len(chunks), "signature_chunk": signature_chunk,
+                           "unparsed_chunks": len(raw_contents), "field_conflicts": conflicts})
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
@@ -896,23 +3608,19 @@ class ai_resume_parse(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.1)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            call_info = {}
+            full_content, error = _generation_text(model_name, messages, temperature=0.1, call_info=call_info)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"resume_info": full_content}
             
             result.update({"parse_depth": parse_depth, "resume_length": len(resume_text), "model": model_name})
+            if call_info["truncated"]:
+                result["input_truncated"] = True
             return json.dumps(result, ensure_ascii=False)
         except Exception as e:
             return json.dumps({"error": True, "message": str(e)}, ensure_ascii=False)
@@ -932,19 +3640,12 @@ class ai_customer_segment(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.2)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.2)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"segment": "未知", "scores": {}, "analysis": full_content}
             
@@ -968,19 +3669,12 @@ class ai_product_description_generate(object):
         ]
         
         try:
-            response = dashscope.Generation.call(model=model_name, messages=messages, stream=False, result_format='message', temperature=0.6)
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        full_content = response.output.choices[0].message.content or ""
-                    else:
-                        full_content = ""
-            else:
-                return json.dumps({"error": True, "message": f"API调用失败: {response.message}"}, ensure_ascii=False)
+            full_content, error = _generation_text(model_name, messages, temperature=0.6)
+            if error:
+                return json.dumps({"error": True, "message": error}, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 result = {"product_description": full_content}
             
@@ -999,32 +3693,25 @@ class ai_industry_classification(object):
         ]
         
         try:
-            response = dashscope.Generation.call(
-                model=model_name,
-                messages=messages,
-                stream=False,
-                result_format='message',
+            call_info = {}
+            full_content, error = _generation_text(
+                model_name,
+                messages,
                 temperature=temperature,
+                call_info=call_info,
                 enable_search=enable_search,
                 top_p=0.8
             )
             
-            full_content = ""
-            if response.status_code == HTTPStatus.OK:
-                if hasattr(response.output, 'choices') and len(response.output.choices) > 0:
-                    if hasattr(response.output.choices[0].message, 'content'):
-                        content = response.output.choices[0].message.content
-                        if content:
-                            full_content = content
-            else:
+            if error:
                 error_msg = {
                     "error": True,
-                    "message": f"Request id: {response.request_id}, Status code: {response.status_code}, error code: {response.code}, error message: {response.message}"
+                    "message": f"Request id: {call_info['request_id']}, Status code: {call_info['status_code']}, error code: {call_info['code']}, error message: {call_info['message']}"
                 }
                 return json.dumps(error_msg, ensure_ascii=False)
             
             try:
-                result = json.loads(full_content)
+                result = _load_model_json(full_content)
             except:
                 import re
                 json_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
@@ -1050,6 +3737,9 @@ class ai_industry_classification(object):
             error_msg = {"error": True, "message": str(e)}
             return json.dumps(error_msg, ensure_ascii=False)
 
+# 所有UDF定义完成后统一接入运行指标
+_instrument_udfs(globals())
+
 
 if __name__ == '__main__':
     print("ClickZetta AI Functions Complete Package - 30个生产就绪的AI函数")
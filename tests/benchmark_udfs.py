@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+UDF基准测试
+在离线模拟后端（mock_dashscope.py）上运行全部UDF，按输入规模 x 并发数的网格统计
+吞吐、p50/p95/p99延迟、CPU时间和峰值内存，结果写入JSON（含原始延迟样本和校准耗时）和CSV，
+供scripts/benchmark_gate.py与基线对比。
+
+--repeat N 把整个网格交错运行N轮（每轮按不同顺序遍历单元，输入也按轮次重新生成），
+每个单元额外记录各轮的p50、CPU时间和校准耗时，门禁据此区分代码变化和运行期间的机器抖动。
+
+默认模拟后端零延迟，测得的是包自身（提示词构造、token估算、JSON解析、本地计算等）每行的开销。
+
+用法:
+    python tests/benchmark_udfs.py --output benchmark_results.json --csv benchmark_results.csv
+    python tests/benchmark_udfs.py --functions ai_text_sentiment_analyze,ai_text_summarize --sizes S,L --concurrency 1,8
+    python tests/benchmark_udfs.py --latency lognormal:300:0.4 --rows 100
+    python tests/benchmark_udfs.py --sizes S,M --concurrency 1,4 --rows 50 --repeat 3 --output new.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_dashscope import MockConfig, load_functions
+
+# 输入规模：(文本字符数, 列表类参数的元素个数)
+SIZES = {"S": (200, 5), "M": (2000, 20), "L": (20000, 100)}
+
+API_KEY = "mock-key"
+
+SENTENCES = [
+    "这款产品的质量非常好，物流也很快，客服态度耐心。",
+    "价格有点偏高，希望以后能有更多优惠活动。",
+    "系统上线后查询性能提升明显，但报表导出偶尔超时。",
+    "The delivery was late and the package was damaged.",
+    "Customer support resolved my issue within ten minutes.",
+    "甲方应于合同签订后三十日内支付首期款项，乙方按约定交付。",
+    "候选人具有五年Python开发经验，熟悉数据仓库与机器学习。",
+    "本季度销售额同比增长百分之十二，主要来自华东地区。",
+]
+
+
+def make_text(rng, length):
+    parts, total = [], 0
+    while total < length:
+        sentence = rng.choice(SENTENCES)
+        parts.append(sentence)
+        total += len(sentence)
+    return "".join(parts)[:length]
+
+
+def image_url(index):
+    return f"https://example.invalid/images/{index}.jpg"
+
+
+def build_args(name, size, row, rng):
+    """为指定UDF生成第row行的调用参数"""
+    chars, items = SIZES[size]
+    text = make_text(rng, chars)
+    texts_json = json.dumps([make_text(rng, max(20, chars // items)) for _ in range(items)], ensure_ascii=False)
+    urls_json = json.dumps([image_url(row * items + i) for i in range(items)])
+    record = json.dumps({"name": f"客户{row}", "notes": text}, ensure_ascii=False)
+    single = {
+        "ai_text_minhash": (text,),
+        "ai_text_near_duplicates": (texts_json,),
+        "ai_text_translate": (text, "英文", API_KEY),
+        "ai_semantic_similarity": (text, make_text(rng, chars), API_KEY),
+        "ai_text_clustering_prepare": (texts_json, API_KEY),
+        "ai_find_similar_text": (text[:200], texts_json, API_KEY),
+        "ai_document_search": (text[:50], json.dumps([{"id": str(i), "text": t} for i, t in enumerate(json.loads(texts_json))], ensure_ascii=False), API_KEY),
+        "ai_industry_classification": (text, "请判断所属行业，返回JSON格式{一级行业:xxx,二级行业:xxx}", API_KEY, "qwen-plus"),
+        "ai_customer_segment": (record, API_KEY),
+        "ai_sales_lead_score": (record, API_KEY),
+        "ai_product_description_generate": (record, API_KEY),
+        "ai_image_similarity": (image_url(2 * row), image_url(2 * row + 1), API_KEY),
+        "ai_image_batch_embedding": (urls_json, API_KEY),
+        "ai_image_similarity_matrix": (urls_json, API_KEY),
+        "ai_video_summarize": (urls_json, API_KEY),
+        "ai_document_parse": (urls_json, API_KEY),
+        "ai_image_index_search": (image_url(row), "benchmark", API_KEY),
+        "ai_image_index_add": ("benchmark_add", json.dumps([{"id": f"{row}-{i}", "embedding": [rng.random() for _ in range(256)]} for i in range(items)])),
+    }
+    if name in single:
+        return single[name]
+    if name in ("ai_image_describe", "ai_image_ocr", "ai_image_analyze", "ai_image_to_embedding", "ai_chart_analyze"):
+        return (image_url(row), API_KEY)
+    # 其余函数均为(文本, api_key)
+    return (text, API_KEY)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return round(peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0, 1)
+
+
+# 校准负载：固定的纯Python工作量（JSON序列化、正则、字符串处理），用于在比较时消除机器快慢和运行期间的频率漂移
+_CALIBRATION_TEXT = "".join(SENTENCES) * 60
+
+
+def calibrate(repeats=9):
+    """返回校准负载单次耗时的中位数（毫秒）"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        payload = json.dumps({"text": _CALIBRATION_TEXT, "items": list(range(200))}, ensure_ascii=False)
+        json.loads(payload)
+        sum(len(word) for word in _CALIBRATION_TEXT.split("，"))
+        "".join(sorted(set(_CALIBRATION_TEXT)))
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return round(sorted(timings)[len(timings) // 2], 4)
+
+
+def run_cell(udf_class, name, size, concurrency, rows, warmup, seed, round_index=0):
+    """运行一个(函数, 规模, 并发)单元，返回统计结果和原始延迟样本（毫秒）"""
+    rng = random.Random(f"{seed}|{name}|{size}" + (f"|{round_index}" if round_index else ""))
+    inputs = [build_args(name, size, row, rng) for row in range(rows + warmup)]
+    instance = udf_class()
+
+    def call(args):
+        start = time.perf_counter()
+        result = instance.evaluate(*args)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        return elapsed, isinstance(result, str) and result.startswith('{"error": true')
+
+    for args in inputs[:warmup]:
+        call(args)
+
+    calibration = calibrate()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    if concurrency <= 1:
+        outputs = [call(args) for args in inputs[warmup:]]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outputs = list(executor.map(call, inputs[warmup:]))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    samples = [round(elapsed, 4) for elapsed, _ in outputs]
+    ordered = sorted(samples)
+    return {
+        "function": name,
+        "size": size,
+        "concurrency": concurrency,
+        "rows": rows,
+        "errors": sum(1 for _, failed in outputs if failed),
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(rows / wall, 2) if wall > 0 else None,
+        "mean_ms": round(sum(samples) / len(samples), 4) if samples else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50), 4),
+        "p95_ms": round(percentile(ordered, 0.95), 4),
+        "p99_ms": round(percentile(ordered, 0.99), 4),
+        "cpu_s": round(cpu, 4),
+        "cpu_ms_per_row": round(cpu * 1000.0 / rows, 4) if rows else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "calibration_ms": calibration,
+        "samples_ms": samples,
+    }
+
+
+def merge_rounds(cells):
+    """合并同一单元多轮的结果：延迟样本合并后重新计算分位数，并保留每轮的p50、CPU时间和校准耗时"""
+    if len(cells) == 1:
+        return cells[0]
+    samples = [value for cell in cells for value in cell["samples_ms"]]
+    ordered = sorted(samples)
+    rows = sum(cell["rows"] for cell in cells)
+    wall = sum(cell["wall_s"] for cell in cells)
+    cpu = sum(cell["cpu_s"] for cell in cells)
+    calibrations = sorted(cell["calibration_ms"] for cell in cells)
+    merged = dict(cells[0])
+    merged.update({
+        "rows": rows,
+        "errors": sum(cell["errors"] for cell in cells),
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(rows / wall, 2) if wall > 0 else None,
+        "mean_ms": round(sum(samples) / len(samples), 4) if samples else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50), 4),
+        "p95_ms": round(percentile(ordered, 0.95), 4),
+        "p99_ms": round(percentile(ordered, 0.99), 4),
+        "cpu_s": round(cpu, 4),
+        "cpu_ms_per_row": round(cpu * 1000.0 / rows, 4) if rows else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "calibration_ms": calibrations[len(calibrations) // 2],
+        "repeat": len(cells),
+        "repeat_p50_ms": [cell["p50_ms"] for cell in cells],
+        "repeat_cpu_ms_per_row": [cell["cpu_ms_per_row"] for cell in cells],
+        "repeat_calibration_ms": [cell["calibration_ms"] for cell in cells],
+        "samples_ms": samples,
+    })
+    return merged
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def prepare_index(functions):
+    """ai_image_index_search需要预先写入索引"""
+    embeddings = json.loads(functions.ai_image_batch_embedding().evaluate(json.dumps([image_url(i) for i in range(200)]), API_KEY))
+    functions.ai_image_index_add().evaluate("benchmark", json.dumps(embeddings["embeddings"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDF基准测试（离线模拟后端）")
+    parser.add_argument("--functions", default="", help="逗号分隔的函数名，默认全部")
+    parser.add_argument("--sizes", default="S,M,L", help="输入规模，可选S/M/L")
+    parser.add_argument("--concurrency", default="1,4,16", help="逗号分隔的并发数")
+    parser.add_argument("--rows", type=int, default=100, help="每个单元的调用行数")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--latency", default="none", help="模拟后端延迟分布，见mock_dashscope.MockConfig")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=1, help="交错运行整个网格的轮数，门禁基线使用3")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--csv", default="")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AISQL_INDEX_DIR", tempfile.mkdtemp(prefix="aisql_bench_"))
+    functions = load_functions(MockConfig(latency=args.latency, seed=args.seed))
+    names = sorted(n for n in dir(functions) if n.startswith("ai_") and isinstance(getattr(functions, n), type))
+    if args.functions:
+        wanted = set(args.functions.split(","))
+        names = [n for n in names if n in wanted]
+    sizes = [s for s in args.sizes.split(",") if s in SIZES]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    if "ai_image_index_search" in names:
+        prepare_index(functions)
+
+    grid = [(name, size, concurrency) for name in names for size in sizes for concurrency in levels]
+    repeat = max(1, args.repeat)
+    rounds = {key: [] for key in grid}
+    for round_index in range(repeat):
+        # 第一轮按网格顺序，之后每轮打乱顺序，避免同一单元总落在运行中的同一时段
+        order = list(grid)
+        if round_index:
+            random.Random(f"{args.seed}|round|{round_index}").shuffle(order)
+            print(f"... 第{round_index + 1}/{repeat}轮", flush=True)
+        for name, size, concurrency in order:
+            rounds[(name, size, concurrency)].append(
+                run_cell(getattr(functions, name), name, size, concurrency, args.rows, args.warmup, args.seed, round_index))
+
+    results = []
+    print(f"{'函数':<34}{'规模':<6}{'并发':>4}{'吞吐(行/秒)':>14}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'CPU(ms/行)':>12}{'错误':>6}")
+    for name, size, concurrency in grid:
+        cell = merge_rounds(rounds[(name, size, concurrency)])
+        results.append(cell)
+        print(f"{name:<34}{size:<6}{concurrency:>4}{cell['throughput_rps']:>14}{cell['p50_ms']:>10}{cell['p95_ms']:>10}"
+              f"{cell['p99_ms']:>10}{cell['cpu_ms_per_row']:>12}{cell['errors']:>6}", flush=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency": args.latency,
+            "rows": args.rows,
+            "sizes": ",".join(sizes),
+            "concurrency": ",".join(str(c) for c in levels),
+            "seed": args.seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False)
+    print(f"\n✅ 结果已写入 {args.output}")
+
+    if args.csv:
+        columns = [key for key in results[0] if key != "samples_ms" and not key.startswith("repeat_")] if results else []
+        with open(args.csv, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"✅ 汇总已写入 {args.csv}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+"""
+pytest公共夹具：在离线模拟后端上加载src/ai_functions_complete.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_dashscope import MockConfig, load_functions
+
+
+@pytest.fixture(scope="session")
+def aisql():
+    return load_functions(MockConfig(seed=7))
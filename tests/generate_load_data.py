@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+大规模合成数据生成器
+为缓存、去重、批处理等压测生成百万行级别的仿真数据，固定种子可复现，逐行流式写出JSONL，
+安装pyarrow时可写Parquet。
+
+数据集:
+    reviews   中英文商品评论，可控制完全重复和近似重复比例（dup_of字段记录来源行，便于校验去重结果）
+    contracts 指定长度的合同文本
+    resumes   简历文本
+    images    图片URL列表（重复比例控制跨行复用的URL，模拟缓存命中）
+    frames    视频关键帧URL列表
+
+用法:
+    python tests/generate_load_data.py reviews --rows 1000000 --dup-ratio 0.2 --near-dup-ratio 0.1 --output reviews.jsonl
+    python tests/generate_load_data.py contracts --rows 10000 --chars 8000 --format parquet --output contracts.parquet
+    python tests/generate_load_data.py images --rows 100000 --list-size 20 --dup-ratio 0.3 --output images.jsonl
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# ==================== 语料 ====================
+
+ZH_PRODUCTS = ["手机", "耳机", "笔记本电脑", "智能手表", "空气净化器", "扫地机器人", "咖啡机", "运动鞋", "羽绒服", "电动牙刷", "显示器", "机械键盘"]
+ZH_ASPECTS = ["质量", "做工", "续航", "外观", "性价比", "物流", "包装", "客服", "音质", "屏幕", "手感", "尺码"]
+ZH_POSITIVE = ["非常好", "超出预期", "很满意", "没得说", "比想象中好", "值得推荐", "很给力"]
+ZH_NEGATIVE = ["太差了", "让人失望", "不如描述", "有明显瑕疵", "完全不值这个价", "问题很多"]
+ZH_NEUTRAL = ["一般般", "还行", "中规中矩", "和描述差不多", "凑合能用"]
+ZH_TAILS = ["会回购。", "推荐给朋友了。", "希望改进。", "不会再买了。", "先用一段时间再追评。", "物流三天就到了。", ""]
+
+EN_PRODUCTS = ["phone", "headphones", "laptop", "smartwatch", "air purifier", "robot vacuum", "coffee maker", "running shoes", "jacket", "monitor"]
+EN_ASPECTS = ["build quality", "battery life", "design", "value for money", "delivery", "packaging", "customer service", "sound", "screen", "fit"]
+EN_POSITIVE = ["is excellent", "exceeded my expectations", "is great", "works perfectly", "is worth every penny"]
+EN_NEGATIVE = ["is terrible", "was disappointing", "is not as described", "broke after a week", "is overpriced"]
+EN_NEUTRAL = ["is okay", "is average", "is as expected", "is fine for the price"]
+EN_TAILS = ["Would buy again.", "Recommended.", "Needs improvement.", "Returning it.", "Will update after a month.", ""]
+
+COMPANIES = ["北京星辰科技有限公司", "上海云帆数据有限公司", "深圳前海智造有限公司", "杭州西湖网络科技有限公司", "成都天府软件有限公司", "广州南方贸易有限公司"]
+CONTRACT_ITEMS = ["企业级数据平台软件许可", "年度技术服务", "云主机资源", "定制开发服务", "硬件设备采购", "系统集成服务"]
+CONTRACT_CLAUSES = [
+    "甲方应于合同签订后{days}日内支付合同总额的{pct}%作为预付款，余款在验收合格后{days2}日内付清。",
+    "乙方应于{date}前完成交付，并提供不少于{months}个月的免费质保服务。",
+    "任何一方违反本合同约定，应向守约方支付合同总额{pct}%的违约金。",
+    "双方对在履行本合同过程中知悉的对方商业秘密负有保密义务，保密期限为合同终止后{months}个月。",
+    "因不可抗力导致合同无法履行的，受影响一方应在{days}日内书面通知对方，并提供相关证明。",
+    "本合同履行过程中发生的争议，双方应协商解决；协商不成的，提交甲方所在地人民法院诉讼解决。",
+    "乙方交付的成果物知识产权归甲方所有，乙方保留其既有技术的知识产权。",
+    "验收标准以附件一《技术规格说明书》为准，甲方应在收到交付物后{days}日内完成验收。",
+]
+
+SURNAMES = "王李张刘陈杨赵黄周吴徐孙胡朱高林何郭马罗"
+GIVEN_NAMES = ["伟", "芳", "娜", "敏", "静", "磊", "洋", "勇", "艳", "杰", "涛", "明", "超", "秀英", "建华", "志强"]
+SCHOOLS = ["北京大学", "清华大学", "浙江大学", "复旦大学", "上海交通大学", "南京大学", "武汉大学", "中山大学"]
+MAJORS = ["计算机科学与技术", "软件工程", "统计学", "数学与应用数学", "电子信息工程", "工商管理"]
+TITLES = ["后端开发工程师", "数据工程师", "算法工程师", "产品经理", "测试工程师", "数据分析师"]
+SKILLS = ["Python", "Java", "Go", "SQL", "Spark", "Flink", "Kafka", "Docker", "Kubernetes", "机器学习", "数据仓库", "PyTorch"]
+
+
+# ==================== 数据集 ====================
+
+class _DuplicatePool:
+    """保存已生成的原始行，按比例产出完全重复或近似重复的行"""
+
+    def __init__(self, rng, capacity=10000):
+        self.rng = rng
+        self.capacity = capacity
+        self.items = []
+        self.seen = 0
+
+    def add(self, row_id, value):
+        # 蓄水池抽样，池中始终是已生成行的均匀样本
+        self.seen += 1
+        if len(self.items) < self.capacity:
+            self.items.append((row_id, value))
+        else:
+            slot = self.rng.randrange(self.seen)
+            if slot < self.capacity:
+                self.items[slot] = (row_id, value)
+
+    def pick(self):
+        return self.rng.choice(self.items) if self.items else None
+
+
+def _perturb(rng, text):
+    """近似重复：少量标点、空白和字符扰动"""
+    chars = list(text)
+    for _ in range(max(1, len(chars) // 40)):
+        action = rng.random()
+        position = rng.randrange(len(chars)) if chars else 0
+        if action < 0.4 and chars:
+            chars[position] = rng.choice("，。！、 ,.!")
+        elif action < 0.7:
+            chars.insert(position, rng.choice(" ！～"))
+        elif chars:
+            del chars[position]
+    return "".join(chars).strip() or text
+
+
+def _review_text(rng, lang):
+    if lang == "en":
+        sentiment = rng.choices(["positive", "negative", "neutral"], weights=[6, 2, 2])[0]
+        phrases = {"positive": EN_POSITIVE, "negative": EN_NEGATIVE, "neutral": EN_NEUTRAL}[sentiment]
+        product = rng.choice(EN_PRODUCTS)
+        parts = [f"The {rng.choice(EN_ASPECTS)} of this {product} {rng.choice(phrases)}."]
+        for _ in range(rng.randint(0, 3)):
+            parts.append(f"The {rng.choice(EN_ASPECTS)} {rng.choice(EN_POSITIVE + EN_NEGATIVE + EN_NEUTRAL)}.")
+        parts.append(rng.choice(EN_TAILS))
+        return " ".join(p for p in parts if p), sentiment, product
+    sentiment = rng.choices(["positive", "negative", "neutral"], weights=[6, 2, 2])[0]
+    phrases = {"positive": ZH_POSITIVE, "negative": ZH_NEGATIVE, "neutral": ZH_NEUTRAL}[sentiment]
+    product = rng.choice(ZH_PRODUCTS)
+    parts = [f"这款{product}的{rng.choice(ZH_ASPECTS)}{rng.choice(phrases)}，"]
+    for _ in range(rng.randint(0, 3)):
+        parts.append(f"{rng.choice(ZH_ASPECTS)}{rng.choice(ZH_POSITIVE + ZH_NEGATIVE + ZH_NEUTRAL)}，")
+    parts.append(rng.choice(ZH_TAILS) or "总体来说就这样。")
+    return "".join(parts), sentiment, product
+
+
+def generate_reviews(rng, rows, args):
+    pool = _DuplicatePool(rng)
+    ratings = {"positive": (4, 5), "neutral": (3, 3), "negative": (1, 2)}
+    for index in range(rows):
+        row_id = f"R{index:09d}"
+        lang = args.lang if args.lang != "mixed" else ("en" if rng.random() < args.en_ratio else "zh")
+        roll = rng.random()
+        source = pool.pick() if roll < args.dup_ratio + args.near_dup_ratio else None
+        if source is not None:
+            source_id, (text, sentiment, product, lang) = source
+            kind = "exact" if roll < args.dup_ratio else "near"
+            if kind == "near":
+                text = _perturb(rng, text)
+            yield {"id": row_id, "lang": lang, "product": product, "rating": rng.randint(*ratings[sentiment]),
+                   "sentiment": sentiment, "text": text, "dup_of": source_id, "dup_kind": kind}
+            continue
+        text, sentiment, product = _review_text(rng, lang)
+        pool.add(row_id, (text, sentiment, product, lang))
+        yield {"id": row_id, "lang": lang, "product": product, "rating": rng.randint(*ratings[sentiment]),
+               "sentiment": sentiment, "text": text, "dup_of": None, "dup_kind": None}
+
+
+def _contract_text(rng, contract_id, chars):
+    party_a, party_b = rng.sample(COMPANIES, 2)
+    item = rng.choice(CONTRACT_ITEMS)
+    amount = rng.randrange(10, 5000) * 10000
+    lines = [f"{item}合同", f"合同编号：{contract_id}", f"签订日期：20{rng.randint(20, 26)}年{rng.randint(1, 12)}月{rng.randint(1, 28)}日",
+             f"甲方：{party_a}", f"乙方：{party_b}", f"合同金额：人民币{amount}元"]
+    clause_no = 1
+    total = sum(len(line) for line in lines)
+    while total < chars:
+        clause = rng.choice(CONTRACT_CLAUSES).format(
+            days=rng.choice([5, 7, 10, 15, 30]), days2=rng.choice([15, 30, 60]), pct=rng.choice([5, 10, 20, 30]),
+            months=rng.choice([6, 12, 24, 36]), date=f"20{rng.randint(24, 27)}年{rng.randint(1, 12)}月{rng.randint(1, 28)}日")
+        line = f"第{clause_no}条 {clause}"
+        lines.append(line)
+        total += len(line)
+        clause_no += 1
+    return "\n".join(lines)[:chars] if chars else "\n".join(lines), party_a, party_b, amount
+
+
+def generate_contracts(rng, rows, args):
+    pool = _DuplicatePool(rng)
+    for index in range(rows):
+        row_id = f"CTR-{index:09d}"
+        chars = rng.randint(args.chars // 2, args.chars) if args.vary_length else args.chars
+        source = pool.pick() if rng.random() < args.dup_ratio else None
+        if source is not None:
+            source_id, (text, party_a, party_b, amount) = source
+            yield {"id": row_id, "party_a": party_a, "party_b": party_b, "amount": amount, "text": text, "dup_of": source_id}
+            continue
+        text, party_a, party_b, amount = _contract_text(rng, row_id, chars)
+        pool.add(row_id, (text, party_a, party_b, amount))
+        yield {"id": row_id, "party_a": party_a, "party_b": party_b, "amount": amount, "text": text, "dup_of": None}
+
+
+def generate_resumes(rng, rows, args):
+    for index in range(rows):
+        name = rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES)
+        years = rng.randint(0, 15)
+        skills = rng.sample(SKILLS, rng.randint(3, 7))
+        start = rng.randint(2000, 2018)
+        lines = ["个人简历", f"姓名：{name}", f"电话：1{rng.randint(3, 9)}{rng.randint(0, 9)}****{rng.randint(1000, 9999)}",
+                 f"邮箱：user{index}@example.com", "教育背景",
+                 f"{start}.09-{start + 4}.06  {rng.choice(SCHOOLS)}  {rng.choice(MAJORS)}  {rng.choice(['本科', '硕士', '博士'])}",
+                 "工作经历"]
+        year = start + 4
+        for _ in range(max(1, years // 3)):
+            span = rng.randint(1, 4)
+            lines.append(f"{year}-{year + span}  {rng.choice(COMPANIES)}  {rng.choice(TITLES)}")
+            lines.append(f"负责{rng.choice(['数据平台建设', '核心交易系统', '推荐系统', '报表系统', '实时计算链路'])}，"
+                         f"{rng.choice(['性能提升', '成本降低', '故障率下降'])}{rng.randint(10, 80)}%。")
+            year += span
+        lines.append("专业技能：" + "、".join(skills))
+        yield {"id": f"CV{index:09d}", "name": name, "years": years, "skills": skills, "text": "\n".join(lines)}
+
+
+def generate_images(rng, rows, args):
+    """重复比例控制列表中复用已出现URL的比例，用于模拟embedding缓存命中"""
+    issued = 0
+    for index in range(rows):
+        urls = []
+        for _ in range(args.list_size):
+            if issued and rng.random() < args.dup_ratio:
+                urls.append(f"{args.base_url}/{rng.randrange(issued)}.jpg")
+            else:
+                urls.append(f"{args.base_url}/{issued}.jpg")
+                issued += 1
+        yield {"id": f"IMG{index:09d}", "image_urls": json.dumps(urls)}
+
+
+def generate_frames(rng, rows, args):
+    for index in range(rows):
+        fps = rng.choice([1, 2, 5])
+        duration = rng.randint(10, 600)
+        count = min(args.list_size, duration * fps)
+        step = max(1, duration * fps // count)
+        frames = [f"{args.base_url}/video_{index}/frame_{i * step:06d}.jpg" for i in range(count)]
+        yield {"id": f"VID{index:09d}", "fps": fps, "duration_s": duration, "frame_urls": json.dumps(frames)}
+
+
+DATASETS = {
+    "reviews": generate_reviews,
+    "contracts": generate_contracts,
+    "resumes": generate_resumes,
+    "images": generate_images,
+    "frames": generate_frames,
+}
+
+
+# ==================== 写出 ====================
+
+def write_jsonl(rows, path):
+    count = 0
+    f = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+    try:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return count
+
+
+def write_parquet(rows, path, batch_size):
+    writer, batch, count = None, [], 0
+    try:
+        for row in rows:
+            # 列表字段序列化为JSON字符串，与UDF的入参格式一致
+            batch.append({k: json.dumps(v, ensure_ascii=False) if isinstance(v, list) else v for k, v in row.items()})
+            if len(batch) >= batch_size:
+                table = pyarrow.Table.from_pylist(batch) if writer is None else pyarrow.Table.from_pylist(batch, schema=writer.schema)
+                writer = writer or pyarrow.parquet.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                count += len(batch)
+                batch = []
+        if batch:
+            table = pyarrow.Table.from_pylist(batch) if writer is None else pyarrow.Table.from_pylist(batch, schema=writer.schema)
+            writer = writer or pyarrow.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大规模合成压测数据生成器")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="-", help="输出路径，'-'表示标准输出（仅JSONL）")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--batch-size", type=int, default=50000, help="Parquet每个行组的行数")
+    parser.add_argument("--dup-ratio", type=float, default=0.0, help="完全重复行（图片数据集为URL复用）的比例")
+    parser.add_argument("--near-dup-ratio", type=float, default=0.0, help="近似重复评论的比例（仅reviews）")
+    parser.add_argument("--lang", choices=["zh", "en", "mixed"], default="mixed", help="评论语言（仅reviews）")
+    parser.add_argument("--en-ratio", type=float, default=0.3, help="mixed模式下英文评论的比例")
+    parser.add_argument("--chars", type=int, default=3000, help="合同文本最大字符数")
+    parser.add_argument("--vary-length", action="store_true", help="合同长度在chars/2到chars之间随机")
+    parser.add_argument("--list-size", type=int, default=10, help="每行图片URL或关键帧数量")
+    parser.add_argument("--base-url", default="https://example.invalid/images")
+    args = parser.parse_args()
+
+    if args.dup_ratio + args.near_dup_ratio > 1:
+        parser.error("--dup-ratio与--near-dup-ratio之和不能超过1")
+    if args.format == "parquet":
+        if not HAS_PYARROW:
+            parser.error("写Parquet需要安装pyarrow: pip install pyarrow")
+        if args.output == "-":
+            parser.error("Parquet格式需要指定--output文件路径")
+
+    rng = random.Random(args.seed)
+    rows = DATASETS[args.dataset](rng, args.rows, args)
+    start = time.perf_counter()
+    count = write_parquet(rows, args.output, args.batch_size) if args.format == "parquet" else write_jsonl(rows, args.output)
+    elapsed = time.perf_counter() - start
+    print(f"✅ {args.dataset}: {count} 行, 耗时 {elapsed:.1f}s, 输出 {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
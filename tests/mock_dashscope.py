@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+离线DashScope模拟后端
+不需要API密钥和网络，用于在CI或隔离环境中测试、压测UDF层
+
+提供两种形态，共用同一个MockBackend：
+1. 进程内替身：install()把模拟的dashscope模块注册到sys.modules，随后导入ai_functions_complete即可
+2. 本地HTTP服务：按DashScope REST接口路径响应，真实SDK设置base_http_api_url后即可连接
+
+覆盖Generation、TextEmbedding、MultiModalConversation、MultiModalEmbedding四个接口，支持：
+- 可配置的延迟分布（fixed/uniform/normal/lognormal）
+- 限流（每秒请求数，超出返回429 Throttling.RateQuota）
+- 错误注入（按比例返回500或抛出连接异常）
+- 确定性输出：相同请求总是得到相同结果；提示词中带JSON格式示例的函数按示例结构生成结果
+
+用法:
+    # 进程内
+    from mock_dashscope import MockConfig, load_functions
+    functions = load_functions(MockConfig(latency="lognormal:200:0.4", error_rate=0.01))
+    functions.ai_text_sentiment_analyze().evaluate("很好", "mock-key")
+
+    # HTTP服务
+    python tests/mock_dashscope.py --port 8089 --latency fixed:100 --rps 50
+    export DASHSCOPE_HTTP_BASE_URL=http://127.0.0.1:8089/api/v1
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# 各向量模型的输出维度，未列出的模型使用1024
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-v1": 1536,
+    "text-embedding-v2": 1536,
+    "text-embedding-v3": 1024,
+    "text-embedding-v4": 1024,
+    "multimodal-embedding-one-peace-v1": 1536,
+    "multimodal-embedding-v1": 1024,
+}
+
+# 合成文本使用的词表（中英混合，便于覆盖token估算的两种分支）
+VOCABULARY = ["数据", "分析", "客户", "产品", "服务", "质量", "价格", "物流", "体验", "建议",
+              "model", "latency", "quality", "report", "summary", "平台", "系统", "性能", "成本", "用户"]
+
+ENDPOINTS = {
+    "/api/v1/services/aigc/text-generation/generation": "generation",
+    "/api/v1/services/embeddings/text-embedding/text-embedding": "text_embedding",
+    "/api/v1/services/aigc/multimodal-generation/generation": "multimodal_conversation",
+    "/api/v1/services/embeddings/multimodal-embedding/multimodal-embedding": "multimodal_embedding",
+}
+
+
+class MockConfig(object):
+    """模拟后端配置
+
+    latency: 延迟分布，none / fixed:毫秒 / uniform:最小:最大 / normal:均值:标准差 / lognormal:中位数:sigma
+    rps: 每秒允许的请求数，0表示不限流
+    error_rate: 返回500 InternalError的比例
+    exception_rate: 直接抛出ConnectionError的比例（模拟网络中断，仅进程内替身）
+    seed: 延迟和错误注入使用的随机种子
+    canned: {系统提示词片段: 固定返回内容}，命中时Generation直接返回该内容
+    """
+
+    def __init__(self, latency="none", rps=0, error_rate=0.0, exception_rate=0.0, seed=42, canned=None):
+        self.latency = latency
+        self.rps = float(rps)
+        self.error_rate = float(error_rate)
+        self.exception_rate = float(exception_rate)
+        self.seed = seed
+        self.canned = canned or {}
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).digest()
+
+
+def _token_count(text):
+    return max(1, int(len(text) / 1.5))
+
+
+class MockBackend(object):
+    """模拟DashScope接口的核心实现，返回(HTTP状态码, 响应体字典)"""
+
+    def __init__(self, config=None):
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.allowance = self.config.rps
+        self.checked = time.monotonic()
+        self.counts = {}
+
+    # ---------- 延迟、限流、错误注入 ----------
+
+    def _sample_latency(self):
+        spec = (self.config.latency or "none").split(":")
+        kind, args = spec[0], [float(v) for v in spec[1:]]
+        with self.lock:
+            if kind == "fixed":
+                value = args[0]
+            elif kind == "uniform":
+                value = self.rng.uniform(args[0], args[1])
+            elif kind == "normal":
+                value = max(0.0, self.rng.gauss(args[0], args[1]))
+            elif kind == "lognormal":
+                value = args[0] * self.rng.lognormvariate(0.0, args[1])
+            else:
+                value = 0.0
+        return value / 1000.0
+
+    def _throttled(self):
+        if self.config.rps <= 0:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.config.rps, self.allowance + (now - self.checked) * self.config.rps)
+            self.checked = now
+            if self.allowance < 1.0:
+                return True
+            self.allowance -= 1.0
+            return False
+
+    def _begin(self, api):
+        """记录调用并按配置注入延迟和故障，返回错误响应或None"""
+        with self.lock:
+            self.counts[api] = self.counts.get(api, 0) + 1
+            roll = self.rng.random()
+        request_id = "mock-%016x" % random.getrandbits(64)
+        if self._throttled():
+            return 429, {"code": "Throttling.RateQuota", "message": "Requests rate limit exceeded, please try again later.", "request_id": request_id}
+        delay = self._sample_latency()
+        if delay > 0:
+            time.sleep(delay)
+        if roll < self.config.exception_rate:
+            raise ConnectionError("mock connection reset")
+        if roll < self.config.exception_rate + self.config.error_rate:
+            return 500, {"code": "InternalError", "message": "mock internal error", "request_id": request_id}
+        return None
+
+    # ---------- 确定性输出 ----------
+
+    @staticmethod
+    def _synthetic_text(seed, length):
+        rng = random.Random(seed)
+        return "".join(rng.choice(VOCABULARY) for _ in range(max(1, length // 2)))[:max(1, length)]
+
+    @classmethod
+    def _fill_template(cls, template, seed):
+        """按提示词中的JSON示例生成同结构的结果：a|b|c取其一，数值在示例附近浮动"""
+        rng = random.Random(seed)
+
+        def fill(value):
+            if isinstance(value, dict):
+                return {key: fill(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [fill(item) for item in value]
+            if isinstance(value, bool):
+                return rng.random() < 0.5
+            if isinstance(value, (int, float)):
+                if 0 < value <= 1:
+                    return round(rng.uniform(0.5, 1.0), 2)
+                return type(value)(round(value * rng.uniform(0.6, 1.1), 1))
+            if isinstance(value, str) and "|" in value:
+                return rng.choice(value.split("|"))
+            return value
+        return fill(template)
+
+    @staticmethod
+    def _json_template(system_prompt):
+        """提取系统提示词中'JSON格式'之后的第一个JSON对象示例"""
+        start = system_prompt.find("{", max(0, system_prompt.find("JSON")))
+        if start < 0:
+            return None
+        depth = 0
+        for index in range(start, len(system_prompt)):
+            if system_prompt[index] == "{":
+                depth += 1
+            elif system_prompt[index] == "}":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        return json.loads(system_prompt[start:index + 1])
+                    except ValueError:
+                        return None
+        return None
+
+    @staticmethod
+    def _message_text(messages):
+        parts = []
+        for message in messages or []:
+            content = message.get("content")
+            if isinstance(content, list):
+                parts.extend(str(item.get("text", "")) for item in content if isinstance(item, dict))
+            else:
+                parts.append(str(content or ""))
+        return "".join(parts)
+
+    def generation(self, model, messages, **kwargs):
+        failure = self._begin("generation")
+        if failure:
+            return failure
+        system_prompt = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        user_text = messages[-1].get("content", "") if messages else ""
+        seed = _digest("generation", model, messages)
+        content = None
+        for fragment, canned in self.config.canned.items():
+            if fragment in system_prompt:
+                content = canned if isinstance(canned, str) else json.dumps(canned, ensure_ascii=False)
+                break
+        if content is None:
+            template = self._json_template(system_prompt)
+            if template is not None:
+                content = json.dumps(self._fill_template(template, seed), ensure_ascii=False)
+            else:
+                length = min(max(len(str(user_text)) // 4, 20), int(kwargs.get("max_tokens") or 400))
+                content = self._synthetic_text(seed, length)
+        input_tokens = _token_count(self._message_text(messages))
+        output_tokens = _token_count(content)
+        return 200, {
+            "request_id": "mock-" + seed[:8].hex(),
+            "output": {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": content}}]},
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens},
+        }
+
+    @staticmethod
+    def _vector(model, item):
+        """按(模型, 输入)生成确定性的单位向量"""
+        dimension = EMBEDDING_DIMENSIONS.get(model, 1024)
+        values, counter = [], 0
+        while len(values) < dimension:
+            block = _digest("embedding", model, item, counter)
+            values.extend(v / 2147483648.0 for v in struct.unpack("<8i", block))
+            counter += 1
+        values = values[:dimension]
+        norm = sum(v * v for v in values) ** 0.5 or 1.0
+        return [round(v / norm, 6) for v in values]
+
+    def text_embedding(self, model, input, **kwargs):
+        failure = self._begin("text_embedding")
+        if failure:
+            return failure
+        texts = input if isinstance(input, list) else [input]
+        embeddings = [{"text_index": i, "embedding": self._vector(model, text)} for i, text in enumerate(texts)]
+        return 200, {
+            "request_id": "mock-" + _digest("text_embedding", model, texts)[:8].hex(),
+            "output": {"embeddings": embeddings},
+            "usage": {"total_tokens": sum(_token_count(str(text)) for text in texts)},
+        }
+
+    def multimodal_conversation(self, model, messages, **kwargs):
+        failure = self._begin("multimodal_conversation")
+        if failure:
+            return failure
+        images = [item["image"] for m in messages if isinstance(m.get("content"), list)
+                  for item in m["content"] if isinstance(item, dict) and "image" in item]
+        seed = _digest("multimodal", model, messages)
+        text = self._synthetic_text(seed, 60 + 40 * len(images))
+        input_tokens = _token_count(self._message_text(messages))
+        return 200, {
+            "request_id": "mock-" + seed[:8].hex(),
+            "output": {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": [{"text": text}]}}]},
+            "usage": {"input_tokens": input_tokens, "output_tokens": _token_count(text), "image_tokens": 1000 * len(images)},
+        }
+
+    def multimodal_embedding(self, model, input, **kwargs):
+        failure = self._begin("multimodal_embedding")
+        if failure:
+            return failure
+        items = input if isinstance(input, list) else [input]
+        # one-peace把多个输入融合为一个向量，其他模型逐项返回
+        if model.startswith("multimodal-embedding-one-peace"):
+            embeddings = [{"index": 0, "type": "fusion", "embedding": self._vector(model, items)}]
+        else:
+            embeddings = [{"index": i, "type": "image" if "image" in item else "text", "embedding": self._vector(model, item)}
+                          for i, item in enumerate(items)]
+        return 200, {
+            "request_id": "mock-" + _digest("multimodal_embedding", model, items)[:8].hex(),
+            "output": {"embeddings": embeddings},
+            "usage": {"input_tokens": 0, "image_count": len(items)},
+        }
+
+
+# ==================== 进程内替身 ====================
+
+class _AttrDict(dict):
+    """与DashScope SDK的响应对象一样，既可按键也可按属性访问"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _wrap(value):
+    if isinstance(value, dict):
+        return _AttrDict((key, _wrap(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_wrap(item) for item in value]
+    return value
+
+
+def _response(status_code, body):
+    return _AttrDict(status_code=status_code, request_id=body.get("request_id", ""), code=body.get("code", ""),
+                     message=body.get("message", ""), output=_wrap(body.get("output")), usage=_wrap(body.get("usage")))
+
+
+def build_module(backend):
+    """构造与dashscope包接口一致的模块对象"""
+    module = types.ModuleType("dashscope")
+    module.api_key = None
+    module.backend = backend
+
+    def api(name, method):
+        return type(name, (object,), {"call": staticmethod(lambda **kwargs: _response(*method(**kwargs)))})
+
+    module.Generation = api("Generation", backend.generation)
+    module.TextEmbedding = api("TextEmbedding", backend.text_embedding)
+    module.MultiModalConversation = api("MultiModalConversation", backend.multimodal_conversation)
+    module.MultiModalEmbedding = api("MultiModalEmbedding", backend.multimodal_embedding)
+    return module
+
+
+def install(config=None):
+    """把模拟的dashscope模块注册到sys.modules，返回其后端（可读取backend.counts）"""
+    backend = MockBackend(config)
+    sys.modules["dashscope"] = build_module(backend)
+    return backend
+
+
+def load_functions(config=None):
+    """安装模拟后端并（重新）导入src/ai_functions_complete.py，返回模块"""
+    install(config)
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    if "ai_functions_complete" in sys.modules:
+        return importlib.reload(sys.modules["ai_functions_complete"])
+    return importlib.import_module("ai_functions_complete")
+
+
+# ==================== 本地HTTP服务 ====================
+
+def make_server(backend, host="127.0.0.1", port=8089):
+    """按DashScope REST接口路径提供服务，响应格式与线上一致"""
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            method = ENDPOINTS.get(self.path.split("?")[0])
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if method is None:
+                status, body = 404, {"code": "NotFound", "message": f"unknown endpoint {self.path}"}
+            else:
+                request = payload.get("input", {})
+                kwargs = dict(payload.get("parameters") or {})
+                if method in ("generation", "multimodal_conversation"):
+                    kwargs["messages"] = request.get("messages", [])
+                elif method == "text_embedding":
+                    kwargs["input"] = request.get("texts", [])
+                else:
+                    kwargs["input"] = request.get("contents", [])
+                try:
+                    status, body = getattr(backend, method)(payload.get("model", ""), **kwargs)
+                except ConnectionError:
+                    self.close_connection = True
+                    return
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer((host, int(port)), _Handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线DashScope模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="none", help="延迟分布，如fixed:100、lognormal:200:0.4")
+    parser.add_argument("--rps", type=float, default=0, help="每秒请求上限，0表示不限流")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    backend = MockBackend(MockConfig(args.latency, args.rps, args.error_rate, seed=args.seed))
+    server = make_server(backend, args.host, args.port)
+    print(f"🚀 模拟DashScope服务: http://{args.host}:{args.port}/api/v1")
+    print(f"   export DASHSCOPE_HTTP_BASE_URL=http://{args.host}:{args.port}/api/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n调用次数: {backend.counts}")
+
+
+if __name__ == '__main__':
+    main()
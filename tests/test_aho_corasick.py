@@ -0,0 +1,38 @@
+"""Aho-Corasick多模式匹配：重叠匹配、后缀匹配与逐词暴力查找一致"""
+import random
+
+
+def spans(matches):
+    return sorted((start, end, word) for start, end, word, _ in matches)
+
+
+def brute_force(words, text):
+    text = text.lower()
+    return sorted((i, i + len(w), w) for w in words for i in range(len(text) - len(w) + 1) if text.startswith(w, i))
+
+
+def test_overlapping_and_suffix_matches(aisql):
+    matcher = aisql._AhoCorasick({"he": 1, "she": 2, "his": 3, "hers": 4})
+    assert spans(matcher.find("ushers")) == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+    assert spans(matcher.find("ahishers")) == [(1, 4, "his"), (3, 6, "she"), (4, 6, "he"), (4, 8, "hers")]
+
+
+def test_cjk_suffix_and_nested_words(aisql):
+    matcher = aisql._AhoCorasick({"刷单": "a", "刷单返利": "b", "返利": "c", "单返": "d"})
+    assert spans(matcher.find("兼职刷单返利日结")) == [(2, 4, "刷单"), (2, 6, "刷单返利"), (3, 5, "单返"), (4, 6, "返利")]
+
+
+def test_payload_and_case_insensitive(aisql):
+    matcher = aisql._AhoCorasick({"Casino": ("赌博", 0.6), "": None})
+    assert matcher.find("Online CASINO") == [(7, 13, "casino", ("赌博", 0.6))]
+    assert matcher.find("") == []
+
+
+def test_matches_brute_force(aisql):
+    rng = random.Random(3)
+    alphabet = "ab退款"
+    words = sorted({"".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(30)})
+    matcher = aisql._AhoCorasick({word: None for word in words})
+    for _ in range(50):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert spans(matcher.find(text)) == brute_force(words, text)
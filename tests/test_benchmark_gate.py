@@ -0,0 +1,89 @@
+"""基准回归门禁：代码不变时应通过，单个单元明显变慢或整体变慢时应失败"""
+import copy
+import json
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GATE = os.path.join(ROOT, "scripts", "benchmark_gate.py")
+BASELINE = os.path.join(ROOT, "tests", "benchmark_baseline.json")
+
+
+def load_baseline():
+    with open(BASELINE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_gate(tmp_path, report, *extra):
+    path = tmp_path / "new.json"
+    path.write_text(json.dumps(report), encoding="utf-8")
+    return subprocess.run([sys.executable, GATE, str(path), "--baseline", BASELINE] + list(extra), capture_output=True, text=True)
+
+
+def scale_cell(cell, factor, calibration_factor=1.0):
+    for key in ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "cpu_ms_per_row"):
+        cell[key] = cell[key] * factor * calibration_factor
+    cell["samples_ms"] = [value * factor * calibration_factor for value in cell["samples_ms"]]
+    cell["calibration_ms"] *= calibration_factor
+    rounds = len(cell.get("repeat_p50_ms") or [])
+    if rounds:
+        cell["repeat_p50_ms"] = [value * factor * calibration_factor for value in cell["repeat_p50_ms"]]
+        cell["repeat_calibration_ms"] = [value * calibration_factor for value in cell["repeat_calibration_ms"]]
+
+
+def equivalent_run(seed=1, machine=1.3):
+    """模拟同一份代码在更慢的机器上重跑：校准耗时整体变慢，各单元再叠加小幅随机抖动"""
+    report = copy.deepcopy(load_baseline())
+    rng = random.Random(seed)
+    for cell in report["results"]:
+        scale_cell(cell, rng.lognormvariate(0.0, 0.05), machine)
+    return report
+
+
+def test_baseline_has_repeated_rounds():
+    report = load_baseline()
+    assert report["meta"]["repeat"] >= 3
+    assert all(len(cell["repeat_p50_ms"]) == report["meta"]["repeat"] for cell in report["results"])
+
+
+def test_gate_passes_against_itself(tmp_path):
+    result = run_gate(tmp_path, load_baseline())
+    assert result.returncode == 0, result.stdout
+
+
+def test_gate_passes_against_equivalent_run(tmp_path):
+    for seed in range(3):
+        result = run_gate(tmp_path, equivalent_run(seed))
+        assert result.returncode == 0, result.stdout
+
+
+def test_gate_flags_a_slow_cell(tmp_path):
+    report = equivalent_run()
+    target = max(report["results"], key=lambda cell: cell["p50_ms"])
+    scale_cell(target, 2.5)
+    result = run_gate(tmp_path, report)
+    assert result.returncode == 1
+    flagged = [line for line in result.stdout.splitlines() if "REGRESSION" in line and target["function"] in line]
+    assert flagged, result.stdout
+
+
+def test_gate_flags_uniform_slowdown(tmp_path):
+    report = copy.deepcopy(load_baseline())
+    for cell in report["results"]:
+        scale_cell(cell, 1.3)
+    result = run_gate(tmp_path, report)
+    assert result.returncode == 1
+    assert "整体变慢" in result.stdout
+
+
+def test_holm_adjust():
+    sys.path.insert(0, os.path.join(ROOT, "scripts"))
+    try:
+        import benchmark_gate
+    finally:
+        sys.path.pop(0)
+    assert benchmark_gate.holm_adjust([0.01, 0.04, 0.03, 0.5]) == pytest.approx([0.04, 0.09, 0.09, 0.5])
@@ -0,0 +1,40 @@
+"""BM25倒排索引：中文按二元组分词后的排序"""
+
+DOCS = [
+    "本合同自双方签字盖章之日起生效，有效期一年。",
+    "退款申请提交后，财务部门将在七个工作日内处理退款。",
+    "员工请假须提前三天提交申请，经部门负责人审批。",
+    "产品保修期为一年，人为损坏不在保修范围内。",
+    "合同期满前三十日，任何一方可书面通知对方解除合同。",
+]
+
+
+def test_cjk_bigram_terms(aisql):
+    assert aisql._search_terms("退款申请") == ["退款", "款申", "申请"]
+    # 空白不打断中文片段，被字母数字隔开的单字保留单字
+    assert aisql._search_terms("退 款") == ["退款"]
+    assert aisql._search_terms("退1款") == ["退", "1", "款"]
+    assert aisql._search_terms("API接口v2") == ["api", "接口", "v2"]
+
+
+def test_ranks_matching_document_first(aisql):
+    index = aisql._BM25Index(DOCS)
+    assert index.top_n("退款多久处理", 3)[0][0] == 1
+    assert index.top_n("保修范围", 3)[0][0] == 3
+    assert index.top_n("请假审批", 3)[0][0] == 2
+
+
+def test_term_frequency_and_rarity(aisql):
+    index = aisql._BM25Index(DOCS)
+    ranking = [doc for doc, _ in index.top_n("解除合同", 5)]
+    # 两篇文档都含“合同”，只有一篇含更少见的“解除”
+    assert ranking[0] == 4 and 0 in ranking
+    scores = dict(index.top_n("合同", 5))
+    assert scores[4] > scores[0]
+
+
+def test_only_matching_documents_are_returned(aisql):
+    index = aisql._BM25Index(DOCS)
+    assert index.top_n("发票", 5) == []
+    assert len(index.top_n("申请", 1)) == 1
+    assert aisql._BM25Index([]).top_n("合同", 3) == []
@@ -0,0 +1,87 @@
+"""级联路由：快速模型的各类升级原因与统计口径"""
+import json
+
+import pytest
+
+FAST, STRONG = "qwen-turbo", "qwen-plus"
+STRONG_REPLY = json.dumps({"label": "strong", "confidence": 0.99})
+
+
+def backend(aisql, monkeypatch, fast_reply, fast_error=None):
+    calls = []
+
+    def generation_text(model_name, messages, temperature=0.7, **kwargs):
+        calls.append(model_name)
+        if model_name == FAST:
+            if isinstance(fast_error, Exception):
+                raise fast_error
+            return fast_reply, fast_error
+        return STRONG_REPLY, None
+
+    monkeypatch.setattr(aisql, "_generation_text", generation_text)
+    monkeypatch.setattr(aisql, "_CASCADE_STATS", {})
+    return calls
+
+
+@pytest.mark.parametrize("fast_reply, fast_error, reason", [
+    (None, "Throttling", "api_error"),
+    (None, RuntimeError("timeout"), "api_error"),
+    ("不是JSON", None, "parse_error"),
+    (json.dumps({"label": "fast"}), None, "no_confidence"),
+    (json.dumps({"label": "fast", "confidence": "高"}), None, "no_confidence"),
+    ('{"label": "fast", "confidence": NaN}', None, "no_confidence"),
+    (json.dumps({"label": "fast", "confidence": -0.5}), None, "no_confidence"),
+    (json.dumps({"label": "fast", "confidence": 0.5}), None, "low_confidence"),
+    (json.dumps({"label": "fast", "confidence": "50%"}), None, "low_confidence"),
+])
+def test_escalation_reasons(aisql, monkeypatch, fast_reply, fast_error, reason):
+    calls = backend(aisql, monkeypatch, fast_reply, fast_error)
+    content, error, info = aisql._cascade_generation(STRONG, [], FAST, 0.8)
+    assert calls == [FAST, STRONG]
+    assert (content, error) == (STRONG_REPLY, None)
+    assert info["escalated"] is True and info["reason"] == reason and info["model"] == STRONG
+    assert info["stats"][reason] == 1 and info["stats"]["escalated"] == 1
+
+
+@pytest.mark.parametrize("confidence", [0.9, "95%", 85])
+def test_confident_fast_result_is_accepted(aisql, monkeypatch, confidence):
+    reply = json.dumps({"label": "fast", "confidence": confidence})
+    calls = backend(aisql, monkeypatch, reply)
+    content, error, info = aisql._cascade_generation(STRONG, [], FAST, 0.8)
+    assert calls == [FAST] and content == reply
+    assert info["escalated"] is False and info["reason"] is None and info["model"] == FAST
+    assert 0.8 <= info["fast_confidence"] <= 1.0
+
+
+def test_without_fast_model_calls_model_directly(aisql, monkeypatch):
+    calls = backend(aisql, monkeypatch, None)
+    assert aisql._cascade_generation(STRONG, [], "", 0.8) == (STRONG_REPLY, None, None)
+    assert aisql._cascade_generation(STRONG, [], STRONG, 0.8)[2] is None
+    assert calls == [STRONG, STRONG]
+
+
+def test_stats_count_each_row_once(aisql, monkeypatch):
+    replies = iter([json.dumps({"confidence": 0.9}), json.dumps({"confidence": 0.3}), "坏JSON", json.dumps({"confidence": 0.95})])
+    backend(aisql, monkeypatch, None)
+    original = aisql._generation_text
+
+    def generation_text(model_name, messages, temperature=0.7, **kwargs):
+        if model_name == FAST:
+            return next(replies), None
+        return original(model_name, messages, temperature)
+
+    monkeypatch.setattr(aisql, "_generation_text", generation_text)
+    for _ in range(4):
+        info = aisql._cascade_generation(STRONG, [], FAST, 0.8)[2]
+    stats = info["stats"]
+    assert (stats["rows"], stats["escalated"], stats["low_confidence"], stats["parse_error"]) == (4, 2, 1, 1)
+    assert stats["api_error"] == stats["no_confidence"] == 0
+    assert stats["escalation_rate"] == 0.5
+    assert aisql._CASCADE_STATS == {aisql._CURRENT_UDF.get(): {k: v for k, v in stats.items() if k != "escalation_rate"}}
+
+
+def test_udf_reports_cascade_info(aisql, monkeypatch):
+    backend(aisql, monkeypatch, json.dumps({"risk_level": "low", "confidence": 0.2}))
+    result = json.loads(aisql.ai_risk_text_detect().evaluate("文本", "mock-key", "all", STRONG, FAST, 0.8))
+    assert result["cascade"]["reason"] == "low_confidence"
+    assert result["cascade"]["stats"]["rows"] == 1
@@ -0,0 +1,45 @@
+"""本地文本清洗规则与operations拆分"""
+import pytest
+
+
+@pytest.mark.parametrize("rule, text, expected", [
+    ("remove_html", "<p>你好&amp;世界</p><script>alert(1)</script><br/>再见", "你好&世界\n\n再见"),
+    ("remove_control_chars", "a\x00b​c﻿", "abc"),
+    ("normalize_unicode", "ﬁ①", "fi1"),
+    ("fullwidth_to_halfwidth", "ＡＢＣ１２３　＃，。", "ABC123 #，。"),
+    ("remove_urls", "见 https://a.com/x?y=1，或www.b.cn", "见 ，或"),
+    ("remove_emails", "联系 a.b@example.com 谢谢", "联系  谢谢"),
+    ("dedupe_punctuation", "好!!!真的？？？。。", "好!真的？。"),
+    ("fix_spacing", "  中 文  text\t here  \n\n\n\nend  ", "中文 text here\n\nend"),
+])
+def test_each_rule(aisql, rule, text, expected):
+    cleaned, count = aisql._CLEAN_RULES[rule](text)
+    assert cleaned == expected
+    assert count > 0
+
+
+@pytest.mark.parametrize("rule", ["remove_html", "remove_control_chars", "normalize_unicode", "fullwidth_to_halfwidth",
+                                  "remove_urls", "remove_emails", "dedupe_punctuation", "fix_spacing"])
+def test_clean_text_is_unchanged(aisql, rule):
+    assert aisql._CLEAN_RULES[rule]("已经干净的文本、没有需要处理的内容。") == ("已经干净的文本、没有需要处理的内容。", 0)
+
+
+def test_fullwidth_keeps_chinese_punctuation(aisql):
+    assert aisql._CLEAN_RULES["fullwidth_to_halfwidth"]("（注：价格￥１００）")[0] == "（注：价格￥100）"
+
+
+def test_split_operations(aisql):
+    default = list(aisql._CLEAN_DEFAULT_RULES)
+    assert aisql._split_clean_operations("all") == (default, [])
+    assert aisql._split_clean_operations("") == (default, [])
+    # 别名映射到规则，按_CLEAN_RULES顺序返回；无法本地处理的操作交给模型
+    assert aisql._split_clean_operations("去除链接，纠正错别字 html nfkc") == (
+        ["remove_html", "normalize_unicode", "remove_urls"], ["纠正错别字"])
+    assert aisql._split_clean_operations("fix_spacing,fix_spacing") == (["fix_spacing"], [])
+
+
+def test_clean_text_locally_reports_applied_rules(aisql):
+    text, applied, changes = aisql._clean_text_locally("<b>Ｈｉ</b>!!  你 好", aisql._split_clean_operations("all")[0])
+    assert text == "Hi! 你好"
+    assert applied == ["remove_html", "fullwidth_to_halfwidth", "dedupe_punctuation", "fix_spacing"]
+    assert changes == 7
@@ -0,0 +1,16 @@
+"""ai_contract_extract：默认整份合同一次调用，分块提取需显式开启"""
+import json
+
+
+def test_default_mode_is_single_call(aisql):
+    text = "甲方：A公司，乙方：B公司。第一条 合同金额为100万元。" * 800
+    result = json.loads(aisql.ai_contract_extract().evaluate(text, "mock-key", chunk_tokens=500))
+    assert "chunk_count" not in result
+    chunked = json.loads(aisql.ai_contract_extract().evaluate(text, "mock-key", mode="auto", chunk_tokens=500))
+    assert chunked["chunk_count"] > 1
+
+
+def test_invalid_chunk_tokens_returns_error_json(aisql):
+    for value in ("abc", 0):
+        result = json.loads(aisql.ai_contract_extract().evaluate("甲方：A公司", "mock-key", mode="auto", chunk_tokens=value))
+        assert result["error"] is True
@@ -0,0 +1,28 @@
+"""ai_document_parse逐页解析后的合并：合并输出被截断时保留逐页内容"""
+import json
+
+PAGES = json.dumps(["https://example.com/page1.png", "https://example.com/page2.png"])
+
+
+def fake_merge(finish_reason):
+    def generation(model_name, messages, temperature=0.7, max_tokens=None, call_info=None, **kwargs):
+        if call_info is not None:
+            call_info.update({"truncated": False, "finish_reason": finish_reason})
+        return "合并后的内容", None
+    return generation
+
+
+def test_truncated_merge_falls_back_to_pages(aisql, monkeypatch):
+    monkeypatch.setattr(aisql, "_generation_text", fake_merge("length"))
+    result = json.loads(aisql.ai_document_parse().evaluate(PAGES, "mock-key", mode="per_page", merge_model="qwen-turbo"))
+    assert result["merged"] is False
+    assert result["merge_truncated"] is True
+    assert "[第1页]" in result["parsed_content"] and "[第2页]" in result["parsed_content"]
+
+
+def test_complete_merge_is_used(aisql, monkeypatch):
+    monkeypatch.setattr(aisql, "_generation_text", fake_merge("stop"))
+    result = json.loads(aisql.ai_document_parse().evaluate(PAGES, "mock-key", mode="per_page", merge_model="qwen-turbo"))
+    assert result["merged"] is True
+    assert result["parsed_content"] == "合并后的内容"
+    assert "merge_truncated" not in result
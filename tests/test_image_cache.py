@@ -0,0 +1,32 @@
+"""图片结果缓存：OCR/向量只做内容哈希精确匹配，近似匹配需显式开启"""
+
+
+def fingerprint(sha256, dhash, aspect=1.5):
+    return {"sha256": sha256, "dhash": dhash, "aspect": aspect}
+
+
+def test_exact_match_only_by_default(aisql):
+    cache = aisql._ImageResultCache()
+    cache.put("ocr", fingerprint("a", 0b1011), {"text": "发票A"})
+    assert cache.get("ocr", fingerprint("a", 0b1011)) == {"text": "发票A"}
+    # 同一模板的另一张票据：dHash只差1位，也不能命中
+    assert cache.get("ocr", fingerprint("b", 0b1010)) is None
+    assert cache.get("ocr", fingerprint("b", 0b1010), near_match=True) is None
+
+
+def test_near_match_requires_opt_in(aisql):
+    cache = aisql._ImageResultCache(max_distance=2)
+    cache.put("describe", fingerprint("a", 0b1011), {"description": "猫"})
+    assert cache.get("describe", fingerprint("b", 0b1010)) is None
+    assert cache.get("describe", fingerprint("b", 0b1010), near_match=True) == {"description": "猫"}
+    assert cache.get("describe", fingerprint("c", 0b0100), near_match=True) is None
+    assert cache.get("describe", fingerprint("d", 0b1010, aspect=0.7), near_match=True) is None
+
+
+def test_sqlite_lookup_respects_exact_matching(aisql, tmp_path):
+    path = str(tmp_path / "cache.db")
+    writer = aisql._ImageResultCache(max_distance=2, path=path)
+    writer.put("ocr", fingerprint("a", 0xABCD), {"text": "表单A"})
+    reader = aisql._ImageResultCache(max_distance=2, path=path)
+    assert reader.get("ocr", fingerprint("b", 0xABCD)) is None
+    assert reader.get("ocr", fingerprint("a", 0xABCD)) == {"text": "表单A"}
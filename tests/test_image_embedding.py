@@ -0,0 +1,46 @@
+"""图片向量：单张嵌入与相似度、批量嵌入共用向量存储，批量返回数量不符时报错"""
+import json
+from types import SimpleNamespace
+
+
+def counting_calls(aisql, monkeypatch):
+    calls = []
+    original = aisql._dashscope_call
+
+    def call(api, **kwargs):
+        calls.append(kwargs["input"])
+        return original(api, **kwargs)
+
+    monkeypatch.setattr(aisql, "_dashscope_call", call)
+    monkeypatch.setattr(aisql, "_IMAGE_EMBEDDING_STORE", aisql._LRUCache(100))
+    return calls
+
+
+def test_single_embedding_uses_the_embedding_store(aisql, monkeypatch):
+    calls = counting_calls(aisql, monkeypatch)
+    url = "https://example.com/store-a.jpg"
+    first = json.loads(aisql.ai_image_to_embedding().evaluate(url, "mock-key"))
+    assert first["dimension"] == len(first["embedding"]) > 0
+    assert len(calls) == 1
+    again = json.loads(aisql.ai_image_to_embedding().evaluate(url, "mock-key"))
+    assert again["embedding"] == first["embedding"]
+    similarity = json.loads(aisql.ai_image_similarity().evaluate(url, url, "mock-key"))
+    assert similarity["similarity"] > 0.999
+    assert len(calls) == 1
+
+
+def test_batch_response_with_missing_vectors_is_an_error(aisql, monkeypatch):
+    monkeypatch.setattr(aisql, "_IMAGE_EMBEDDING_STORE", aisql._LRUCache(100))
+
+    def short_response(api, **kwargs):
+        return SimpleNamespace(status_code=200, message="",
+                               output={"embeddings": [{"index": 0, "embedding": [1.0, 0.0]}]})
+
+    monkeypatch.setattr(aisql, "_dashscope_call", short_response)
+    urls = ["https://example.com/batch-%d.jpg" % i for i in range(3)]
+    embeddings, error = aisql._embed_images(urls, "multimodal-embedding-v1")
+    assert embeddings is None
+    assert "3" in error and "1" in error
+    assert all(aisql._IMAGE_EMBEDDING_STORE.get(("multimodal-embedding-v1", url)) is None for url in urls)
+    result = json.loads(aisql.ai_image_batch_embedding().evaluate(json.dumps(urls), "mock-key", "multimodal-embedding-v1"))
+    assert result["error"] is True
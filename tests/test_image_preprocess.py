@@ -0,0 +1,63 @@
+"""图片预处理：EXIF方向校正，本地文件原子写入且目录有上限"""
+import io
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def jpeg(width, height, orientation=None):
+    image = Image.new("RGB", (width, height), "white")
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def test_exif_orientation_is_applied_before_resize(aisql):
+    encoded, original_size, sent_size = aisql._encode_image(jpeg(3000, 1000, orientation=6), "describe")
+    assert original_size == (1000, 3000)
+    assert sent_size == (256, 768)
+    assert Image.open(io.BytesIO(encoded)).size == (256, 768)
+
+
+def test_upright_jpeg_is_kept_as_is(aisql):
+    data = jpeg(200, 100)
+    encoded, _, sent_size = aisql._encode_image(data, "ocr")
+    assert sent_size == (200, 100)
+
+
+def test_file_reference_is_written_atomically(aisql, monkeypatch, tmp_path):
+    monkeypatch.setattr(aisql.tempfile, "gettempdir", lambda: str(tmp_path))
+    reference = aisql._image_reference(b"image-bytes", "file")
+    path = reference[len("file://"):]
+    with open(path, "rb") as f:
+        assert f.read() == b"image-bytes"
+    assert aisql._image_reference(b"image-bytes", "file") == reference
+    assert [name for name in os.listdir(tmp_path / "aisql_images") if name.endswith(".tmp")] == []
+
+
+def test_image_directory_is_bounded(aisql, monkeypatch, tmp_path):
+    monkeypatch.setattr(aisql.tempfile, "gettempdir", lambda: str(tmp_path))
+    monkeypatch.setattr(aisql, "_IMAGE_FILE_MAX_FILES", 3)
+    monkeypatch.setattr(aisql, "_IMAGE_FILE_MIN_AGE", 0)
+    references = []
+    for index in range(5):
+        references.append(aisql._image_reference(b"image-%d" % index, "file"))
+        path = references[-1][len("file://"):]
+        os.utime(path, (1000 + index, 1000 + index))
+    remaining = sorted(os.listdir(tmp_path / "aisql_images"))
+    assert len(remaining) == 3
+    assert os.path.exists(references[-1][len("file://"):])
+    assert not os.path.exists(references[0][len("file://"):])
+
+
+def test_recently_written_files_are_not_evicted(aisql, monkeypatch, tmp_path):
+    monkeypatch.setattr(aisql.tempfile, "gettempdir", lambda: str(tmp_path))
+    monkeypatch.setattr(aisql, "_IMAGE_FILE_MAX_FILES", 1)
+    for index in range(3):
+        aisql._image_reference(b"image-%d" % index, "file")
+    assert len(os.listdir(tmp_path / "aisql_images")) == 3
@@ -0,0 +1,58 @@
+"""MinHash签名与LSH分段参数：签名跨进程稳定，分段参数贴合阈值"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEXT = "这款耳机音质很好，降噪效果明显，佩戴舒适，续航也不错。"
+
+SIGNATURE_SCRIPT = """
+import json, sys
+sys.path.insert(0, {tests_dir!r})
+from mock_dashscope import MockConfig, load_functions
+functions = load_functions(MockConfig())
+print(functions.ai_text_minhash().evaluate({text!r}, 64, 0.8))
+"""
+
+
+def run_in_subprocess(hash_seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed))
+    script = SIGNATURE_SCRIPT.format(tests_dir=TESTS_DIR, text=TEXT)
+    output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_signature_is_stable_across_processes(aisql):
+    local = json.loads(aisql.ai_text_minhash().evaluate(TEXT, 64, 0.8))
+    for seed in (1, 12345):
+        remote = run_in_subprocess(seed)
+        assert remote["signature"] == local["signature"]
+        assert remote["band_keys"] == local["band_keys"]
+
+
+def test_signature_similarity_tracks_jaccard(aisql):
+    a = aisql._text_shingles(TEXT)
+    b = aisql._text_shingles(TEXT.replace("续航也不错", "续航一般"))
+    estimate = aisql._minhash_similarity(aisql._minhash_signature(a, 256), aisql._minhash_signature(b, 256))
+    assert abs(estimate - aisql._jaccard(a, b)) < 0.1
+    assert aisql._minhash_signature(a, 256) == aisql._minhash_signature(set(a), 256)
+
+
+def test_empty_text_has_sentinel_signature(aisql):
+    assert aisql._minhash_signature(set(), 8) == [aisql._MINHASH_MAX] * 8
+
+
+@pytest.mark.parametrize("threshold", [0.5, 0.8, 0.9])
+def test_lsh_params_fit_threshold(aisql, threshold):
+    bands, rows = aisql._lsh_params(threshold, 128)
+    assert bands * rows <= 128
+    # S曲线的拐点(1/b)^(1/r)应接近阈值
+    assert abs((1.0 / bands) ** (1.0 / rows) - threshold) < 0.1
+
+
+def test_lsh_params_rise_with_threshold(aisql):
+    rows = [aisql._lsh_params(t, 128)[1] for t in (0.5, 0.7, 0.9)]
+    assert rows == sorted(rows)
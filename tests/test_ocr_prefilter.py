@@ -0,0 +1,43 @@
+"""OCR文字预筛：只有实际做了预筛的图片才计入统计"""
+import io
+
+from PIL import Image, ImageDraw
+
+
+def blank_png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 240), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def text_png():
+    image = Image.new("RGB", (320, 240), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(10, 230, 14):
+        draw.text((10, y), "INVOICE 2024-001 TOTAL 1,234.56 QTY 12", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_disabled_prefilter_is_not_counted(aisql):
+    before = dict(aisql._OCR_PREFILTER_STATS)
+    action, score, _ = aisql._ocr_prefilter("https://example.com/a.png", blank_png(), 0)
+    assert (action, score) == ("send", None)
+    assert aisql._OCR_PREFILTER_STATS == before
+
+
+def test_unreadable_image_is_not_counted(aisql):
+    before = dict(aisql._OCR_PREFILTER_STATS)
+    action, score, _ = aisql._ocr_prefilter("https://example.com/a.png", b"not an image", 0.2)
+    assert (action, score) == ("send", None)
+    assert aisql._OCR_PREFILTER_STATS == before
+
+
+def test_enabled_prefilter_counts_outcomes(aisql):
+    before = dict(aisql._OCR_PREFILTER_STATS)
+    assert aisql._ocr_prefilter("https://example.com/a.png", blank_png(), 0.2)[0] == "skip"
+    assert aisql._ocr_prefilter("https://example.com/a.png", blank_png(), 0.2, "qwen-vl-ocr")[0] == "downgrade"
+    assert aisql._ocr_prefilter("https://example.com/b.png", text_png(), 0.01)[0] == "send"
+    after = aisql._OCR_PREFILTER_STATS
+    assert [after[k] - before[k] for k in ("skipped", "downgraded", "sent")] == [1, 1, 1]
@@ -0,0 +1,92 @@
+"""风险文本本地预筛：只有词典覆盖全部风险类型时才本地放行，匹配前做NFKC和去空白标点归一化"""
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize("risk_types, covered", [
+    ("all", False),
+    ("全部", False),
+    ("", False),
+    ("欺诈,赌博", True),
+    ("fraud、gambling", True),
+    ("violence drugs porn", True),
+    ("violence,sensitive", False),
+    ("违规", False),
+])
+def test_risk_types_coverage(aisql, risk_types, covered):
+    assert aisql._risk_types_covered(risk_types) is covered
+
+
+def test_uncovered_risk_types_go_to_model(aisql):
+    text = "今天天气不错，我们去公园散步吧"
+    local = json.loads(aisql.ai_risk_text_detect().evaluate(text, "mock-key", "欺诈", prefilter_threshold=0.3))
+    assert local["model"] == "local" and local["risk_level"] == "none"
+    sent = json.loads(aisql.ai_risk_text_detect().evaluate(text, "mock-key", "sensitive", prefilter_threshold=0.3))
+    assert sent["model"] != "local"
+    assert sent["prefilter"]["action"] == "model" and sent["prefilter"]["risk_types_covered"] is False
+
+
+def test_lexicon_hit_is_never_passed(aisql):
+    passed, info = aisql._risk_prefilter("稳赚不赔的内幕消息，加微信abc12345", 0.3)
+    assert passed is False
+    assert {m["category"] for m in info["matches"]} == {"欺诈"}
+    assert "引流" in info["signals"]
+
+
+def test_invalid_threshold_returns_error_json(aisql):
+    result = json.loads(aisql.ai_risk_text_detect().evaluate("文本", "mock-key", prefilter_threshold="abc"))
+    assert result["error"] is True
+
+
+@pytest.mark.parametrize("text", [
+    "你去死吧，我知道你住哪…",
+    "我要自杀，不想活了",
+    "所有某族人都应该被赶出去",
+    "你的身份证和银行卡密码发我",
+    "刷 单 日 结",
+    "ＣＡＳＩＮＯ",
+])
+def test_all_risk_types_never_pass_locally(aisql, text):
+    result = json.loads(aisql.ai_risk_text_detect().evaluate(text, "mock-key", "all", prefilter_threshold=0.3))
+    assert result["model"] != "local"
+    assert result["prefilter"]["action"] == "model"
+
+
+@pytest.mark.parametrize("text, word, category", [
+    ("刷 单 日 结", "刷 单", "欺诈"),
+    ("ＣＡＳＩＮＯ", "ＣＡＳＩＮＯ", "赌博"),
+    ("博-彩，网站", "博-彩", "赌博"),
+    ("i will KILL   you", "KILL   you", "暴力"),
+])
+def test_spaced_and_fullwidth_evasions_match(aisql, text, word, category):
+    passed, info = aisql._risk_prefilter(text, 0.3, "欺诈,赌博,暴力")
+    assert passed is False
+    match = next(m for m in info["matches"] if m["category"] == category)
+    assert match["text"] == word
+    assert text[match["start"]:match["end"]] == word
+
+
+def test_heuristics_see_split_phone_number(aisql):
+    passed, info = aisql._risk_prefilter("联系 138 1234 5678", 0.3, "欺诈")
+    assert "电话" in info["signals"]
+
+
+def test_local_pass_reports_fixed_confidence(aisql):
+    result = json.loads(aisql.ai_risk_text_detect().evaluate("今天天气不错", "mock-key", "欺诈,赌博", prefilter_threshold=0.3))
+    assert result["model"] == "local"
+    assert result["confidence"] == aisql._RISK_PREFILTER_CONFIDENCE < 1.0
+
+
+def test_lexicon_can_declare_full_coverage(aisql, monkeypatch, tmp_path):
+    path = tmp_path / "lexicon.json"
+    path.write_text(json.dumps({"_covers_all": True, "自残": ["自杀", "不想活了"]}, ensure_ascii=False), encoding="utf-8")
+    monkeypatch.setenv("AISQL_RISK_LEXICON", str(path))
+    monkeypatch.setattr(aisql, "_RISK_MATCHER", None)
+    monkeypatch.setattr(aisql, "_RISK_CATEGORIES", frozenset())
+    monkeypatch.setattr(aisql, "_RISK_COVERS_ALL", False)
+    assert aisql._risk_types_covered("all") is True
+    assert "_covers_all" not in aisql._RISK_CATEGORIES
+    passed, info = aisql._risk_prefilter("我要自杀，不想活了", 0.3)
+    assert passed is False and {m["category"] for m in info["matches"]} == {"自残"}
+    assert aisql._risk_prefilter("今天天气不错", 0.3)[0] is True
@@ -0,0 +1,82 @@
+"""本地情感词典打分：否定、程度副词和转折的判定结果"""
+import json
+
+import pytest
+
+
+def local(aisql, text):
+    result, confidence = aisql._lexicon_sentiment(text)
+    return result["sentiment"], confidence
+
+
+@pytest.mark.parametrize("text", ["没有退款", "还没退货", "I want a refund", "not returned yet"])
+def test_after_sales_nouns_are_not_flipped_to_positive(aisql, text):
+    sentiment, confidence = local(aisql, text)
+    assert sentiment == "neutral" and confidence == 0.0
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("不好", "negative"),
+    ("不太好", "negative"),
+    ("这个东西不满意", "negative"),
+    ("not good", "negative"),
+    ("没有问题", "positive"),
+    ("还没有退款，非常失望", "negative"),
+    ("退款很快，满意", "positive"),
+])
+def test_negation(aisql, text, expected):
+    assert local(aisql, text)[0] == expected
+
+
+@pytest.mark.parametrize("text", ["无线耳机非常好用", "无线网络非常稳定", "无人机特别好用", "无论如何都推荐",
+                                  "没想到这么好用", "不仅好用而且便宜", "毫不犹豫推荐"])
+def test_negation_characters_inside_words_do_not_flip(aisql, text):
+    assert local(aisql, text)[0] == "positive"
+    result, prescore = aisql._sentiment_prescore(text, 0.8)
+    assert result is None or result["sentiment"] == "positive"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("未拆封就坏了", "negative"),
+    ("别人家的很好", "positive"),
+    ("不是很好", "negative"),
+    ("没有那么好", "negative"),
+    ("not really good", "negative"),
+    ("不是不好", "positive"),
+])
+def test_negation_window(aisql, text, expected):
+    assert local(aisql, text)[0] == expected
+
+
+def test_distant_negation_is_ignored(aisql):
+    # 否定词与情感词之间隔着其他内容时不再翻转
+    assert local(aisql, "没看说明书也很好用")[0] == "positive"
+    assert local(aisql, "不到一天就坏了")[0] == "negative"
+
+
+def test_weak_negation_is_less_confident(aisql):
+    assert local(aisql, "不太好")[1] < local(aisql, "不好")[1]
+
+
+def test_degree_words_scale_confidence(aisql):
+    assert local(aisql, "有点满意")[1] < local(aisql, "满意")[1] < local(aisql, "非常满意")[1]
+    assert local(aisql, "very good")[1] > local(aisql, "good")[1]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("质量不错，但是物流太慢", "negative"),
+    ("价格有点贵，但是质量很好", "positive"),
+    ("looks nice but broken", "negative"),
+])
+def test_contrast_favours_the_last_clause(aisql, text, expected):
+    assert local(aisql, text)[0] == expected
+
+
+def test_prescore_sends_negated_refund_to_model(aisql):
+    result, prescore = aisql._sentiment_prescore("没有退款", 0.6)
+    assert result is None and prescore["action"] == "model"
+
+
+def test_invalid_min_local_confidence_returns_error_json(aisql):
+    result = json.loads(aisql.ai_text_sentiment_analyze().evaluate("很好", "mock-key", min_local_confidence="abc"))
+    assert result["error"] is True
@@ -0,0 +1,23 @@
+"""ai_text_summarize的map_reduce归并：层数有上限，参数错误返回错误JSON"""
+import json
+
+
+def test_reduce_stops_when_summaries_do_not_shrink(aisql, monkeypatch):
+    calls = []
+
+    def verbose_summary(model_name, messages, temperature, max_tokens=None, call_info=None):
+        calls.append(messages)
+        return "摘要内容没有变短。" * 400, None
+
+    monkeypatch.setattr(aisql, "_generation_text", verbose_summary)
+    text = "这是一段很长的文本，用来测试分块摘要。" * 2000
+    result = json.loads(aisql.ai_text_summarize().evaluate(text, "mock-key", mode="map_reduce", chunk_tokens=1000))
+    assert result["mode"] == "map_reduce"
+    assert result["levels"] <= aisql._SUMMARY_MAX_LEVELS + 1
+    assert len(calls) < 200
+
+
+def test_invalid_chunk_tokens_returns_error_json(aisql):
+    for value in ("abc", 0, -5):
+        result = json.loads(aisql.ai_text_summarize().evaluate("短文本", "mock-key", chunk_tokens=value))
+        assert result["error"] is True
@@ -0,0 +1,55 @@
+"""大图分块：只切全宽横条，合并时只去掉上下重叠区域内重复识别的行"""
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_repeated_short_values_are_kept(aisql):
+    merged = aisql._merge_tile_texts({0: "数量 单价\n1 100\n合计 100", 1: "备注\n1 100"}, 2)
+    assert merged.split("\n") == ["数量 单价", "1 100", "合计 100", "备注", "1 100"]
+
+
+def test_vertical_overlap_prefers_more_complete_line(aisql):
+    merged = aisql._merge_tile_texts({0: "第一行\n合同编号：HT-20", 1: "合同编号：HT-2024-001\n第三行"}, 2)
+    assert merged.split("\n") == ["第一行", "合同编号：HT-2024-001", "第三行"]
+
+
+def test_lines_keep_reading_order_across_strips(aisql):
+    merged = aisql._merge_tile_texts({0: "甲方：某公司 乙方：某个人\n第一条 标的", 1: "第一条 标的\n第二条 价款"}, 2)
+    assert merged.split("\n") == ["甲方：某公司 乙方：某个人", "第一条 标的", "第二条 价款"]
+
+
+def test_failed_strip_is_skipped(aisql):
+    assert aisql._merge_tile_texts({0: "A", 2: "C"}, 3).split("\n") == ["A", "C"]
+
+
+def test_wide_image_is_downscaled_not_split_horizontally(aisql):
+    tiles, row_spans = aisql._image_tiles(png(4000, 3000), tile_size=1536, overlap=128)
+    assert len(tiles) == len(row_spans) == 1
+    assert Image.open(io.BytesIO(tiles[0][1])).size == (1536, 1152)
+
+
+def test_tall_image_is_cut_into_full_width_strips(aisql):
+    tiles, row_spans = aisql._image_tiles(png(1000, 4000), tile_size=1536, overlap=128)
+    assert [row for row, _ in tiles] == list(range(len(row_spans))) and len(row_spans) == 3
+    assert all(Image.open(io.BytesIO(data)).size[0] == 1000 for _, data in tiles)
+    assert row_spans[0][0] == 0 and row_spans[-1][1] == 4000
+
+
+def test_tile_size_floor_and_tile_count_cap(aisql):
+    tiles, row_spans = aisql._image_tiles(png(600, 800), tile_size=1, overlap=128)
+    assert len(tiles) == 2 and all(end - start == aisql._TILE_MIN_SIZE for start, end in row_spans)
+    tiles, row_spans = aisql._image_tiles(png(512, 60000), tile_size=512, overlap=128)
+    assert len(tiles) <= aisql._TILE_MAX_COUNT
+
+
+def test_small_image_is_not_tiled(aisql):
+    assert aisql._image_tiles(png(800, 600), tile_size=1536) == ([], [(0, 600)])
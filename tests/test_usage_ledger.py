@@ -0,0 +1,68 @@
+"""用量账本的作业标签：按调用上下文或UDF末尾参数设置，环境变量只作后备；单价配置错误时发出警告"""
+import json
+
+import pytest
+
+
+def read_ledger(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_job_scope_overrides_env_tag(aisql, tmp_path, monkeypatch):
+    path = str(tmp_path / "ledger.jsonl")
+    ledger = aisql._UsageLedger(path, interval=3600)
+    monkeypatch.setattr(aisql, "_LEDGER", ledger)
+    monkeypatch.setenv("AISQL_JOB_TAG", "nightly")
+
+    with aisql._job_scope("adhoc-42"):
+        aisql.ai_text_summarize().evaluate("这是一段需要摘要的文本。", "mock-key")
+    aisql.ai_text_summarize().evaluate("这是一段需要摘要的文本。", "mock-key")
+    ledger.flush()
+
+    records = read_ledger(path)
+    calls = [r["job"] for r in records if r["type"] == "call"]
+    rows = {r["job"]: r["rows"] for r in records if r["type"] == "rows"}
+    assert calls == ["adhoc-42", "nightly"]
+    assert rows == {"adhoc-42": 1, "nightly": 1}
+    assert aisql._job_tag() == "nightly"
+
+
+def test_job_scope_is_inherited_by_concurrent_tasks(aisql):
+    with aisql._job_scope("batch-7"):
+        tags = aisql._run_concurrently(lambda _: aisql._job_tag(), range(8), 4)
+    assert tags == ["batch-7"] * 8
+
+
+def test_trailing_argument_sets_job_tag(aisql, tmp_path, monkeypatch):
+    path = str(tmp_path / "ledger.jsonl")
+    ledger = aisql._UsageLedger(path, interval=3600)
+    monkeypatch.setattr(aisql, "_LEDGER", ledger)
+    monkeypatch.setenv("AISQL_JOB_TAG", "nightly")
+
+    # ai_text_summarize(text, api_key, model_name, max_length, mode, chunk_tokens, max_workers) 之后多传一个参数
+    result = json.loads(aisql.ai_text_summarize().evaluate("这是一段需要摘要的文本。", "mock-key", "qwen-plus", 200, "auto", 4000, 4, "sql-job-1"))
+    assert "summary" in result
+    aisql.ai_text_summarize().evaluate("这是一段需要摘要的文本。", "mock-key", job_tag="py-job-2")
+    aisql.ai_text_summarize().evaluate("这是一段需要摘要的文本。", "mock-key", "qwen-plus")
+    ledger.flush()
+
+    records = read_ledger(path)
+    assert [r["job"] for r in records if r["type"] == "call"] == ["sql-job-1", "py-job-2", "nightly"]
+    assert {r["job"]: r["rows"] for r in records if r["type"] == "rows"} == {"sql-job-1": 1, "py-job-2": 1, "nightly": 1}
+
+
+def test_malformed_model_prices_warn(aisql, monkeypatch, tmp_path):
+    monkeypatch.setenv("AISQL_MODEL_PRICES", "{qwen-plus: 0.1")
+    with pytest.warns(RuntimeWarning, match="AISQL_MODEL_PRICES"):
+        assert aisql._load_model_prices() == aisql._MODEL_PRICES
+    monkeypatch.setenv("AISQL_MODEL_PRICES", str(tmp_path / "missing.json"))
+    with pytest.warns(RuntimeWarning):
+        assert aisql._load_model_prices() == aisql._MODEL_PRICES
+    monkeypatch.setenv("AISQL_MODEL_PRICES", json.dumps({"qwen-plus": 0.1, "my-model": {"input": 0.001, "output": "0.002"},
+                                                         "qwen-max": {"input": 0.002, "output": 0.008}}))
+    with pytest.warns(RuntimeWarning) as record:
+        prices = aisql._load_model_prices()
+    assert len(record) == 2
+    assert prices["qwen-plus"] == aisql._MODEL_PRICES["qwen-plus"] and "my-model" not in prices
+    assert prices["qwen-max"] == {"input": 0.002, "output": 0.008}
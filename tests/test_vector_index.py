@@ -0,0 +1,67 @@
+"""向量索引：头部记录模型和维度，拒绝不一致的写入和检索"""
+import json
+
+import pytest
+
+
+@pytest.fixture
+def index(aisql, tmp_path):
+    return aisql._VectorIndex(str(tmp_path / "items.jsonl"))
+
+
+def test_header_records_model_and_dimension(aisql, index):
+    assert index.add([("a", [1.0, 0.0, 0.0]), ("b", [0.0, 1.0, 0.0])], "model-x") == (2, 3)
+    with open(index.path, encoding="utf-8") as f:
+        assert json.loads(f.readline()) == {"header": {"model": "model-x", "dimension": 3}}
+    reloaded = aisql._VectorIndex(index.path)
+    ranked, size = reloaded.search([1.0, 0.1, 0.0], 1, "model-x")
+    assert size == 2 and ranked[0][0] == "a"
+    assert (reloaded.model, reloaded.dimension) == ("model-x", 3)
+
+
+def test_mismatched_model_or_dimension_is_rejected(index):
+    index.add([("a", [1.0, 0.0, 0.0])], "model-x")
+    with pytest.raises(ValueError, match="模型"):
+        index.add([("b", [0.0, 1.0, 0.0])], "model-y")
+    with pytest.raises(ValueError, match="维度"):
+        index.add([("b", [0.0, 1.0])], "model-x")
+    with pytest.raises(ValueError, match="维度"):
+        index.add([("b", [0.0, 1.0, 0.0]), ("c", [1.0])])
+    with pytest.raises(ValueError, match="模型"):
+        index.search([1.0, 0.0, 0.0], 1, "model-y")
+    with pytest.raises(ValueError, match="维度"):
+        index.search([1.0, 0.0], 1, "model-x")
+    assert index.search([1.0, 0.0, 0.0], 5, "model-x") == ([("a", pytest.approx(1.0))], 1)
+
+
+def test_legacy_file_without_header_infers_dimension(aisql, index):
+    with open(index.path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "a", "embedding": [1.0, 0.0]}) + "\n")
+    with pytest.raises(ValueError, match="维度"):
+        index.add([("b", [1.0, 0.0, 0.0])], "model-x")
+    assert index.add([("b", [0.0, 1.0])], "model-x") == (2, 2)
+    reloaded = aisql._VectorIndex(index.path)
+    reloaded.search([1.0, 0.0], 1)
+    assert reloaded.model == "model-x"
+
+
+def test_non_positive_top_k_is_rejected(aisql, index, monkeypatch, tmp_path):
+    index.add([("a", [1.0, 0.0])])
+    with pytest.raises(ValueError):
+        index.search([1.0, 0.0], 0)
+    monkeypatch.setenv("AISQL_INDEX_DIR", str(tmp_path))
+    result = json.loads(aisql.ai_image_index_search().evaluate("https://example.com/q.jpg", "items", "mock-key", 0))
+    assert result["error"] is True and "top_k" in result["message"]
+
+
+def test_index_add_takes_model_from_embedding_output(aisql, monkeypatch, tmp_path):
+    monkeypatch.setenv("AISQL_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(aisql, "_VECTOR_INDEXES", {})
+    first = {"image_url": "u1", "embedding": [1.0, 0.0], "model": "model-x"}
+    result = json.loads(aisql.ai_image_index_add().evaluate("catalog", json.dumps([first])))
+    assert result["model"] == "model-x" and result["dimension"] == 2
+    other = {"image_url": "u2", "embedding": [0.0, 1.0], "model": "model-y"}
+    result = json.loads(aisql.ai_image_index_add().evaluate("catalog", json.dumps([other])))
+    assert result["error"] is True
+    result = json.loads(aisql.ai_image_index_add().evaluate("catalog", json.dumps([first, other])))
+    assert result["error"] is True
@@ -24,7 +24,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '生成文本摘要。参数：text(必填)-需要摘要的文本,api_key(必填)-DashScope密钥,model_name(可选,默认qwen-plus)-模型名称,max_length(可选,默认200)-摘要最大字数。返回JSON:{summary:摘要内容,original_length:原文长度,model:使用的模型,timestamp:生成时间}。错误返回:{error:true,message:错误信息}。示例：SELECT public.ai_text_summarize(content,"api-key") FROM articles; SELECT public.ai_text_summarize(content,"api-key","qwen-max",150) FROM docs; 批量处理：SELECT doc_id,json_extract(public.ai_text_summarize(content,"api-key"),"$.summary") as summary FROM documents; 详细文档见docs/FUNCTION_REFERENCE.md';
+COMMENT '生成文本摘要。参数：text(必填)-需要摘要的文本,api_key(必填)-DashScope密钥,model_name(可选,默认qwen-plus)-模型名称,max_length(可选,默认200)-摘要最大字数,mode(可选,默认auto)-single/map_reduce/auto,长文本自动分块并发摘要后归并,chunk_tokens(可选,默认4000)-分块token预算,max_workers(可选,默认4)-分块并发数。返回JSON:{summary:摘要内容,original_length:原文长度,model:使用的模型,timestamp:生成时间}。错误返回:{error:true,message:错误信息}。示例：SELECT public.ai_text_summarize(content,"api-key") FROM articles; SELECT public.ai_text_summarize(content,"api-key","qwen-max",150) FROM docs; 批量处理：SELECT doc_id,json_extract(public.ai_text_summarize(content,"api-key"),"$.summary") as summary FROM documents; 详细文档见docs/FUNCTION_REFERENCE.md';
 
 -- 2. 多语言翻译
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_text_translate
@@ -46,7 +46,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '情感分析。参数：text(必填)-分析文本,api_key(必填)-DashScope密钥,model_name(可选,默认qwen-plus)。返回JSON:{sentiment:positive/negative/neutral,confidence:置信度,emotions:{joy:0.8,anger:0.1,sadness:0.05,fear:0.05},model:模型}。示例：SELECT public.ai_text_sentiment_analyze(review,"api-key") FROM feedback; SELECT feedback_id,json_extract(public.ai_text_sentiment_analyze(comment,"api-key"),"$.sentiment") as sentiment FROM reviews; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '情感分析。参数：text(必填)-分析文本,api_key(必填)-DashScope密钥,model_name(可选,默认qwen-plus),min_local_confidence(可选,默认0不启用)-本地情感词典预评分阈值,短文本本地置信度不低于该值时直接返回(model为local)不调用模型,建议0.8。返回JSON:{sentiment:positive/negative/neutral,confidence:置信度,emotions:{joy:0.8,anger:0.1,sadness:0.05,fear:0.05},model:模型}。示例：SELECT public.ai_text_sentiment_analyze(review,"api-key") FROM feedback; SELECT feedback_id,json_extract(public.ai_text_sentiment_analyze(comment,"api-key"),"$.sentiment") as sentiment FROM reviews; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 4. 实体信息提取
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_text_extract_entities
@@ -79,7 +79,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '文本分类。参数：text(必填)-待分类文本,api_key(必填)-DashScope密钥,categories(必填)-类别列表(逗号分隔如:科技,娱乐,体育),model_name(可选,默认qwen-plus)。返回JSON:{category:科技,confidence:0.92,all_scores:{科技:0.92,娱乐:0.05,体育:0.03},model:模型}。示例：SELECT public.ai_text_classify(content,"api-key","科技,金融,教育,娱乐") FROM news; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '文本分类。参数：text(必填)-待分类文本,api_key(必填)-DashScope密钥,categories(必填)-类别列表(逗号分隔如:科技,娱乐,体育),model_name(可选,默认qwen-plus),fast_model(可选,默认空)-级联路由的快速模型如qwen-turbo,先用其生成，JSON解析失败或confidence低于min_confidence时改用model_name重新生成,min_confidence(可选,默认0.8)-置信度阈值。返回JSON:{category:科技,confidence:0.92,all_scores:{科技:0.92,娱乐:0.05,体育:0.03},model:模型}。示例：SELECT public.ai_text_classify(content,"api-key","科技,金融,教育,娱乐") FROM news; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 7. 文本清洗和标准化
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_text_clean_normalize
@@ -90,7 +90,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '文本清洗标准化。参数：text(必填)-待清洗文本,api_key(必填)-DashScope密钥,operations(可选,默认all)-操作类型(all/remove_html/fix_spacing等),model_name(可选,默认qwen-plus)。返回JSON:{cleaned_text:清洗后文本,operations_applied:[remove_html,fix_spacing],changes_made:15,model:模型}。示例：SELECT public.ai_text_clean_normalize(raw_text,"api-key") FROM documents; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '文本清洗标准化。参数：text(必填)-待清洗文本,api_key(必填)-DashScope密钥,operations(可选,默认all)-逗号分隔的操作(all/remove_html/remove_control_chars/fullwidth_to_halfwidth/dedupe_punctuation/fix_spacing/normalize_unicode/remove_urls/remove_emails在本地执行，其他如拼写纠错交给模型),model_name(可选,默认qwen-plus),engine(可选,默认auto)-auto本地规则优先仅语义操作调用模型/local只用本地规则/llm全部交给模型。返回JSON:{cleaned_text:清洗后文本,operations_applied:[remove_html,fix_spacing],changes_count:15,engine:local}。示例：SELECT public.ai_text_clean_normalize(raw_text,"api-key") FROM documents; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 8. 自动标签生成
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_auto_tag_generate
@@ -158,7 +158,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '文档语义搜索。参数：query(必填)-搜索查询,documents_json(必填)-文档数组JSON[{id:1,text:内容}],api_key(必填)-DashScope密钥,top_k(可选,默认3)。返回JSON:{results:[{document:文档内容,score:0.92,highlights:[匹配片段1,匹配片段2]}]}。示例：SELECT public.ai_document_search("用户问题",json_array_agg(json_object("id",doc_id,"text",content)),"api-key") FROM docs; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '文档语义搜索。参数：query(必填)-搜索查询,documents_json(必填)-文档数组JSON[{id:1,text:内容}],api_key(必填)-DashScope密钥,top_k(可选,默认3),model_name(可选,默认text-embedding-v4),prefilter_top_n(可选,默认0)-大于0时先做BM25词法预筛选,仅对前N个候选做嵌入。返回JSON:{results:[{document:文档内容,score:0.92,highlights:[匹配片段1,匹配片段2]}]}。示例：SELECT public.ai_document_search("用户问题",json_array_agg(json_object("id",doc_id,"text",content)),"api-key") FROM docs; 详见docs/FUNCTION_REFERENCE.md';
 
 -- ==================== 多模态处理函数 (8个) ====================
 
@@ -171,7 +171,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '图片描述生成。参数：image_url(必填)-图片URL,api_key(必填)-DashScope密钥,prompt(可选)-自定义提示词,model_name(可选,默认qwen-vl-plus)。返回JSON:{description:图片描述,objects:[山,雪,天空,树木],scene:自然风景,model:模型}。示例：SELECT public.ai_image_describe(img_url,"api-key") FROM products; SELECT public.ai_image_describe(photo_url,"api-key","详细描述产品特征") FROM catalog; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '图片描述生成。参数：image_url(必填)-图片URL,api_key(必填)-DashScope密钥,prompt(可选)-自定义提示词,model_name(可选,默认qwen-vl-plus),preprocess(可选,默认none)-base64/file时本地下载并按任务缩放重编码后提交,use_cache(可选,默认false)-按图片内容和感知哈希缓存结果,不同URL的相同图片可复用。返回JSON:{description:图片描述,objects:[山,雪,天空,树木],scene:自然风景,model:模型}。示例：SELECT public.ai_image_describe(img_url,"api-key") FROM products; SELECT public.ai_image_describe(photo_url,"api-key","详细描述产品特征") FROM catalog; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 15. 图片OCR文字识别
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_image_ocr
@@ -182,7 +182,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '图片OCR识别。参数：image_url(必填)-图片URL,api_key(必填)-DashScope密钥,language(可选,默认中英混合)-识别语言,model_name(可选,默认qwen-vl-plus)。返回JSON:{text:识别文字,blocks:[{text:第一段,confidence:0.98},{text:第二段,confidence:0.95}],language:中文,model:模型}。示例：SELECT public.ai_image_ocr(receipt_img,"api-key") FROM invoices; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '图片OCR识别。参数：image_url(必填)-图片URL,api_key(必填)-DashScope密钥,language(可选,默认中英混合)-识别语言,model_name(可选,默认qwen-vl-plus),preprocess(可选,默认none)-base64/file时本地下载并按任务缩放重编码后提交,use_cache(可选,默认false)-按图片内容和感知哈希缓存结果,不同URL的相同图片可复用,min_text_score(可选,默认0)-大于0时本地估计文字区域占比,低于该值直接返回空文字不调用模型,low_text_model(可选,默认空)-非空时低于阈值的图片改用该模型识别,tile_size(可选,默认0)-大于0时超过该尺寸的大图切成重叠的全宽横条(最多16条,过宽时先缩小)并发识别后去重合并,max_workers(可选,默认4)-分块并发数。返回JSON:{text:识别文字,blocks:[{text:第一段,confidence:0.98},{text:第二段,confidence:0.95}],language:中文,model:模型}。示例：SELECT public.ai_image_ocr(receipt_img,"api-key") FROM invoices; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 16. 图片智能分析
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_image_analyze
@@ -193,7 +193,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '图片智能分析。参数：image_url(必填)-图片URL,api_key(必填)-DashScope密钥,analysis_type(可选,默认general)-分析类型(general/objects/scene/people/text),model_name(可选,默认qwen-vl-plus)。返回JSON:{analysis:分析结果,analysis_type:分析类型,image_url:图片地址,model:模型}。示例：SELECT public.ai_image_analyze(photo,"api-key","objects") FROM gallery; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '图片智能分析。参数：image_url(必填)-图片URL,api_key(必填)-DashScope密钥,analysis_type(可选,默认general)-分析类型(general/objects/scene/people/text),model_name(可选,默认qwen-vl-plus),preprocess(可选,默认none)-base64/file时本地下载并按任务缩放重编码后提交,use_cache(可选,默认false)-按图片内容和感知哈希缓存结果,不同URL的相同图片可复用。返回JSON:{analysis:分析结果,analysis_type:分析类型,image_url:图片地址,model:模型}。示例：SELECT public.ai_image_analyze(photo,"api-key","objects") FROM gallery; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 17. 图片转向量
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_image_to_embedding
@@ -204,7 +204,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '图片转向量。参数：image_url(必填)-图片URL,api_key(必填)-DashScope密钥,model_name(可选,默认multimodal-embedding-one-peace-v1)。返回JSON:{embedding:[0.1,...],dimension:1024,image_url:图片地址,model:模型}。示例：CREATE TABLE image_vectors AS SELECT img_id,public.ai_image_to_embedding(url,"api-key") as vector FROM images; 用于图片相似搜索。详见docs/FUNCTION_REFERENCE.md';
+COMMENT '图片转向量。参数：image_url(必填)-图片URL,api_key(必填)-DashScope密钥,model_name(可选,默认multimodal-embedding-one-peace-v1),use_cache(可选,默认false)-按图片内容和感知哈希缓存结果,不同URL的相同图片可复用。返回JSON:{embedding:[0.1,...],dimension:1024,image_url:图片地址,model:模型}。示例：CREATE TABLE image_vectors AS SELECT img_id,public.ai_image_to_embedding(url,"api-key") as vector FROM images; 用于图片相似搜索。详见docs/FUNCTION_REFERENCE.md';
 
 -- 18. 图片相似度计算
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_image_similarity
@@ -226,7 +226,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '视频内容摘要。参数：video_frames_json(必填)-视频帧URL数组JSON,api_key(必填)-DashScope密钥,model_name(可选,默认qwen-vl-plus)。返回JSON:{summary:视频摘要,frame_count:帧数量,model:模型}。示例：SELECT public.ai_video_summarize(json_array(frame1_url,frame2_url,frame3_url),"api-key") FROM videos; 建议提取3-10个关键帧。详见docs/FUNCTION_REFERENCE.md';
+COMMENT '视频内容摘要。参数：video_frames_json(必填)-视频帧URL数组JSON,api_key(必填)-DashScope密钥,model_name(可选,默认qwen-vl-plus),max_frames(可选,默认0)-大于0时本地去除近似重复帧并最多保留该数量的关键帧,dedup_threshold(可选,默认6)-重复帧dHash距离阈值。返回JSON:{summary:视频摘要,frame_count:帧数量,model:模型}。示例：SELECT public.ai_video_summarize(json_array(frame1_url,frame2_url,frame3_url),"api-key") FROM videos; 建议提取3-10个关键帧。详见docs/FUNCTION_REFERENCE.md';
 
 -- 20. 图表智能分析
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_chart_analyze
@@ -237,7 +237,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '图表智能分析。参数：chart_image_url(必填)-图表图片URL,api_key(必填)-DashScope密钥,analysis_focus(可选,默认data)-分析重点(data/trend/comparison/insight),model_name(可选,默认qwen-vl-plus)。返回JSON:{analysis:分析结果,focus:分析重点,chart_url:图表地址,model:模型}。示例：SELECT public.ai_chart_analyze(chart_url,"api-key","trend") FROM reports; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '图表智能分析。参数：chart_image_url(必填)-图表图片URL,api_key(必填)-DashScope密钥,analysis_focus(可选,默认data)-分析重点(data/trend/comparison/insight),model_name(可选,默认qwen-vl-plus),preprocess(可选,默认none)-base64/file时本地下载并按任务缩放重编码后提交。返回JSON:{analysis:分析结果,focus:分析重点,chart_url:图表地址,model:模型}。示例：SELECT public.ai_chart_analyze(chart_url,"api-key","trend") FROM reports; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 21. 文档智能解析
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_document_parse
@@ -248,7 +248,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '文档智能解析。参数：doc_images_json(必填)-文档页面图片URL数组JSON,api_key(必填)-DashScope密钥,parse_type(可选,默认structure)-解析类型(structure/content/table/form),model_name(可选,默认qwen-vl-plus)。返回JSON:{parsed_content:解析内容,parse_type:解析类型,page_count:页数,model:模型}。示例：SELECT public.ai_document_parse(json_array(page1,page2),"api-key","table") FROM docs; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '文档智能解析。参数：doc_images_json(必填)-文档页面图片URL数组JSON,api_key(必填)-DashScope密钥,parse_type(可选,默认structure)-解析类型(structure/content/table/form),model_name(可选,默认qwen-vl-plus),mode(可选,默认single)-per_page时逐页并发解析并按页码拼接,max_workers(可选,默认4),merge_model(可选)-非空时用该文本模型合并跨页表格,tile_size(可选,默认0)-大于0时超过该尺寸的页面切成重叠的全宽横条,所有横条并发识别后逐页合并。返回JSON:{parsed_content:解析内容,parse_type:解析类型,page_count:页数,model:模型}。示例：SELECT public.ai_document_parse(json_array(page1,page2),"api-key","table") FROM docs; 详见docs/FUNCTION_REFERENCE.md';
 
 -- ==================== 业务场景函数 (9个) ====================
 
@@ -261,7 +261,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '客户意图分析。参数：customer_text(必填)-客户对话文本,api_key(必填)-DashScope密钥,context(可选,默认customer_service)-业务场景,model_name(可选,默认qwen-plus)。返回JSON:{intent:complaint,sub_intents:[refund,quality_issue],urgency:high,sentiment:negative,recommended_action:escalate_to_manager,confidence:0.89}。示例：SELECT public.ai_customer_intent_analyze(feedback,"api-key") FROM tickets; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '客户意图分析。参数：customer_text(必填)-客户对话文本,api_key(必填)-DashScope密钥,context(可选,默认customer_service)-业务场景,model_name(可选,默认qwen-plus),fast_model(可选,默认空)-级联路由的快速模型如qwen-turbo,先用其生成，JSON解析失败或confidence低于min_confidence时改用model_name重新生成,min_confidence(可选,默认0.8)-置信度阈值。返回JSON:{intent:complaint,sub_intents:[refund,quality_issue],urgency:high,sentiment:negative,recommended_action:escalate_to_manager,confidence:0.89}。示例：SELECT public.ai_customer_intent_analyze(feedback,"api-key") FROM tickets; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 23. 销售线索评分
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_sales_lead_score
@@ -294,7 +294,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '风险文本检测。参数：text(必填)-待检测文本,api_key(必填)-DashScope密钥,risk_types(可选,默认all)-风险类型(all/violence/fraud/sensitive等),model_name(可选,默认qwen-plus)。返回JSON:{risk_level:低/中/高,risk_types:[],risk_details:{},confidence:0.95,safe:true/false}。示例：SELECT content,public.ai_risk_text_detect(content,"api-key") as risk FROM user_posts WHERE status="pending"; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '风险文本检测。参数：text(必填)-待检测文本,api_key(必填)-DashScope密钥,risk_types(可选,默认all)-风险类型(all/violence/fraud/sensitive等),model_name(可选,默认qwen-plus),fast_model(可选,默认空)-级联路由的快速模型如qwen-turbo,先用其生成，JSON解析失败或confidence低于min_confidence时改用model_name重新生成,min_confidence(可选,默认0.8)-置信度阈值,prefilter_threshold(可选,默认0不启用)-本地风险词典预筛阈值,词典无命中且启发式得分低于该值时直接返回risk_level:none不调用模型,confidence固定为0.9(仅限risk_types都属于词典类别,all需词典声明_covers_all),建议0.3。返回JSON:{risk_level:低/中/高,risk_types:[],risk_details:{},confidence:0.95,safe:true/false}。示例：SELECT content,public.ai_risk_text_detect(content,"api-key") as risk FROM user_posts WHERE status="pending"; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 26. 合同信息提取
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_contract_extract
@@ -305,7 +305,7 @@ WITH PROPERTIES (
     'remote.udf.api' = 'python3.mc.v0',
     'remote.udf.protocol' = 'http.arrow.v0'
 )
-COMMENT '合同信息提取。参数：contract_text(必填)-合同文本,api_key(必填)-DashScope密钥,extract_fields(可选,默认all)-提取字段(all/parties/amount/date/terms等),model_name(可选,默认qwen-plus)。返回JSON:{parties:[甲方,乙方],amount:100万,date:{start:2025-01-01,end:2025-12-31},terms:[条款1,条款2],obligations:{甲方:[],乙方:[]}}。示例：SELECT public.ai_contract_extract(content,"api-key","parties,amount") FROM contracts; 详见docs/FUNCTION_REFERENCE.md';
+COMMENT '合同信息提取。参数：contract_text(必填)-合同文本,api_key(必填)-DashScope密钥,extract_fields(可选,默认all)-提取字段(all/parties/amount/date/terms等),model_name(可选,默认qwen-plus),mode(可选,默认single)-single/chunked/auto,chunked/auto时长合同按条款分块并发提取后合并,chunk_tokens(可选,默认3000),max_workers(可选,默认4)。返回JSON:{parties:[甲方,乙方],amount:100万,date:{start:2025-01-01,end:2025-12-31},terms:[条款1,条款2],obligations:{甲方:[],乙方:[]}}。示例：SELECT public.ai_contract_extract(content,"api-key","parties,amount") FROM contracts; 详见docs/FUNCTION_REFERENCE.md';
 
 -- 27. 简历智能解析
 CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_resume_parse
@@ -351,6 +351,79 @@ WITH PROPERTIES (
 )
 COMMENT '行业分类识别(原bailian_llm兼容函数)。参数：text(必填)-待分类文本,prompt(必填)-分类提示词,api_key(必填)-DashScope密钥,model_name(必填)-模型名称,temperature(可选,默认0.7),enable_search(可选,默认false)。返回JSON格式分类结果。示例：SELECT public.ai_industry_classification(company_desc,"请根据企业描述判断所属行业，返回JSON格式{一级行业:xxx,二级行业:xxx}","api-key","qwen-plus") FROM companies; 详见docs/FUNCTION_REFERENCE.md';
 
+-- ==================== 本地扩展函数 ====================
+-- 以下函数在本地计算，不调用DashScope API
+
+-- 31. 文本MinHash签名
+CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_text_minhash
+AS 'ai_functions_complete.ai_text_minhash'
+USING ARCHIVE 'volume://external_functions_prod/clickzetta_ai_functions_full.zip'
+CONNECTION ai_function_connection
+WITH PROPERTIES (
+    'remote.udf.api' = 'python3.mc.v0',
+    'remote.udf.protocol' = 'http.arrow.v0'
+)
+COMMENT '文本MinHash签名(本地计算,无API调用)。参数：text(必填)-文本,num_perm(可选,默认128)-签名长度,threshold(可选,默认0.8)-目标Jaccard阈值,shingle_size(可选,默认3)-shingle单元数(中文按字,英文按词)。返回JSON:{signature:[...],band_keys:[b00_1a2b3c4d,...],bands:9,rows:13,num_perm:128,shingle_count:20,text_length:30}。示例：大规模去重时展开band_keys后按键自连接得到候选对：SELECT id,public.ai_text_minhash(content) FROM reviews; 详见docs/FUNCTION_REFERENCE.md';
+
+-- 32. 近似重复文本分组
+CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_text_near_duplicates
+AS 'ai_functions_complete.ai_text_near_duplicates'
+USING ARCHIVE 'volume://external_functions_prod/clickzetta_ai_functions_full.zip'
+CONNECTION ai_function_connection
+WITH PROPERTIES (
+    'remote.udf.api' = 'python3.mc.v0',
+    'remote.udf.protocol' = 'http.arrow.v0'
+)
+COMMENT '近似重复文本分组(MinHash+LSH,本地计算,无API调用)。参数：texts_json(必填)-文本数组JSON或[{id:1,text:内容}],threshold(可选,默认0.8)-判定重复的Jaccard阈值,ambiguous_threshold(可选,默认0.5)-模糊区间下限,shingle_size(可选,默认3),num_perm(可选,默认128)。返回JSON:{groups:[{group_id:0,representative:1,ids:[1,5],size:2}],ambiguous_pairs:[{id1:2,id2:7,jaccard:0.62}],total_texts:100,unique_count:90,duplicate_count:10}。ambiguous_pairs可再交给ai_semantic_similarity确认。示例：SELECT public.ai_text_near_duplicates(json_array_agg(json_object("id",review_id,"text",content))) FROM reviews GROUP BY product_id; 详见docs/FUNCTION_REFERENCE.md';
+
+-- ==================== 批量图片向量函数 ====================
+
+-- 33. 批量图片转向量
+CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_image_batch_embedding
+AS 'ai_functions_complete.ai_image_batch_embedding'
+USING ARCHIVE 'volume://external_functions_prod/clickzetta_ai_functions_full.zip'
+CONNECTION ai_function_connection
+WITH PROPERTIES (
+    'remote.udf.api' = 'python3.mc.v0',
+    'remote.udf.protocol' = 'http.arrow.v0'
+)
+COMMENT '批量图片转向量。参数：image_urls_json(必填)-图片URL数组JSON,api_key(必填)-DashScope密钥,model_name(可选,默认multimodal-embedding-one-peace-v1),max_workers(可选,默认4)-并发请求数。支持多图请求的模型按批发送,重复URL只生成一次向量。返回JSON:{embeddings:[{image_url:url,embedding:[...]}],count:10,dimension:1536,model:模型}。示例：SELECT public.ai_image_batch_embedding(json_array_agg(image_url),"api-key") FROM products GROUP BY category; 详见docs/FUNCTION_REFERENCE.md';
+
+-- 34. 图片两两相似度矩阵
+CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_image_similarity_matrix
+AS 'ai_functions_complete.ai_image_similarity_matrix'
+USING ARCHIVE 'volume://external_functions_prod/clickzetta_ai_functions_full.zip'
+CONNECTION ai_function_connection
+WITH PROPERTIES (
+    'remote.udf.api' = 'python3.mc.v0',
+    'remote.udf.protocol' = 'http.arrow.v0'
+)
+COMMENT '图片两两相似度矩阵。参数：image_urls_json(必填)-图片URL数组JSON,api_key(必填)-DashScope密钥,model_name(可选,默认multimodal-embedding-one-peace-v1),max_workers(可选,默认4)。每张图片只生成一次向量,相似度在本地计算。返回JSON:{matrix:[[1.0,0.82],[0.82,1.0]],image_urls:[...],count:2,model:模型}。示例：SELECT public.ai_image_similarity_matrix(json_array_agg(image_url),"api-key") FROM products GROUP BY sku_group; 详见docs/FUNCTION_REFERENCE.md';
+
+-- ==================== 图片向量索引函数 ====================
+
+-- 35. 写入图片向量索引
+CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_image_index_add
+AS 'ai_functions_complete.ai_image_index_add'
+USING ARCHIVE 'volume://external_functions_prod/clickzetta_ai_functions_full.zip'
+CONNECTION ai_function_connection
+WITH PROPERTIES (
+    'remote.udf.api' = 'python3.mc.v0',
+    'remote.udf.protocol' = 'http.arrow.v0'
+)
+COMMENT '写入图片向量索引(本地计算,不调用API)。参数：index_name(必填)-索引名称(字母数字下划线短横线),items_json(必填)-[{id:sku1,embedding:[...]}]数组JSON,也可直接传ai_image_to_embedding的输出(以image_url为id),model_name(可选,默认取输出中的model字段)-向量模型。同一id重复写入时覆盖;索引头部记录模型和维度,不一致时返回错误。返回JSON:{index_name:catalog,added:100,size:5000,dimension:1536,model:模型}。示例：SELECT public.ai_image_index_add("catalog",json_array_agg(json_object("id",sku,"embedding",embedding))) FROM product_embeddings; 详见docs/FUNCTION_REFERENCE.md';
+
+-- 36. 以图搜图
+CREATE EXTERNAL FUNCTION IF NOT EXISTS ai_image_index_search
+AS 'ai_functions_complete.ai_image_index_search'
+USING ARCHIVE 'volume://external_functions_prod/clickzetta_ai_functions_full.zip'
+CONNECTION ai_function_connection
+WITH PROPERTIES (
+    'remote.udf.api' = 'python3.mc.v0',
+    'remote.udf.protocol' = 'http.arrow.v0'
+)
+COMMENT '以图搜图。参数：query_image_url(必填)-查询图片URL,index_name(必填)-索引名称,api_key(必填)-DashScope密钥,top_k(可选,默认10,须为正整数),model_name(可选,默认multimodal-embedding-one-peace-v1,需与建索引时一致,不一致时返回错误)。只为查询图片生成一次向量,在本地索引中计算余弦相似度。返回JSON:{results:[{id:sku1,score:0.93}],query_image:url,index_name:catalog,index_size:5000,model:模型}。示例：SELECT public.ai_image_index_search(image_url,"catalog","api-key",5) FROM new_uploads; 详见docs/FUNCTION_REFERENCE.md';
+
 -- ==================== 部署完成提示 ====================
 -- 30个AI函数部署完成！
 -- 请确保：